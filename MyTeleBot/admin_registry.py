@@ -0,0 +1,183 @@
+"""
+In-memory registry of chat administrators with TTL refresh and event invalidation
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from telegram import ChatMember, ChatMemberUpdated
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+ADMIN_STATUSES = (ChatMember.ADMINISTRATOR, ChatMember.OWNER)
+GONE_STATUSES = (ChatMember.LEFT, ChatMember.BANNED)
+
+
+class AdminRegistry:
+    """Caches get_chat_administrators results per chat.
+
+    Lookups never touch the network. A chat that is unknown or whose entry
+    is older than the TTL gets a background refresh; concurrent callers for
+    the same chat share one in-flight fetch. At most `max_chats` chats are
+    kept, least recently touched evicted first, and a chat the bot has left
+    is dropped at once.
+    """
+
+    def __init__(self, ttl: float = 600.0, on_refresh: Optional[Callable[[int, Set[int]], None]] = None,
+                 max_chats: int = 10000):
+        self.ttl = ttl
+        self.on_refresh = on_refresh
+        self.max_chats = max_chats
+        self._admins: "OrderedDict[int, Set[int]]" = OrderedDict()
+        self._fetched_at: Dict[int, float] = {}
+        self._inflight: Dict[int, asyncio.Task] = {}
+        # Admin lists from the last shutdown's snapshot, seeded (as stale) on first access
+        self.snapshot = None
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.errors = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def is_admin(self, chat_id: int, user_id: int) -> bool:
+        """Answer from memory only; unknown chats report no admins."""
+        if chat_id not in self._admins:
+            self._restore(chat_id)
+        return user_id in self._admins.get(chat_id, ())
+
+    def get_admins(self, chat_id: int) -> Set[int]:
+        if chat_id not in self._admins:
+            self._restore(chat_id)
+        return self._admins.get(chat_id, set())
+
+    def _restore(self, chat_id: int):
+        if self.snapshot is not None:
+            admin_ids = self.snapshot.take(chat_id)
+            if admin_ids is not None:
+                self.seed(chat_id, set(admin_ids))
+
+    def touch(self, chat_id: int, bot) -> None:
+        """
+        Record an access for a chat and schedule a refresh if it is missing or stale
+
+        Only a fresh entry counts as a hit; a stale one is a miss even though
+        its (old) admin list is still served until the refresh lands.
+
+        Args:
+            chat_id: Telegram chat ID
+            bot: Bot instance used to call get_chat_administrators
+        """
+        if chat_id in self._admins:
+            self._admins.move_to_end(chat_id)
+        else:
+            self._restore(chat_id)
+        fetched_at = self._fetched_at.get(chat_id)
+        if fetched_at is not None and time.monotonic() - fetched_at < self.ttl:
+            self.hits += 1
+            return
+        self.misses += 1
+        self._schedule_fetch(chat_id, bot)
+
+    async def fetch(self, chat_id: int, bot) -> Set[int]:
+        """
+        Fetch the admin list now, joining any fetch already in flight
+
+        Args:
+            chat_id: Telegram chat ID
+            bot: Bot instance used to call get_chat_administrators
+
+        Returns:
+            Set of admin user IDs (possibly stale if the fetch failed)
+        """
+        task = self._schedule_fetch(chat_id, bot)
+        await asyncio.shield(task)
+        return self.get_admins(chat_id)
+
+    def _schedule_fetch(self, chat_id: int, bot) -> asyncio.Task:
+        task = self._inflight.get(chat_id)
+        if task is None:
+            task = asyncio.create_task(self._refresh(chat_id, bot))
+            self._inflight[chat_id] = task
+        return task
+
+    async def _refresh(self, chat_id: int, bot):
+        try:
+            with REGISTRY.timer("admin_fetch"):
+                admins = await bot.get_chat_administrators(chat_id)
+            self._store(chat_id, {admin.user.id for admin in admins}, time.monotonic())
+            self.refreshes += 1
+            if self.on_refresh is not None:
+                self.on_refresh(chat_id, self._admins[chat_id])
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Failed to fetch admin list for chat {chat_id}: {e}")
+        finally:
+            self._inflight.pop(chat_id, None)
+
+    def seed(self, chat_id: int, admin_ids: Set[int]):
+        """Preload a chat's admins (e.g. from disk) as stale, so the next access refreshes them."""
+        self._store(chat_id, set(admin_ids), float("-inf"))
+
+    def _store(self, chat_id: int, admin_ids: Set[int], fetched_at: float):
+        self._admins[chat_id] = admin_ids
+        self._admins.move_to_end(chat_id)
+        self._fetched_at[chat_id] = fetched_at
+        while len(self._admins) > self.max_chats:
+            old_id, _ = self._admins.popitem(last=False)
+            self._fetched_at.pop(old_id, None)
+            self.evictions += 1
+
+    def invalidate(self, chat_id: int):
+        """Mark a chat as stale so the next access triggers a refresh."""
+        if chat_id in self._fetched_at:
+            self._fetched_at[chat_id] = float("-inf")
+            self.invalidations += 1
+
+    def apply_member_update(self, member_update: Optional[ChatMemberUpdated], bot_id: Optional[int] = None):
+        """
+        Apply a ChatMemberUpdated event to the cached admin set and invalidate it
+
+        Args:
+            member_update: update.chat_member or update.my_chat_member
+            bot_id: The bot's own user ID; an update saying it left or was removed forgets the chat
+        """
+        if member_update is None:
+            return
+        chat_id = member_update.chat.id
+        member = member_update.new_chat_member
+        if bot_id is not None and member.user.id == bot_id and member.status in GONE_STATUSES:
+            self.forget(chat_id)
+            return
+        admins = self._admins.get(chat_id)
+        if admins is not None:
+            if member.status in ADMIN_STATUSES:
+                admins.add(member.user.id)
+            else:
+                admins.discard(member.user.id)
+        self.invalidate(chat_id)
+
+    def forget(self, chat_id: int):
+        self._admins.pop(chat_id, None)
+        self._fetched_at.pop(chat_id, None)
+
+    def snapshot_items(self) -> Iterator[Tuple[int, List[int]]]:
+        for chat_id, admin_ids in self._admins.items():
+            yield chat_id, sorted(admin_ids)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "chats": len(self._admins),
+            "hits": self.hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "errors": self.errors,
+            "invalidations": self.invalidations,
+            "evictions": self.evictions,
+            "inflight": len(self._inflight),
+        }
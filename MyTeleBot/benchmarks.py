@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+"""
+Offline micro-benchmarks for the Siege bot hot paths
+
+Run a single benchmark with `python benchmarks.py <name>` or all of them
+with `python benchmarks.py all`. Nothing here touches the network.
+"""
+
+import argparse
+import asyncio
+import logging
+import statistics
+import time
+
+
+class FakeSentMessage:
+    """Stands in for the Message returned by reply_text."""
+
+    def __init__(self, log):
+        self.log = log
+
+    async def edit_text(self, text):
+        self.log.append(("edit", time.perf_counter(), text))
+
+
+class FakeMessage:
+    """Stands in for update.message; records when each send happens."""
+
+    def __init__(self):
+        self.log = []
+
+    async def reply_text(self, text):
+        self.log.append(("send", time.perf_counter(), text))
+        return FakeSentMessage(self.log)
+
+
+async def fake_token_stream(tokens, token_delay):
+    for token in tokens:
+        await asyncio.sleep(token_delay)
+        yield token
+
+
+def _summary(samples):
+    samples = sorted(samples)
+    return {
+        "p50_ms": round(statistics.median(samples) * 1000, 2),
+        "max_ms": round(samples[-1] * 1000, 2),
+    }
+
+
+async def bench_streaming(runs=5, tokens=60, token_delay=0.01):
+    """Time to first byte: buffered reply_text vs progressive streaming edits."""
+    from streaming import StreamingReply
+
+    words = [f"word{i} " for i in range(tokens)]
+    buffered, streamed, edits = [], [], []
+    for _ in range(runs):
+        message = FakeMessage()
+        start = time.perf_counter()
+        text = "".join([chunk async for chunk in fake_token_stream(words, token_delay)])
+        await message.reply_text(text.strip())
+        buffered.append(message.log[0][1] - start)
+
+        message = FakeMessage()
+        reply = StreamingReply(message, lambda text: text, edit_interval=0.1)
+        # first_byte_at is on the monotonic clock, as the bot measures it
+        start = time.monotonic()
+        await reply.run(fake_token_stream(words, token_delay))
+        streamed.append(reply.first_byte_at - start)
+        edits.append(reply.edits)
+
+    print(f"streaming: {tokens} tokens @ {token_delay * 1000:.0f} ms/token, {runs} runs")
+    print(f"  buffered  TTFB {_summary(buffered)}")
+    print(f"  streaming TTFB {_summary(streamed)}  edits/reply={statistics.mean(edits):.1f}")
+
+
+def _time_per_call(fn, runs):
+    start = time.perf_counter()
+    for _ in range(runs):
+        fn()
+    return (time.perf_counter() - start) / runs * 1e6
+
+
+async def bench_prompt(runs=2000):
+    """Prompt construction: legacy full f-string vs budgeted builder (estimate and real tokenizer)."""
+    from tokenizers import Tokenizer, models, pre_tokenizers, trainers
+    from personality import PERSONA_PREFIX, SiegePersonality
+    from prompt_builder import PromptBuilder, TokenCounter
+
+    personality = SiegePersonality()
+    message = "hey siege what do you think about napoleon and the battle of austerlitz?"
+    facts = ["Napoleon Bonaparte was a French military leader.", "Current time: 09:00 PM EDT"]
+    history = [f"earlier message number {i} about warhammer and cats" for i in range(10)]
+
+    # A small BPE trained on the persona and the sample messages exercises the real tokenizers
+    # path offline; its vocabulary covers these words as a production tokenizer's would
+    tokenizer = Tokenizer(models.BPE(unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+    corpus = [PERSONA_PREFIX, personality.create_prompt_tail(message, "alice", tool_results=facts, history=history)]
+    tokenizer.train_from_iterator(corpus * 10, trainers.BpeTrainer(vocab_size=2000, special_tokens=["[UNK]"]))
+    real_counter = TokenCounter()
+    real_counter._tokenizer, real_counter._loaded = tokenizer, True
+
+    print(f"prompt: {runs} builds")
+    legacy = _time_per_call(lambda: personality.create_prompt(message, "alice", tool_results=facts, history=history), runs)
+    print(f"  create_prompt (no budget)      {legacy:8.1f} us/build")
+    # 1200 fits as sized from length; 600 forces exact counting and trimming
+    for name, counter, budget in (("estimate", TokenCounter(), 1200), ("tokenizers BPE", real_counter, 1200),
+                                  ("estimate", TokenCounter(), 600), ("tokenizers BPE", real_counter, 600)):
+        builder = PromptBuilder(personality, counter, budget=budget)
+        builder.build(message, "alice")
+        per_call = _time_per_call(lambda: builder.build(message, "alice", tool_results=facts, history=history), runs)
+        _, tokens = builder.build(message, "alice", tool_results=facts, history=history)
+        exact = counter.count(builder.build(message, "alice", tool_results=facts, history=history)[0])
+        print(f"  PromptBuilder ({name:<14}, budget {budget}) {per_call:8.1f} us/build, {tokens} tokens reported, "
+              f"{exact} exact (prefix {builder.prefix_tokens}) {builder.stats()}")
+
+
+async def bench_state(users=2000, messages=20000):
+    """Per-message state updates: in-memory store vs SQLite write-behind (including the final flush)."""
+    import os
+    import tempfile
+    from state_store import SQLiteStateStore, StateStore
+
+    print(f"state: {messages} messages from {users} users")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, store in (("memory", StateStore()),
+                            ("sqlite", SQLiteStateStore(os.path.join(tmp, "state.sqlite"), flush_interval=0.5))):
+            await store.start()
+            start = time.perf_counter()
+            for i in range(messages):
+                user_id = i % users
+                await store.load_user(user_id)
+                store.remember_user(user_id, f"user{user_id}")
+                store.append_history(user_id, f"message number {i}")
+                if i % 100 == 0:
+                    await asyncio.sleep(0)
+            await store.close()
+            elapsed = time.perf_counter() - start
+            print(f"  {name:<7} {messages / elapsed:10.0f} msg/s  {store.stats()}")
+
+
+async def bench_snapshot(users=10000, responses=2048):
+    """Warm restart: snapshot write/open time and size, restore cost, cache hit ratio right after a restart."""
+    import os
+    import tempfile
+    from response_cache import ResponseCache
+    from snapshot import Snapshot, merge, write_snapshot
+    from state_store import StateStore
+
+    def fill():
+        store, cache = StateStore(max_users=users), ResponseCache(maxsize=responses)
+        for user_id in range(users):
+            store.remember_user(user_id, f"user{user_id}")
+            for i in range(10):
+                store.append_history(user_id, f"message number {i} from user {user_id}")
+        for i in range(responses):
+            cache.put(f"question {i}", "group", "chat", "user", f"answer {i} for user")
+        return store, cache
+
+    def replay(cache):
+        return sum(cache.get(f"question {i}", "group", "chat", "user") is not None for i in range(responses))
+
+    print(f"snapshot: {users} users with 10 history lines, {responses} cached replies")
+    store, cache = fill()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "snapshot.bin")
+        start = time.perf_counter()
+        size = write_snapshot(path, {
+            "users": merge(store.snapshot_items(), None, users),
+            "responses": merge(cache.snapshot_items(), None, responses),
+        })
+        print(f"  write    {(time.perf_counter() - start) * 1000:8.1f} ms  {size / 1024:.0f} KiB")
+        start = time.perf_counter()
+        snapshot = Snapshot.open(path)
+        print(f"  open     {(time.perf_counter() - start) * 1000:8.3f} ms")
+
+        restored = StateStore(max_users=users)
+        restored.snapshot = snapshot.section("users")
+        start = time.perf_counter()
+        for user_id in range(0, users, 7):
+            await restored.load_user(user_id)
+        print(f"  restore  {(time.perf_counter() - start) / len(range(0, users, 7)) * 1e6:8.1f} us/user")
+
+        cold, warm = ResponseCache(maxsize=responses), ResponseCache(maxsize=responses)
+        warm.snapshot = snapshot.section("responses")
+        print(f"  replayed questions answered from cache: cold {replay(cold) / responses:.0%}, "
+              f"after restart {replay(warm) / responses:.0%}")
+        snapshot.close()
+
+
+async def bench_resilience(calls=400, concurrency=20):
+    """LLM call path against a flaky fake backend: plain vs retries vs retries + hedging."""
+    from fake_llm import FakeLLMBackend
+    from resilience import CircuitBreaker, LLMUnavailable, ResilientLLM
+
+    logging.getLogger("resilience").setLevel(logging.ERROR)
+    print(f"resilience: {calls} calls, fake backend 100 ms, 5% slow (x10), 5% 503s")
+    configs = (
+        ("plain", dict(retries=0)),
+        ("retries", dict(retries=2, base_delay=0.05)),
+        ("retries+hedge", dict(retries=2, base_delay=0.05, hedge=True)),
+    )
+    for name, options in configs:
+        backend = FakeLLMBackend(latency=0.1, error_rate=0.05, slow_rate=0.05, seed=7)
+        llm = ResilientLLM(backend, timeout=3.0, breaker=CircuitBreaker(failure_threshold=50), **options)
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies, failures = [], 0
+
+        async def one():
+            nonlocal failures
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    await llm.generate("prompt")
+                except LLMUnavailable:
+                    failures += 1
+                    return
+                latencies.append(time.perf_counter() - start)
+
+        await asyncio.gather(*(one() for _ in range(calls)))
+        latencies.sort()
+        print(f"  {name:<14} ok={len(latencies) / calls:.1%} {_summary(latencies)} "
+              f"p99_ms={latencies[int(0.99 * (len(latencies) - 1))] * 1000:.1f} backend_calls={backend.calls}")
+
+
+def _traced_bytes(fill):
+    import gc
+    import tracemalloc
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = fill()
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del kept
+    return used
+
+
+async def bench_math(runs=2000):
+    """safe_math vs eval on everyday sums, and worst-case time on hostile input."""
+    import safe_math
+
+    print(f"math: {runs} evaluations per expression")
+    for expression in ("12*7", "(3+4)*2.5 - 1/3", "2**10 + 15/4"):
+        unsafe = _time_per_call(lambda: eval(expression, {"__builtins__": {}}, {}), runs)
+        safe = _time_per_call(lambda: safe_math.evaluate(expression), runs)
+        print(f"  {expression:<18} eval {unsafe:7.1f} us   safe_math {safe:7.1f} us")
+
+    worst = 0.0
+    for expression in safe_math.HOSTILE:
+        started = time.perf_counter()
+        try:
+            outcome = f"= {safe_math.evaluate(expression)}"[:30]
+        except safe_math.MathError as e:
+            outcome = f"rejected ({e})"[:60]
+        elapsed = time.perf_counter() - started
+        worst = max(worst, elapsed)
+        print(f"  {expression[:24]:<24} {elapsed * 1000:7.3f} ms  {outcome}")
+    print(f"  worst case {worst * 1000:.3f} ms (limit {safe_math.DEFAULT_LIMITS.time_limit * 1000:.0f} ms); "
+          f"`python safe_math.py check` fails on any regression")
+
+    # Longest gap between ticks of a 1 ms heartbeat while 200 powers are evaluated concurrently
+    stall = 0.0
+
+    async def heartbeat():
+        nonlocal stall
+        last = time.perf_counter()
+        while True:
+            await asyncio.sleep(0.001)
+            now = time.perf_counter()
+            stall, last = max(stall, now - last), now
+
+    beat = asyncio.create_task(heartbeat())
+    await asyncio.sleep(0)
+    started = time.perf_counter()
+    results = await asyncio.gather(
+        *(safe_math.evaluate_async(f"{n}**{n % 300}") for n in range(200)), return_exceptions=True
+    )
+    elapsed = time.perf_counter() - started
+    beat.cancel()
+    rejected = sum(isinstance(result, safe_math.MathError) for result in results)
+    print(f"  200 async powers ({rejected} rejected) in {elapsed * 1000:.1f} ms, "
+          f"longest event loop stall {stall * 1000:.1f} ms")
+
+
+async def bench_knowledge(runs=20000):
+    """Local fact lookups: per-call element dict vs the prebuilt index (exact, prefix, fuzzy)."""
+    import knowledge
+    from personality import SiegePersonality
+
+    def rebuilt_dict(number):
+        # What get_periodic_element used to do on every call
+        elements = {i: f"{name} ({symbol})" for i, (name, symbol) in enumerate(knowledge.ELEMENTS[:100], 1)}
+        return elements.get(number)
+
+    start = time.perf_counter()
+    index = knowledge.build_index(SiegePersonality())
+    print(f"knowledge: index built in {(time.perf_counter() - start) * 1000:.2f} ms, {index.stats()}")
+    cases = (
+        ("dict per call", lambda: rebuilt_dict(47)),
+        ("by number", lambda: knowledge.element(47)),
+        ("exact name", lambda: index.lookup("silver")),
+        ("symbol", lambda: index.lookup("Ag")),
+        ("prefix", lambda: index.lookup("silv")),
+        ("fuzzy", lambda: index.lookup("flourine")),
+        ("no match", lambda: index.lookup("unobtainium")),
+    )
+    for name, fn in cases:
+        print(f"  {name:<14} {_time_per_call(fn, runs):8.2f} us/lookup")
+
+
+async def bench_memory(users=5000, messages_per_user=15):
+    """Bytes per tracked user: legacy nested dicts with re-sliced lists vs slotted ring-buffer records."""
+    from state_store import StateStore
+
+    def legacy():
+        user_data = {}
+        for i in range(messages_per_user):
+            for user_id in range(users):
+                if user_id not in user_data:
+                    user_data[user_id] = {"username": f"user{user_id % 50}", "is_admin": False, "history": []}
+                history = user_data[user_id]["history"]
+                history.append(f"message {i} from {user_id}")
+                if len(history) > 10:
+                    user_data[user_id]["history"] = history[-10:]
+        return user_data
+
+    def compact():
+        store = StateStore(max_users=users)
+        for i in range(messages_per_user):
+            for user_id in range(users):
+                store.remember_user(user_id, f"user{user_id % 50}")
+                store.append_history(user_id, f"message {i} from {user_id}")
+        return store
+
+    print(f"memory: {users} users x {messages_per_user} messages (history of 10)")
+    for name, fill in (("legacy dicts", legacy), ("UserRecord", compact)):
+        print(f"  {name:<13} {_traced_bytes(fill) / users:8.0f} bytes/user")
+
+    capped = StateStore(max_users=users * 10, max_bytes=256 * 1024)
+    for user_id in range(users):
+        capped.remember_user(user_id, f"user{user_id % 50}")
+        capped.append_history(user_id, f"message from {user_id}")
+    print(f"  256 KiB cap: {capped.stats()}")
+
+
+async def bench_metrics(runs=200000):
+    """Per-call cost of stage timers and counters, enabled vs disabled."""
+    from metrics import Metrics
+
+    print(f"metrics: {runs} timed blocks + counter increments")
+    baseline = _time_per_call(lambda: None, runs)
+    for enabled in (False, True):
+        metrics = Metrics(enabled=enabled)
+
+        def instrumented():
+            with metrics.timer("stage"):
+                pass
+            metrics.inc("messages")
+
+        per_call = _time_per_call(instrumented, runs) - baseline
+        print(f"  {'enabled' if enabled else 'disabled':<9} {per_call * 1000:8.1f} ns/call")
+    render = _time_per_call(metrics.render, 1000)
+    print(f"  render (1 stage, 1 counter) {render:8.1f} us")
+
+
+async def bench_summary(turns=(10, 50, 200), raw_window=4):
+    """Prompt tokens as a conversation grows: all raw history vs a short raw window plus rolling summaries."""
+    from fake_llm import FakeLLMBackend
+    from memory import RollingMemory
+    from personality import SiegePersonality
+    from prompt_builder import PromptBuilder, TokenCounter
+
+    counter = TokenCounter()
+    # No budget, so the raw variant shows what an untrimmed prompt would cost
+    builder = PromptBuilder(SiegePersonality(), counter, budget=1 << 20, max_message_tokens=1 << 20)
+    backend = FakeLLMBackend(latency=0.0, reply="alice is planning a Mars trip and keeps asking about rocket fuel.")
+    print(f"summary: prompt tokens by conversation length (raw window {raw_window})")
+    for count in turns:
+        # Refreshed inline here; the bot does the same from its background worker
+        memory = RollingMemory(backend.generate, counter)
+        history = []
+        for i in range(count):
+            text = f"message {i}: thinking about rocket fuel and the trip to mars"
+            history.append(text)
+            memory.observe(("user", 1), "alice", text)
+            if (i + 1) % memory.refresh_every == 0:
+                await memory.refresh(("user", 1))
+        _, raw_tokens = builder.build("and now?", "alice", history=history)
+        summary = memory.summary(("user", 1))
+        _, rolling_tokens = builder.build(
+            "and now?", "alice", history=history[-raw_window:], memory=[f"About @alice: {summary}"] if summary else ()
+        )
+        print(f"  {count:4d} turns  raw={raw_tokens:6d} tokens  rolling={rolling_tokens:5d} tokens  "
+              f"summaries={memory.stats()['refreshes']}")
+
+
+BENCHMARKS = {
+    "knowledge": bench_knowledge,
+    "math": bench_math,
+    "memory": bench_memory,
+    "metrics": bench_metrics,
+    "prompt": bench_prompt,
+    "resilience": bench_resilience,
+    "snapshot": bench_snapshot,
+    "state": bench_state,
+    "streaming": bench_streaming,
+    "summary": bench_summary,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("name", choices=sorted(BENCHMARKS) + ["all"])
+    args = parser.parse_args()
+    names = sorted(BENCHMARKS) if args.name == "all" else [args.name]
+    for name in names:
+        asyncio.run(BENCHMARKS[name]())
+
+
+if __name__ == "__main__":
+    main()
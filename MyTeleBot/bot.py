@@ -1,108 +1,651 @@
 import logging
 import asyncio
-import cohere
+import signal
+import time
 from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
+from telegram.ext import Application, ChatMemberHandler, CommandHandler, MessageHandler, filters, ContextTypes
 from personality import SiegePersonality
 from config import Config
+from admin_registry import AdminRegistry
+from cohere_client import CohereClient
+from streaming import StreamingReply
+from intent_router import IntentRouter
+from wiki_lookup import WikiLookup
+from response_cache import ResponseCache
+from coalescer import MessageCoalescer, PendingMessage
+from relevance import RelevanceGate
+from prompt_builder import PromptBuilder, TokenCounter
+from memory import RollingMemory
+from model_router import FACTUAL, SMALL_TALK, ModelRouter, tiers_from_config
+from state_store import SQLiteStateStore, StateStore
+from scheduler import ChatScheduler
+from resilience import CircuitBreaker, CircuitOpenError, LLMUnavailable, ResilientLLM
+from fake_llm import FakeLLMBackend
+from metrics import REGISTRY
+from loop_monitor import LoopMonitor
+from startup import STARTUP
+from snapshot import Snapshot, merge, write_snapshot
+from ratelimit import PRIORITY_AMBIENT, PRIORITY_BACKGROUND, PRIORITY_DIRECT, PriorityLimiter, TelegramRateLimiter, current_priority
 
 logger = logging.getLogger(__name__)
 
 class SiegeBot:
     def __init__(self):
         self.config = Config()
+        self.metrics = REGISTRY
+        self.metrics.enabled = self.config.metrics_enabled
         self.personality = SiegePersonality()
-        self.cohere_client = cohere.Client(self.config.cohere_api_key)
+        self.cohere_client = CohereClient(self.config)
+        backend = self.cohere_client
+        if self.config.llm_backend == "fake":
+            backend = FakeLLMBackend(latency=self.config.fake_llm_latency, error_rate=self.config.fake_llm_error_rate)
+        self.llm_limiter = PriorityLimiter(
+            self.config.llm_rate_per_minute / 60,
+            self.config.llm_burst,
+            max_waiting=self.config.llm_max_waiting,
+        )
+        self.llm = ResilientLLM(
+            backend,
+            timeout=self.config.response_timeout,
+            retries=self.config.llm_retries,
+            base_delay=self.config.llm_retry_base_delay,
+            max_delay=self.config.llm_retry_max_delay,
+            breaker=CircuitBreaker(self.config.llm_breaker_threshold, self.config.llm_breaker_reset),
+            hedge=self.config.llm_hedge,
+            limiter=self.llm_limiter,
+        )
+        self.prompt_builder = PromptBuilder(
+            self.personality,
+            TokenCounter(self.config.prompt_tokenizer),
+            budget=self.config.prompt_token_budget,
+            max_message_tokens=self.config.prompt_max_message_tokens,
+            max_memory_tokens=self.config.prompt_max_memory_tokens,
+        )
+        self.model_router = ModelRouter(
+            tiers_from_config(self.config),
+            self.prompt_builder.counter,
+            factual_threshold=self.config.route_factual_threshold,
+        )
+        self.memory = RollingMemory(
+            self._summarize,
+            self.prompt_builder.counter,
+            refresh_every=self.config.memory_refresh_every,
+            max_tokens=self.config.memory_summary_tokens,
+        )
+        self.wiki = WikiLookup(
+            cache_path=self.config.wiki_cache_path,
+            offline_path=self.config.wiki_offline_db,
+            network=self.config.wiki_network,
+            timeout=self.config.wiki_timeout,
+            http_timeout=self.config.wiki_http_timeout,
+        ) if self.config.intent_wikipedia else None
+        self.intent_router = IntentRouter(self.personality, wiki=self.wiki)
+        self.response_cache = ResponseCache(
+            maxsize=self.config.response_cache_size,
+            ttl=self.config.response_cache_ttl,
+            max_chars=self.config.response_cache_max_chars,
+        )
+        self.response_cache.opted_out.update(self.config.response_cache_optout_chats)
+        self.relevance_gate = RelevanceGate(
+            keywords=self.config.relevance_keywords,
+            random_rate=self.config.relevance_random_rate,
+        )
+        self.coalescer = None
+        if self.config.coalesce_window > 0:
+            self.coalescer = MessageCoalescer(
+                self.respond_to_batch,
+                window=self.config.coalesce_window,
+                max_batch=self.config.coalesce_max_batch,
+                max_delay=self.config.coalesce_max_delay,
+                run=self._in_chat_lane,
+            )
         self.bot_username = "@Siege_Chat_Bot"
         self.application = None
+        self.snapshot = None
+        self._stop_requested = asyncio.Event()
+        self.loop_monitor = LoopMonitor(
+            interval=self.config.loop_monitor_interval,
+            threshold=self.config.loop_lag_threshold,
+            metrics=self.metrics,
+        )
+        self.scheduler = ChatScheduler(
+            max_workers=self.config.scheduler_workers,
+            max_queue_depth=self.config.scheduler_queue_depth,
+            overflow=self.config.scheduler_overflow,
+            monitor=self.loop_monitor,
+        )
+        self.telegram_limiter = TelegramRateLimiter(
+            global_rate=self.config.telegram_global_rate,
+            group_per_minute=self.config.telegram_group_per_minute,
+            max_retries=self.config.telegram_max_retries,
+        )
 
-        # In-memory state
-        self.user_data = {}         # user_id: {"username": ..., "is_admin": bool, "history": [..]}
-        self.admins_per_chat = {}   # chat_id: set([admin_user_ids])
+        # User state lives in a bounded in-memory layer, optionally persisted to SQLite
+        state_limits = {
+            "max_users": self.config.state_max_users,
+            "max_bytes": int(self.config.state_max_memory_mb * 1024 * 1024),
+            "idle_ttl": self.config.state_idle_ttl or None,
+        }
+        if self.config.state_db:
+            self.state = SQLiteStateStore(
+                self.config.state_db,
+                flush_interval=self.config.state_flush_interval,
+                flush_batch=self.config.state_flush_batch,
+                **state_limits,
+            )
+        else:
+            self.state = StateStore(**state_limits)
+        self.user_data = self.state.users   # user_id: UserRecord
+        self.admin_registry = AdminRegistry(
+            ttl=self.config.admin_cache_ttl,
+            on_refresh=self.state.save_chat_admins,
+            max_chats=self.config.admin_cache_max_chats,
+        )
+        self._register_gauges()
+
+    def _register_gauges(self):
+        # Read only when metrics are scraped or /stats is asked for
+        gauges = {
+            "llm_inflight": lambda: self.llm.inflight,
+            "llm_circuit_open": lambda: int(self.llm.breaker.state != CircuitBreaker.CLOSED),
+            "llm_waiting": lambda: self.llm_limiter.waiting,
+            "telegram_waiting": lambda: self.telegram_limiter.global_limiter.waiting,
+            "scheduler_busy": lambda: self.scheduler.busy,
+            "scheduler_queued": lambda: self.scheduler.stats()["queued"],
+            "coalescer_pending": lambda: self.coalescer.pending() if self.coalescer is not None else 0,
+            "memory_queued": lambda: self.memory.stats()["queued"],
+            "state_users": lambda: len(self.user_data),
+            "state_memory_bytes": lambda: self.state.memory_bytes,
+            "admin_chats": lambda: self.admin_registry.stats()["chats"],
+            "admin_hits": lambda: self.admin_registry.hits,
+            "admin_misses": lambda: self.admin_registry.misses,
+            "admin_refreshes": lambda: self.admin_registry.refreshes,
+            "startup_ready_seconds": lambda: STARTUP.marks.get("ready", 0.0),
+            "startup_first_update_seconds": lambda: STARTUP.marks.get("first_update", 0.0),
+            "loop_lag_max_seconds": lambda: self.loop_monitor.max_lag,
+            "loop_stalls": lambda: self.loop_monitor.stalls,
+        }
+        for name, read in gauges.items():
+            self.metrics.gauge(name, read)
+
+    def build_application(self, updater=True):
+        """
+        Create the Application with every handler registered
+
+        Args:
+            updater: False for a shard worker, which is fed updates by the dispatcher
+        """
+        builder = Application.builder().token(self.config.telegram_token)
+        builder = builder.concurrent_updates(self.scheduler).rate_limiter(self.telegram_limiter)
+        if self.config.telegram_base_url:
+            builder = builder.base_url(self.config.telegram_base_url)
+        if not updater:
+            builder = builder.updater(None)
+        application = builder.build()
+        application.add_handler(CommandHandler("start", self.start_command))
+        application.add_handler(CommandHandler("help", self.help_command))
+        application.add_handler(CommandHandler("cache", self.cache_command))
+        application.add_handler(CommandHandler("stats", self.stats_command))
+        application.add_handler(ChatMemberHandler(self.chat_member_update, ChatMemberHandler.ANY_CHAT_MEMBER))
+        application.add_handler(MessageHandler(filters.ALL, self.handle_message))
+        application.add_error_handler(self.error_handler)
+        return application
+
+    async def start(self, updates=None):
+        """
+        Run the bot until stop() is called
 
-    async def start(self):
-        token = self.config.telegram_token
-        self.application = Application.builder().token(token).build()
-        self.application.add_handler(CommandHandler("start", self.start_command))
-        self.application.add_handler(CommandHandler("help", self.help_command))
-        self.application.add_handler(MessageHandler(filters.ALL, self.handle_message))
+        Args:
+            updates: Async iterator of update dicts to handle instead of polling or
+                a webhook, as a shard worker does; the bot stops once it is exhausted
+        """
+        self.application = self.build_application(updater=updates is None)
         logger.info("Starting Siege Bot...")
-        await self.application.initialize()
-        await self.application.start()
-        await self.application.updater.start_polling()
-        await asyncio.Event().wait()
+        await self.start_services()
+        self._install_signal_handlers()
+        feeder = warm_up = None
+        try:
+            await self.application.initialize()
+            await self.application.start()
+            if updates is not None:
+                feeder = asyncio.create_task(self._feed_updates(updates))
+                feeder.add_done_callback(lambda _: self.stop())
+            elif self.config.update_mode == "webhook":
+                await self.application.updater.start_webhook(
+                    listen=self.config.webhook_listen,
+                    port=self.config.webhook_port,
+                    url_path=self.config.webhook_path,
+                    webhook_url=f"{self.config.webhook_url}/{self.config.webhook_path}",
+                    secret_token=self.config.webhook_secret_token,
+                    allowed_updates=Update.ALL_TYPES,
+                )
+                logger.info(f"Receiving updates by webhook on port {self.config.webhook_port}")
+            else:
+                await self.application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+            STARTUP.mark("ready")
+            if self.config.llm_backend != "fake":
+                # Load the Cohere SDK while the first updates arrive rather than before polling
+                warm_up = asyncio.create_task(self.cohere_client.warm_up())
+            await self._stop_requested.wait()
+            logger.info("Stopping Siege Bot...")
+        finally:
+            # Stop taking new updates first, then let handlers already running finish
+            for task in (feeder, warm_up):
+                if task is not None:
+                    task.cancel()
+            if self.application.updater is not None and self.application.updater.running:
+                await self.application.updater.stop()
+            if self.application.running:
+                await self.application.stop()
+            if self.coalescer is not None:
+                # Answer batches still inside their coalescing window while the bot can still send
+                try:
+                    await asyncio.wait_for(self.coalescer.drain(), self.config.shutdown_drain_timeout)
+                except asyncio.TimeoutError:
+                    logger.warning(f"Gave up on {self.coalescer.pending()} coalesced messages after "
+                                   f"{self.config.shutdown_drain_timeout:.0f}s")
+            await self.application.shutdown()
+            await self.stop_services()
+
+    async def _feed_updates(self, updates):
+        try:
+            async for data in updates:
+                await self.application.update_queue.put(Update.de_json(data, self.application.bot))
+        except Exception as e:
+            logger.error(f"Update feed failed: {e}")
+
+    async def start_services(self):
+        """Load the tokenizer and start the background components handlers rely on."""
+        await asyncio.to_thread(self.prompt_builder.counter.load)
+        await self.state.start()
+        if self.config.loop_monitor_enabled:
+            self.loop_monitor.start()
+        if self.config.memory_enabled:
+            self.memory.start()
+        for chat_id, admin_ids in (await self.state.load_chat_admins()).items():
+            self.admin_registry.seed(chat_id, admin_ids)
+        if self.config.snapshot_path:
+            self._load_snapshot()
+        if self.config.metrics_port:
+            await self.metrics.serve(self.config.metrics_listen, self.config.metrics_port)
+
+    async def stop_services(self):
+        """Stop what start_services() started, flushing state last."""
+        await self.metrics.close()
+        await self.loop_monitor.close()
+        await self.memory.close()
+        await self.cohere_client.close()
+        if self.wiki is not None:
+            self.wiki.close()
+        if self.config.snapshot_path:
+            await self._save_snapshot()
+        await self.state.close()
+
+    def _snapshot_sources(self):
+        """Section name -> (component holding it, most entries to keep)."""
+        sources = {
+            "admins": (self.admin_registry, None),
+            "memory": (self.memory, self.memory.max_keys),
+            "responses": (self.response_cache, self.response_cache.maxsize),
+        }
+        if not self.config.state_db:
+            # SQLite already persists users; the snapshot only stands in for it in memory-only mode
+            sources["users"] = (self.state, self.state.max_users)
+        return sources
+
+    def _load_snapshot(self):
+        """Map the last shutdown's snapshot; components restore from it on their first miss."""
+        self.snapshot = Snapshot.open(self.config.snapshot_path, self.config.snapshot_max_age)
+        if self.snapshot is None:
+            return
+        for name, (component, _) in self._snapshot_sources().items():
+            component.snapshot = self.snapshot.section(name)
+        opt_outs = self.snapshot.section("cache_optout")
+        if opt_outs is not None:
+            self.response_cache.opted_out.update(chat_id for chat_id, _ in opt_outs.take_all())
+        logger.info(f"Loaded snapshot {self.config.snapshot_path} from {self.snapshot.stats()['age_s']}s ago: "
+                    + ", ".join(f"{name} {len(section)}" for name, section in self.snapshot.sections.items()))
+
+    async def _save_snapshot(self):
+        """Write the hot caches, plus whatever the loaded snapshot still holds that nobody asked for."""
+        previous = self.snapshot.sections if self.snapshot is not None else {}
+        # Collected here, while nothing else runs; encoded and written in a thread
+        sections = {
+            name: merge(list(component.snapshot_items()), previous.get(name), limit)
+            for name, (component, limit) in self._snapshot_sources().items()
+        }
+        sections["cache_optout"] = merge([(chat_id, 1) for chat_id in self.response_cache.opted_out], None)
+        started = time.perf_counter()
+        try:
+            size = await asyncio.to_thread(write_snapshot, self.config.snapshot_path, sections)
+            logger.info(f"Wrote snapshot {self.config.snapshot_path}: {size / 1024:.1f} KiB "
+                        f"in {(time.perf_counter() - started) * 1000:.0f} ms")
+        except OSError as e:
+            logger.error(f"Failed to write snapshot {self.config.snapshot_path}: {e}")
+        finally:
+            if self.snapshot is not None:
+                self.snapshot.close()
+                self.snapshot = None
+
+    def stop(self):
+        """Ask start() to shut down gracefully."""
+        self._stop_requested.set()
+
+    def _install_signal_handlers(self):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.stop)
+            except (NotImplementedError, RuntimeError):
+                # Windows, or not running in the main thread
+                pass
 
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_name = self._get_user_name(update)
         await update.message.reply_text(self.personality.get_start_message())
+        await self.state.load_user(update.effective_user.id)
         self._remember_user(update, user_name, update.message.chat_id)
 
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(self.personality.get_help_message())
 
+    async def cache_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        # /cache on|off toggles canned replies for this chat; group admins only
+        chat = update.effective_chat
+        if chat.type != "private":
+            admins = await self.update_admins(chat.id, context)
+            if update.effective_user.id not in admins:
+                await update.message.reply_text("Admins only, normie. 💀")
+                return
+        if context.args and context.args[0].lower() in ("on", "off"):
+            self.response_cache.set_enabled(chat.id, context.args[0].lower() == "on")
+        state = "on" if self.response_cache.enabled_for(chat.id) else "off"
+        await update.message.reply_text(f"Response cache is {state} for this chat.")
+
+    async def stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        # /stats reports stage latencies, counters and gauges; bot operators, or admins of this group
+        chat = update.effective_chat
+        user_id = update.effective_user.id
+        allowed = user_id in self.config.bot_admin_ids
+        if not allowed and chat.type != "private":
+            allowed = user_id in await self.update_admins(chat.id, context)
+        if not allowed:
+            await update.message.reply_text("Admins only, normie. 💀")
+            return
+        await update.message.reply_text(self.metrics.format_summary())
+
+    async def error_handler(self, update: object, context: ContextTypes.DEFAULT_TYPE):
+        self.metrics.inc("errors", "handler")
+        logger.error(f"Unhandled error while processing an update: {context.error}", exc_info=context.error)
+
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not update.message or not update.message.text:
             return
+        self.metrics.inc("messages")
+        try:
+            with self.metrics.timer("handle"):
+                await self._handle_message(update, context)
+        finally:
+            STARTUP.first_update()
 
+    async def _handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         chat_id = update.effective_chat.id
         user_id = update.effective_user.id
         user_name = self._get_user_name(update)
 
-        # Update admin list for this group if group chat
+        # Remember and learn from this user
+        with self.metrics.timer("state"):
+            await self.state.load_user(user_id)
+            is_admin = self.is_admin(chat_id, user_id)
+            self._remember_user(update, user_name, chat_id, is_admin)
+            self._learn_from_conversation(user_id, update.message.text)
+            if self.config.memory_enabled:
+                self.memory.observe(("user", user_id), user_name, update.message.text)
+                if update.effective_chat.type != "private":
+                    self.memory.observe(("chat", chat_id), user_name, update.message.text)
+
+        # In groups, only DMs, @mentions, replies to the bot and trigger words get an answer
+        with self.metrics.timer("gate"):
+            interaction = self.relevance_gate.classify(update.message, context.bot.username or self.bot_username, context.bot.id)
+        if interaction is None:
+            self.metrics.inc("skipped")
+            return
+        # Replies to the bot's addressees jump ahead of ambient chatter in every queue
+        current_priority.set(self._priority(interaction))
+
+        # Refresh the cached admin list in the background if it is missing or stale
         if update.effective_chat.type in ("group", "supergroup"):
-            await self.update_admins(chat_id, context)
+            with self.metrics.timer("admin"):
+                self.admin_registry.touch(chat_id, context.bot)
 
-        # Remember and learn from this user
-        is_admin = self.is_admin(chat_id, user_id)
-        self._remember_user(update, user_name, chat_id, is_admin)
-        self._learn_from_conversation(user_id, update.message.text)
+        # Deterministic questions are answered locally without calling Cohere
+        with self.metrics.timer("route"):
+            route = await self.intent_router.route(interaction.text)
+        if route.answer is not None:
+            self.metrics.inc("local_answers")
+            await self._answer_pending(chat_id)
+            await self._reply(update.message, f"@{user_name} {route.answer}", self.model_router.tiers[FACTUAL].max_chars)
+            return
+
+        # Repeated chatter is served from cache; post-processing keeps it from looking canned
+        chat_type = update.effective_chat.type
+        if self._use_response_cache(chat_id, interaction, route.facts):
+            with self.metrics.timer("cache"):
+                cached = self.response_cache.get(interaction.text, chat_type, interaction.kind, user_name)
+            if cached is not None:
+                self.metrics.inc("cache_hits")
+                await self._answer_pending(chat_id)
+                await self._reply(update.message, cached)
+                return
+            self.metrics.inc("cache_misses")
+
+        # Bursts of chatter in busy chats are batched into one generation. @mentions and replies
+        # to the bot don't wait out the window: they are answered now, with any chatter before them
+        if self.coalescer is not None and chat_type in self.config.coalesce_chat_types:
+            if not interaction.is_direct or self.coalescer.has_pending(chat_id):
+                self.metrics.inc("coalesced")
+                self.coalescer.submit(chat_id, PendingMessage(update, user_name, interaction, route.facts))
+                if interaction.is_direct:
+                    await self.coalescer.flush_pending(chat_id)
+                return
+
+        await self.respond(update, user_name, interaction, route.facts)
+
+    async def _answer_pending(self, chat_id):
+        """Answer chatter still in this chat's burst window before replying to a later message."""
+        if self.coalescer is not None:
+            await self.coalescer.flush_pending(chat_id)
+
+    async def _in_chat_lane(self, chat_id, items, reply):
+        # A timed flush queues behind the chat's running handler, like an update would
+        await self.scheduler.do_process_update(items[-1].update, reply)
+
+    async def respond(self, update, user_name, interaction, facts):
+        # Generate and send response, streaming it where enabled for this chat type
+        chat_type = update.effective_chat.type
+        user_id = update.effective_user.id
+        if not await self._admit_llm_call(self._priority(interaction)):
+            await update.message.reply_text(self.personality.get_fallback_response())
+            return
+        # Small talk goes to the light model with a short cap, factual questions to the strong one
+        tier = self.model_router.route(interaction.text, facts)
+        try:
+            if chat_type in self.config.streaming_chat_types:
+                reply = await self.stream_response(update.message, interaction.text, user_name, facts, interaction, user_id, update.effective_chat.id, tier)
+                generated_text = reply.text
+            else:
+                generated_text = await self.generate_text(interaction.text, user_name, facts, interaction, user_id, update.effective_chat.id, tier)
+                await self._reply(update.message, generated_text, tier.max_chars)
+        except LLMUnavailable as e:
+            await self._reply_unavailable(update.message, e)
+            return
+        if generated_text and self._use_response_cache(update.effective_chat.id, interaction, facts):
+            self.response_cache.put(interaction.text, chat_type, interaction.kind, user_name, generated_text)
+
+    async def respond_to_batch(self, chat_id, items):
+        self.loop_monitor.label(f"coalesced batch of {len(items)} chat {chat_id}")
+        if len(items) == 1:
+            item = items[0]
+            await self.respond(item.update, item.user_name, item.interaction, item.facts)
+            return
+        # One multi-speaker generation, sent as a reply to the latest message
+        priority = min(self._priority(item.interaction) for item in items)
+        current_priority.set(priority)
+        if not await self._admit_llm_call(priority):
+            await items[-1].update.message.reply_text(self.personality.get_fallback_response())
+            return
+        conversation = [(item.user_name, item.interaction.text) for item in items]
+        facts = [fact for item in items for fact in item.facts]
+        tier = self.model_router.route("\n".join(text for _, text in conversation), facts)
+        with self.metrics.timer("prompt"):
+            prompt, tokens = self.prompt_builder.build(
+                "", "", tool_results=facts, conversation=conversation, memory=self._chat_memory(chat_id)
+            )
+        try:
+            generated_text = await self._generate(prompt, tokens, tier)
+        except LLMUnavailable as e:
+            await self._reply_unavailable(items[-1].update.message, e)
+            return
+        await self._reply(items[-1].update.message, generated_text, tier.max_chars)
+
+    async def _reply(self, message, text, max_length=None):
+        with self.metrics.timer("postprocess"):
+            text = self.personality.post_process_response(text, max_length or self.config.max_response_length)
+        with self.metrics.timer("send"):
+            return await message.reply_text(text)
+
+    async def _reply_unavailable(self, message, error):
+        # Canned persona replies while the backend is down, an error quip for one-off failures
+        logger.error(f"Generation failed: {error}")
+        self.metrics.inc("errors", "circuit_open" if isinstance(error, CircuitOpenError) else "llm_unavailable")
+        if isinstance(error, CircuitOpenError):
+            await message.reply_text(self.personality.get_fallback_response())
+        else:
+            await message.reply_text(self.personality.get_error_response())
 
-        # Generate and send response
-        response = await self.generate_response(update.message.text, user_name)
-        await update.message.reply_text(response)
+    @staticmethod
+    def _priority(interaction):
+        return PRIORITY_DIRECT if interaction.is_direct else PRIORITY_AMBIENT
+
+    async def _admit_llm_call(self, priority):
+        # Shed load rather than let callers time out when over the LLM quota
+        admitted = await self.llm_limiter.acquire(priority, timeout=self.config.llm_queue_timeout)
+        if not admitted:
+            self.metrics.inc("shed", "direct" if priority == PRIORITY_DIRECT else "ambient")
+            logger.warning(f"LLM over capacity, shedding request (priority {priority}): {self.llm_limiter.stats()}")
+        return admitted
+
+    def _use_response_cache(self, chat_id, interaction, facts):
+        return (
+            self.config.response_cache_enabled
+            and not facts
+            and self.response_cache.enabled_for(chat_id)
+            and self.response_cache.cacheable(interaction.text)
+        )
 
     def _get_user_name(self, update: Update):
         return update.effective_user.username or update.effective_user.first_name or "stranger"
 
+    async def chat_member_update(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        # Promotions, demotions and departures invalidate the cached admin list; the bot's own departure drops it
+        self.admin_registry.apply_member_update(update.chat_member or update.my_chat_member, context.bot.id)
+
     async def update_admins(self, chat_id, context):
-        # Only call this occasionally or on new members to avoid API spam
-        try:
-            admins = await context.bot.get_chat_administrators(chat_id)
-            self.admins_per_chat[chat_id] = set(admin.user.id for admin in admins)
-        except Exception as e:
-            logger.error(f"Failed to fetch admin list: {e}")
+        # Forces a fetch; concurrent callers share the same request
+        return await self.admin_registry.fetch(chat_id, context.bot)
 
     def is_admin(self, chat_id, user_id):
-        return user_id in self.admins_per_chat.get(chat_id, set())
+        return self.admin_registry.is_admin(chat_id, user_id)
 
     def _remember_user(self, update, user_name, chat_id, is_admin=False):
-        user_id = update.effective_user.id
-        if user_id not in self.user_data:
-            self.user_data[user_id] = {
-                "username": user_name,
-                "is_admin": is_admin,
-                "history": []
-            }
-        self.user_data[user_id]["is_admin"] = is_admin
+        self.state.remember_user(update.effective_user.id, user_name, is_admin)
 
     def _learn_from_conversation(self, user_id, message):
         # Naive: store last 10 messages per user
-        history = self.user_data[user_id]["history"]
-        history.append(message)
-        if len(history) > 10:
-            self.user_data[user_id]["history"] = history[-10:]
-
-    async def generate_response(self, user_message, user_name):
-        # You could use the user's history here to improve the prompt
-        prompt = self.personality.create_prompt(user_message, user_name)
-        response = await asyncio.to_thread(
-            self.cohere_client.generate,
-            model='command',
-            prompt=prompt,
-            max_tokens=100,
-            temperature=0.8,
-            stop_sequences=["\n\n", "Human:", "User:"]
-        )
-        generated_text = response.generations[0].text.strip()
-        final_response = self.personality.post_process_response(generated_text)
+        self.state.append_history(user_id, message)
+
+    def _create_prompt(self, user_message, user_name, tool_results=None, interaction=None, user_id=None, chat_id=None):
+        # Earlier messages from this user, minus the one being answered
+        record = self.user_data.get(user_id)
+        history = record.history[:-1][-self.config.memory_raw_window:] if record is not None else []
+        # Older context comes from the rolling summaries instead of raw turns
+        user_summary = self.memory.summary(("user", user_id))
+        memory = [f"About @{user_name}: {user_summary}"] if user_summary else []
+        memory.extend(self._chat_memory(chat_id))
+        with self.metrics.timer("prompt"):
+            return self.prompt_builder.build(
+                user_message,
+                user_name,
+                is_private=interaction is not None and interaction.is_private,
+                is_mention=interaction is not None and interaction.is_mention,
+                is_reply=interaction is not None and interaction.is_reply,
+                tool_results=tool_results or (),
+                history=history,
+                memory=memory,
+            )
+
+    def _chat_memory(self, chat_id):
+        summary = self.memory.summary(("chat", chat_id)) if chat_id is not None else ""
+        return [f"This chat: {summary}"] if summary else []
+
+    async def _summarize(self, prompt):
+        # Background work: first to be shed when the LLM budget is tight, retries included
+        current_priority.set(PRIORITY_BACKGROUND)
+        if not await self.llm_limiter.acquire(PRIORITY_BACKGROUND, timeout=self.config.llm_queue_timeout):
+            raise LLMUnavailable("LLM busy, summary deferred")
+        # Summaries are short and internal, so the light model is good enough
+        options = dict(self.model_router.tiers[SMALL_TALK].options, max_tokens=self.config.memory_summary_tokens)
+        with self.metrics.timer("summary"):
+            return await self.llm.generate(prompt, **options)
+
+    async def _generate(self, prompt, prompt_tokens, tier):
+        started = time.monotonic()
+        with self.metrics.timer("llm"):
+            text = await self.llm.generate(prompt, **tier.options)
+        self._record_generation(tier, time.monotonic() - started, prompt_tokens, text)
+        return text
+
+    def _record_generation(self, tier, seconds, prompt_tokens, text):
+        self.model_router.record(tier, seconds, prompt_tokens, text)
+        self.metrics.observe(f"llm_{tier.name}", seconds)
+        self.metrics.inc("routed", tier.name)
+
+    async def generate_text(self, user_message, user_name, tool_results=None, interaction=None, user_id=None, chat_id=None, tier=None):
+        tier = tier or self.model_router.route(user_message, tool_results or ())
+        prompt, tokens = self._create_prompt(user_message, user_name, tool_results, interaction, user_id, chat_id)
+        return await self._generate(prompt, tokens, tier)
+
+    async def generate_response(self, user_message, user_name, tool_results=None, interaction=None, user_id=None, chat_id=None):
+        tier = self.model_router.route(user_message, tool_results or ())
+        try:
+            generated_text = await self.generate_text(user_message, user_name, tool_results, interaction, user_id, chat_id, tier)
+        except CircuitOpenError:
+            return self.personality.get_fallback_response()
+        except LLMUnavailable:
+            return self.personality.get_error_response()
+        final_response = self.personality.post_process_response(generated_text, tier.max_chars)
         return final_response
+
+    async def stream_response(self, message, user_message, user_name, tool_results=None, interaction=None, user_id=None, chat_id=None, tier=None):
+        tier = tier or self.model_router.route(user_message, tool_results or ())
+        prompt, tokens = self._create_prompt(user_message, user_name, tool_results, interaction, user_id, chat_id)
+        reply = StreamingReply(
+            message,
+            lambda text: self.personality.post_process_response(text, tier.max_chars),
+            first_chunk_chars=self.config.streaming_first_chunk_chars,
+            edit_interval=self.config.streaming_edit_interval,
+        )
+        started = time.monotonic()
+        try:
+            # Includes the progressive edits, so it is kept apart from the plain "llm" stage
+            with self.metrics.timer("llm_stream"):
+                await reply.run(self.llm.stream(prompt, **tier.options))
+        except LLMUnavailable as e:
+            if reply.sent is None:
+                raise
+            # The partial reply has already been finalized in place; don't send a second message
+            logger.error(f"Generation failed mid-stream: {e}")
+        self._record_generation(tier, time.monotonic() - started, tokens, reply.text)
+        if reply.sent is not None:
+            self.metrics.observe("llm_stream_first_send", reply.first_byte_at - started)
+        return reply
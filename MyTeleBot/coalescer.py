@@ -0,0 +1,145 @@
+"""
+Per-chat debounce that coalesces bursts of messages into one LLM call
+"""
+
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from telegram import Update
+
+from relevance import Interaction
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PendingMessage:
+    """A message waiting for its chat's batch to be flushed."""
+    update: Update
+    user_name: str
+    interaction: Interaction
+    facts: List[str] = field(default_factory=list)
+
+
+@dataclass
+class _Batch:
+    items: List[PendingMessage]
+    deadline: float
+    hard_deadline: float
+    timer: Optional[asyncio.Task] = None
+
+
+class MessageCoalescer:
+    """Collects messages per chat and hands them to `flush` as one batch.
+
+    A batch is flushed once the chat has been quiet for `window` seconds,
+    once `max_delay` seconds have passed since its first message, or as
+    soon as it holds `max_batch` messages, whichever comes first. Submitting
+    never blocks, so the update loop keeps moving while a batch waits.
+
+    Flushes triggered by time or size go through `run`, if given, so they
+    can wait their turn in the chat's scheduler lane. A handler that must
+    answer after the batch calls flush_pending(), which answers it inline.
+    """
+
+    def __init__(self, flush: Callable[[int, List[PendingMessage]], Awaitable[None]],
+                 window: float = 2.0, max_batch: int = 5, max_delay: Optional[float] = None,
+                 run: Optional[Callable[[int, List[PendingMessage], Awaitable[None]], Awaitable[None]]] = None):
+        self.flush = flush
+        self.run = run
+        self.window = window
+        self.max_batch = max_batch
+        self.max_delay = max_delay if max_delay is not None else window * 2
+        self._batches: Dict[int, _Batch] = {}
+        self._tasks = set()
+        self.messages = 0
+        self.batches = 0
+
+    def submit(self, chat_id: int, item: PendingMessage):
+        """
+        Add a message to its chat's pending batch
+
+        Args:
+            chat_id: Telegram chat ID the batch belongs to
+            item: The message to coalesce
+        """
+        self.messages += 1
+        now = asyncio.get_running_loop().time()
+        batch = self._batches.get(chat_id)
+        if batch is None:
+            batch = _Batch([item], now + self.window, now + self.max_delay)
+            self._batches[chat_id] = batch
+            batch.timer = self._spawn(self._wait_and_flush(chat_id, batch))
+        else:
+            batch.items.append(item)
+            batch.deadline = min(now + self.window, batch.hard_deadline)
+        if len(batch.items) >= self.max_batch:
+            batch.timer.cancel()
+            self._flush_now(chat_id, batch)
+
+    async def _wait_and_flush(self, chat_id: int, batch: _Batch):
+        loop = asyncio.get_running_loop()
+        while (delay := batch.deadline - loop.time()) > 0:
+            await asyncio.sleep(delay)
+        self._flush_now(chat_id, batch)
+
+    def _flush_now(self, chat_id: int, batch: _Batch):
+        if self._batches.get(chat_id) is batch:
+            del self._batches[chat_id]
+            self.batches += 1
+            self._spawn(self._run_flush(chat_id, batch.items))
+
+    async def flush_pending(self, chat_id: int):
+        """Answer the chat's pending batch now, in the calling task, so it goes out before anything sent next."""
+        batch = self._batches.pop(chat_id, None)
+        if batch is None:
+            return
+        batch.timer.cancel()
+        self.batches += 1
+        await self._reply(chat_id, batch.items)
+
+    def has_pending(self, chat_id: int) -> bool:
+        return chat_id in self._batches
+
+    async def _run_flush(self, chat_id: int, items: List[PendingMessage]):
+        if self.run is None:
+            await self._reply(chat_id, items)
+        else:
+            await self.run(chat_id, items, self._reply(chat_id, items))
+
+    async def _reply(self, chat_id: int, items: List[PendingMessage]):
+        try:
+            await self.flush(chat_id, items)
+        except Exception as e:
+            logger.exception(f"Failed to reply to coalesced batch in chat {chat_id}: {e}")
+
+    def _spawn(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def drain(self):
+        """Flush every pending batch now instead of waiting out its window, then wait for the replies."""
+        for chat_id, batch in list(self._batches.items()):
+            batch.timer.cancel()
+            self._flush_now(chat_id, batch)
+        await self.join()
+
+    async def join(self):
+        """Wait until every pending batch has been flushed and answered."""
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    def pending(self) -> int:
+        return sum(len(batch.items) for batch in self._batches.values())
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "messages": self.messages,
+            "batches": self.batches,
+            "pending": self.pending(),
+            "messages_per_batch": round(self.messages / self.batches, 2) if self.batches else 0.0,
+        }
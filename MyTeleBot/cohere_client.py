@@ -4,20 +4,163 @@ Cohere API client for generating intelligent responses
 
 import logging
 import asyncio
-from typing import Optional, Dict, Any
-import cohere
+import importlib
+from typing import AsyncIterator, Optional, Dict, Any, Sequence
+import httpx
 from config import Config
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_STOP_SEQUENCES = ["\n\n", "Human:", "User:"]
+
 class CohereClient:
-    """Client for interacting with Cohere API"""
+    """Async client for the Cohere API with pooled connections and bounded concurrency"""
     
     def __init__(self, config: Config):
         self.config = config
-        self.client = cohere.Client(api_key=config.COHERE_API_KEY)
+        # One keep-alive pool shared by every call instead of a thread per request
+        self.http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=config.cohere_max_connections,
+                max_keepalive_connections=config.cohere_max_connections,
+                keepalive_expiry=config.cohere_keepalive_expiry,
+            ),
+            timeout=config.response_timeout,
+        )
+        # The SDK and its pydantic models take most of a second to import, so they load
+        # on first use (or in the background via warm_up()) instead of before the bot can poll
+        self._client = None
+        self._import: Optional[asyncio.Future] = None
+        self._semaphore = asyncio.Semaphore(config.cohere_max_concurrency)
+        self.in_flight = 0
         self.conversation_history: Dict[int, list] = {}
         
+    @property
+    def client(self):
+        """The cohere.AsyncClient, created on first access (await warm_up() first on the event loop)."""
+        if self._client is None:
+            import cohere
+            self._client = cohere.AsyncClient(
+                api_key=self.config.cohere_api_key,
+                httpx_client=self.http_client,
+                timeout=self.config.response_timeout,
+            )
+        return self._client
+
+    async def warm_up(self):
+        """Import the SDK in a worker thread, once; callers share the same import."""
+        if self._import is None:
+            self._import = asyncio.ensure_future(asyncio.to_thread(importlib.import_module, "cohere"))
+        # Shielded: a caller that times out must not cancel the import for everyone else
+        await asyncio.shield(self._import)
+
+    async def generate(
+        self,
+        prompt: str,
+        *,
+        model: Optional[str] = None,
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+        stop_sequences: Optional[Sequence[str]] = None,
+        timeout: Optional[float] = None,
+    ) -> str:
+        """
+        Generate text for a prompt, bounded by the concurrency semaphore and a timeout
+        
+        Args:
+            prompt: The prompt to send to Cohere
+            model: Model override (defaults to config.cohere_model)
+            max_tokens: Token cap override (defaults to config.cohere_max_tokens)
+            temperature: Sampling temperature override
+            stop_sequences: Stop sequences override
+            timeout: Seconds for the whole call including queueing (defaults to config.response_timeout)
+            
+        Returns:
+            Generated text, stripped
+            
+        Raises:
+            asyncio.TimeoutError: If the call does not finish within the timeout
+        """
+        timeout = timeout if timeout is not None else self.config.response_timeout
+        return await asyncio.wait_for(
+            self._generate(prompt, model, max_tokens, temperature, stop_sequences, timeout),
+            timeout,
+        )
+
+    async def _generate(self, prompt, model, max_tokens, temperature, stop_sequences, timeout) -> str:
+        await self.warm_up()
+        async with self._semaphore:
+            self.in_flight += 1
+            try:
+                response = await self.client.generate(
+                    model=model or self.config.cohere_model,
+                    prompt=prompt,
+                    max_tokens=max_tokens or self.config.cohere_max_tokens,
+                    temperature=self.config.cohere_temperature if temperature is None else temperature,
+                    stop_sequences=list(DEFAULT_STOP_SEQUENCES if stop_sequences is None else stop_sequences),
+                    request_options={"timeout_in_seconds": int(timeout) or 1, "max_retries": 0},
+                )
+            finally:
+                self.in_flight -= 1
+        if response.generations:
+            return response.generations[0].text.strip()
+        return ""
+
+    async def generate_stream(
+        self,
+        prompt: str,
+        *,
+        model: Optional[str] = None,
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+        stop_sequences: Optional[Sequence[str]] = None,
+        timeout: Optional[float] = None,
+    ) -> AsyncIterator[str]:
+        """
+        Stream generated text fragments as they arrive
+        
+        Holds a concurrency slot for the lifetime of the stream. The timeout
+        is a deadline for the whole stream, not for each fragment.
+        
+        Args:
+            prompt: The prompt to send to Cohere
+            model, max_tokens, temperature, stop_sequences, timeout: As for generate()
+            
+        Yields:
+            Text fragments in generation order
+        """
+        loop = asyncio.get_running_loop()
+        timeout = timeout if timeout is not None else self.config.response_timeout
+        deadline = loop.time() + timeout
+        await asyncio.wait_for(self.warm_up(), timeout)
+        await asyncio.wait_for(self._semaphore.acquire(), deadline - loop.time())
+        self.in_flight += 1
+        try:
+            events = self.client.generate_stream(
+                model=model or self.config.cohere_model,
+                prompt=prompt,
+                max_tokens=max_tokens or self.config.cohere_max_tokens,
+                temperature=self.config.cohere_temperature if temperature is None else temperature,
+                stop_sequences=list(DEFAULT_STOP_SEQUENCES if stop_sequences is None else stop_sequences),
+                request_options={"timeout_in_seconds": int(timeout) or 1, "max_retries": 0},
+            ).__aiter__()
+            try:
+                while True:
+                    try:
+                        event = await asyncio.wait_for(events.__anext__(), deadline - loop.time())
+                    except StopAsyncIteration:
+                        break
+                    if event.event_type == "text-generation":
+                        yield event.text
+                    elif event.event_type == "stream-error":
+                        raise RuntimeError(f"Cohere stream error: {event.err}")
+            finally:
+                # Closes the HTTP response now, not whenever the abandoned generator is collected
+                await events.aclose()
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
     async def generate_response(self, user_id: int, message: str, context: Optional[str] = None) -> str:
         """
         Generate a response using Cohere API
@@ -35,10 +178,9 @@ class CohereClient:
             conversation_context = self._build_conversation_context(user_id, message, context)
             
             # Generate response using Cohere
-            response = await asyncio.to_thread(
-                self._call_cohere_api,
-                conversation_context
-            )
+            response = await self.generate(conversation_context, stop_sequences=["Human:"])
+            if not response:
+                response = "I'm not sure how to respond to that. Could you try rephrasing your question?"
             
             # Update conversation history
             self._update_conversation_history(user_id, message, response)
@@ -48,40 +190,10 @@ class CohereClient:
         except Exception as e:
             logger.error(f"Cohere API error for user {user_id}: {e}")
             return "I'm having trouble accessing my AI service right now. Please try again in a moment."
-    
-    def _call_cohere_api(self, prompt: str) -> str:
-        """
-        Make synchronous call to Cohere API
-        
-        Args:
-            prompt: The prompt to send to Cohere
-            
-        Returns:
-            Generated response text
-        """
-        try:
-            response = self.client.generate(
-                model=self.config.COHERE_MODEL,
-                prompt=prompt,
-                max_tokens=self.config.COHERE_MAX_TOKENS,
-                temperature=self.config.COHERE_TEMPERATURE,
-                k=0,
-                stop_sequences=[],
-                return_likelihoods='NONE'
-            )
-            
-            if response.generations and len(response.generations) > 0:
-                generated_text = response.generations[0].text.strip()
-                if generated_text:
-                    return generated_text
-                else:
-                    return "I'm not sure how to respond to that. Could you try rephrasing your question?"
-            else:
-                return "I didn't generate a proper response. Please try again."
-                
-        except Exception as e:
-            logger.error(f"Error calling Cohere API: {e}")
-            raise
+
+    async def close(self):
+        """Close the shared HTTP connection pool"""
+        await self.http_client.aclose()
     
     def _build_conversation_context(self, user_id: int, message: str, context: Optional[str] = None) -> str:
         """
@@ -20,11 +20,167 @@ class Config:
         if not self.cohere_api_key:
             raise ValueError("COHERE_API_KEY environment variable is required")
 
+        # How updates arrive: "polling" (getUpdates) or "webhook" (Telegram POSTs to our server)
+        self.update_mode = os.getenv("UPDATE_MODE", "polling").strip().lower()
+        if self.update_mode not in ("polling", "webhook"):
+            raise ValueError("UPDATE_MODE must be 'polling' or 'webhook'")
+        self.webhook_url = os.getenv("WEBHOOK_URL", "").strip().rstrip("/")
+        if self.update_mode == "webhook" and not self.webhook_url:
+            raise ValueError("WEBHOOK_URL environment variable is required in webhook mode")
+        self.webhook_listen = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+        self.webhook_port = int(os.getenv("WEBHOOK_PORT", os.getenv("PORT", "8443")))
+        self.webhook_path = os.getenv("WEBHOOK_PATH", "telegram").strip("/")
+        self.webhook_secret_token = os.getenv("WEBHOOK_SECRET_TOKEN") or None
+        # Bot API server override, e.g. a local Bot API server or the fake_telegram harness
+        self.telegram_base_url = os.getenv("TELEGRAM_BASE_URL") or None
+
+        # Multi-process mode: a dispatcher hashes chat_id to SHARD_WORKERS processes (1 = single process)
+        self.shard_workers = int(os.getenv("SHARD_WORKERS", "1"))
+        self.shard_index = int(os.getenv("SHARD_INDEX", "-1"))   # set by the dispatcher in each worker's environment
+        self.shard_heartbeat_interval = float(os.getenv("SHARD_HEARTBEAT_INTERVAL", "2"))
+        self.shard_health_timeout = float(os.getenv("SHARD_HEALTH_TIMEOUT", "15"))    # silent longer = restarted
+        self.shard_restart_delay = float(os.getenv("SHARD_RESTART_DELAY", "1"))       # doubles on repeated crashes
+        self.shard_buffer = int(os.getenv("SHARD_BUFFER", "1000"))                    # updates held per worker while it restarts
+        self.shard_shutdown_timeout = float(os.getenv("SHARD_SHUTDOWN_TIMEOUT", "30"))
+
+        # Update scheduling: chats run in parallel on a bounded pool, each chat strictly in order
+        self.scheduler_workers = int(os.getenv("SCHEDULER_WORKERS", "16"))
+        self.scheduler_queue_depth = int(os.getenv("SCHEDULER_QUEUE_DEPTH", "20"))
+        self.scheduler_overflow = os.getenv("SCHEDULER_OVERFLOW", "drop_oldest")   # or drop_newest
+
+        # Telegram flood limits for outbound requests
+        self.telegram_global_rate = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))             # per second
+        self.telegram_group_per_minute = float(os.getenv("TELEGRAM_GROUP_PER_MINUTE", "20"))
+        self.telegram_max_retries = int(os.getenv("TELEGRAM_MAX_RETRIES", "3"))                 # on RetryAfter
+
+        # LLM quota: over capacity, callers get a fallback reply instead of waiting
+        self.llm_rate_per_minute = float(os.getenv("LLM_RATE_PER_MINUTE", "120"))
+        self.llm_burst = int(os.getenv("LLM_BURST", "10"))
+        self.llm_max_waiting = int(os.getenv("LLM_MAX_WAITING", "50"))
+        self.llm_queue_timeout = float(os.getenv("LLM_QUEUE_TIMEOUT", "10"))
+
         # Optional configurations with defaults
         self.log_level = os.getenv("LOG_LEVEL", "INFO")
-        self.max_response_length = int(os.getenv("MAX_RESPONSE_LENGTH", "300"))
+        self.max_response_length = int(os.getenv("MAX_RESPONSE_LENGTH", "300"))   # characters, small talk and roasts
         self.response_timeout = int(os.getenv("RESPONSE_TIMEOUT", "30"))
 
+        # LLM resilience: retries with jittered backoff, circuit breaker, optional hedging
+        self.llm_backend = os.getenv("LLM_BACKEND", "cohere")   # "fake" injects latency/errors locally
+        self.llm_retries = int(os.getenv("LLM_RETRIES", "2"))
+        self.llm_retry_base_delay = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.25"))
+        self.llm_retry_max_delay = float(os.getenv("LLM_RETRY_MAX_DELAY", "2.0"))
+        self.llm_breaker_threshold = int(os.getenv("LLM_BREAKER_THRESHOLD", "5"))
+        self.llm_breaker_reset = float(os.getenv("LLM_BREAKER_RESET", "30"))
+        self.llm_hedge = os.getenv("LLM_HEDGE", "false").lower() in ("1", "true", "yes")
+        self.fake_llm_latency = float(os.getenv("FAKE_LLM_LATENCY", "0.3"))
+        self.fake_llm_error_rate = float(os.getenv("FAKE_LLM_ERROR_RATE", "0.0"))
+
+        # Cohere generation settings
+        self.cohere_model = os.getenv("COHERE_MODEL", "command")
+        self.cohere_max_tokens = int(os.getenv("COHERE_MAX_TOKENS", "100"))
+        self.cohere_temperature = float(os.getenv("COHERE_TEMPERATURE", "0.8"))
+        self.cohere_max_concurrency = int(os.getenv("COHERE_MAX_CONCURRENCY", "8"))
+        self.cohere_max_connections = int(os.getenv("COHERE_MAX_CONNECTIONS", "16"))
+        self.cohere_keepalive_expiry = float(os.getenv("COHERE_KEEPALIVE_EXPIRY", "60"))
+
+        # Model routing: small talk -> light model, short cap; roasts and factual questions -> strong model
+        self.route_models = os.getenv("ROUTE_MODELS", "true").lower() in ("1", "true", "yes")
+        self.route_fast_model = os.getenv("ROUTE_FAST_MODEL", "command-light")
+        self.route_strong_model = os.getenv("ROUTE_STRONG_MODEL", self.cohere_model)
+        self.route_small_talk_tokens = int(os.getenv("ROUTE_SMALL_TALK_TOKENS", "40"))
+        self.route_roast_tokens = int(os.getenv("ROUTE_ROAST_TOKENS", "80"))
+        self.route_roast_temperature = float(os.getenv("ROUTE_ROAST_TEMPERATURE", "0.9"))
+        self.route_factual_tokens = int(os.getenv("ROUTE_FACTUAL_TOKENS", "250"))
+        self.route_factual_temperature = float(os.getenv("ROUTE_FACTUAL_TEMPERATURE", "0.3"))
+        self.route_factual_max_chars = int(os.getenv("ROUTE_FACTUAL_MAX_CHARS", "800"))
+        self.route_factual_threshold = int(os.getenv("ROUTE_FACTUAL_THRESHOLD", "2"))   # topic words + question + facts
+        # Estimated USD per 1k tokens (prompt + output), only used for the logged cost figures
+        self.route_fast_cost_per_1k = float(os.getenv("ROUTE_FAST_COST_PER_1K", "0.0005"))
+        self.route_strong_cost_per_1k = float(os.getenv("ROUTE_STRONG_COST_PER_1K", "0.002"))
+
+        # Prompt budget: tokenizer.json path or Hugging Face tokenizer name, fetched once into the hub cache
+        # (empty = estimate from length)
+        self.prompt_tokenizer = os.getenv("PROMPT_TOKENIZER", "Cohere/command-nightly") or None
+        self.prompt_token_budget = int(os.getenv("PROMPT_TOKEN_BUDGET", "1200"))
+        self.prompt_max_message_tokens = int(os.getenv("PROMPT_MAX_MESSAGE_TOKENS", "200"))
+        self.prompt_max_memory_tokens = int(os.getenv("PROMPT_MAX_MEMORY_TOKENS", "120"))
+
+        # Rolling memory: a short raw window of recent messages plus summaries refreshed in the background
+        self.memory_enabled = os.getenv("MEMORY_ENABLED", "true").lower() in ("1", "true", "yes")
+        self.memory_raw_window = int(os.getenv("MEMORY_RAW_WINDOW", "4"))
+        self.memory_refresh_every = int(os.getenv("MEMORY_REFRESH_EVERY", "6"))
+        self.memory_summary_tokens = int(os.getenv("MEMORY_SUMMARY_TOKENS", "60"))
+
+        # Relevance gating in groups: extra trigger words and a chance to chime in unprompted
+        self.relevance_keywords = [
+            keyword.strip() for keyword in os.getenv("RELEVANCE_KEYWORDS", "siege").split(",") if keyword.strip()
+        ]
+        self.relevance_random_rate = float(os.getenv("RELEVANCE_RANDOM_RATE", "0"))
+
+        # Streaming replies: chat types that get progressive message edits
+        self.streaming_chat_types = {
+            chat_type.strip() for chat_type in os.getenv("STREAMING_CHAT_TYPES", "private").split(",") if chat_type.strip()
+        }
+        self.streaming_first_chunk_chars = int(os.getenv("STREAMING_FIRST_CHUNK_CHARS", "40"))
+        self.streaming_edit_interval = float(os.getenv("STREAMING_EDIT_INTERVAL", "1.0"))
+
+        # Local intent router: Wikipedia enrichment for "look up X" / "define X" requests
+        self.intent_wikipedia = os.getenv("INTENT_WIKIPEDIA", "true").lower() in ("1", "true", "yes")
+
+        # Wikipedia lookups: on-disk cache, optional offline FTS index, network fallback
+        self.wiki_cache_path = os.getenv("WIKI_CACHE_PATH", "wiki_cache.sqlite") or None
+        self.wiki_offline_db = os.getenv("WIKI_OFFLINE_DB") or None
+        self.wiki_network = os.getenv("WIKI_NETWORK", "true").lower() in ("1", "true", "yes")
+        self.wiki_timeout = float(os.getenv("WIKI_TIMEOUT", "3"))
+        self.wiki_http_timeout = float(os.getenv("WIKI_HTTP_TIMEOUT", "10"))   # per request; lookups finish off the reply path
+
+        # Response cache for repeated short messages
+        self.response_cache_enabled = os.getenv("RESPONSE_CACHE", "true").lower() in ("1", "true", "yes")
+        self.response_cache_size = int(os.getenv("RESPONSE_CACHE_SIZE", "2048"))
+        self.response_cache_ttl = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+        self.response_cache_max_chars = int(os.getenv("RESPONSE_CACHE_MAX_CHARS", "80"))
+        self.response_cache_optout_chats = {
+            int(chat_id) for chat_id in os.getenv("RESPONSE_CACHE_OPTOUT_CHATS", "").split(",") if chat_id.strip()
+        }
+
+        # Burst coalescing: seconds of quiet before a chat's pending messages get one reply (0 disables)
+        self.coalesce_window = float(os.getenv("COALESCE_WINDOW", "2.0"))
+        self.coalesce_max_delay = float(os.getenv("COALESCE_MAX_DELAY", "4.0"))
+        self.coalesce_max_batch = int(os.getenv("COALESCE_MAX_BATCH", "5"))
+        self.coalesce_chat_types = {
+            chat_type.strip() for chat_type in os.getenv("COALESCE_CHAT_TYPES", "group,supergroup").split(",") if chat_type.strip()
+        }
+
+        # User/chat state: SQLite file for persistence (unset keeps state in memory only)
+        self.state_db = os.getenv("STATE_DB") or None
+        self.state_max_users = int(os.getenv("STATE_MAX_USERS", "10000"))
+        self.state_max_memory_mb = float(os.getenv("STATE_MAX_MEMORY_MB", "64"))
+        self.state_idle_ttl = float(os.getenv("STATE_IDLE_TTL", "86400"))   # 0 disables idle eviction
+        self.state_flush_interval = float(os.getenv("STATE_FLUSH_INTERVAL", "2.0"))
+        self.state_flush_batch = int(os.getenv("STATE_FLUSH_BATCH", "500"))
+
+        # Warm restarts: hot caches written here on shutdown and restored lazily on boot (empty disables)
+        self.snapshot_path = os.getenv("SNAPSHOT_PATH", "siege_snapshot.bin")
+        self.snapshot_max_age = float(os.getenv("SNAPSHOT_MAX_AGE", "86400"))   # older snapshots are ignored
+        self.shutdown_drain_timeout = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "20"))   # seconds to answer pending batches
+
+        # Admin list cache: seconds before a chat's admin set is refreshed
+        self.admin_cache_ttl = float(os.getenv("ADMIN_CACHE_TTL", "600"))
+        self.admin_cache_max_chats = int(os.getenv("ADMIN_CACHE_MAX_CHATS", "10000"))   # least recently active evicted
+
+        # Metrics: stage latency histograms and counters, served as Prometheus text on METRICS_PORT (0 = no server)
+        self.metrics_enabled = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+        self.metrics_listen = os.getenv("METRICS_LISTEN", "0.0.0.0")
+        self.metrics_port = int(os.getenv("METRICS_PORT", "0"))
+        # Event-loop health: lag sampled every LOOP_MONITOR_INTERVAL, stacks logged for stalls over LOOP_LAG_THRESHOLD
+        self.loop_monitor_enabled = os.getenv("LOOP_MONITOR_ENABLED", "true").lower() in ("1", "true", "yes")
+        self.loop_monitor_interval = float(os.getenv("LOOP_MONITOR_INTERVAL", "0.1"))
+        self.loop_lag_threshold = float(os.getenv("LOOP_LAG_THRESHOLD", "0.25"))
+        # Bot operators: user IDs allowed to run /stats anywhere (group admins may run it in their group)
+        self.bot_admin_ids = {
+            int(user_id) for user_id in os.getenv("BOT_ADMIN_IDS", "").split(",") if user_id.strip()
+        }
+
     def validate(self):
         """Validate all required configuration"""
         required_vars = [
@@ -0,0 +1,77 @@
+"""
+Local fake LLM backend that injects latency and errors, for offline testing
+"""
+
+import asyncio
+import random
+from typing import AsyncIterator, Optional
+
+DEFAULT_REPLY = "Affirmative, the plan is sound and the enemy will regret everything."
+
+
+class FakeBackendError(Exception):
+    """An injected backend failure carrying an HTTP-like status code."""
+
+    def __init__(self, status_code: int = 503):
+        super().__init__(f"fake backend error {status_code}")
+        self.status_code = status_code
+
+
+class FakeLLMBackend:
+    """Drop-in for CohereClient's generate()/generate_stream().
+
+    Latency is `latency` seconds times a lognormal factor with shape
+    `jitter` (so there is a tail), scaled with the `max_tokens` cap when one is
+    passed (`latency` is for a 100-token cap); `slow_rate` of calls take `slow_factor` times longer, `error_rate`
+    raise FakeBackendError(503) and `hang_rate` never answer.
+    """
+
+    def __init__(self, latency: float = 0.3, error_rate: float = 0.0, slow_rate: float = 0.0,
+                 slow_factor: float = 10.0, hang_rate: float = 0.0, reply: str = DEFAULT_REPLY,
+                 seed: Optional[int] = None, jitter: float = 0.25):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.slow_factor = slow_factor
+        self.hang_rate = hang_rate
+        self.reply = reply
+        self.random = random.Random(seed)
+        self.calls = 0
+
+    def _delay(self, max_tokens: Optional[int] = None) -> float:
+        delay = self.latency * self.random.lognormvariate(0, self.jitter)
+        if max_tokens:
+            # Fixed overhead plus decoding time that grows with the allowed output
+            delay *= 0.3 + 0.7 * max_tokens / 100
+        if self.random.random() < self.slow_rate:
+            delay *= self.slow_factor
+        return delay
+
+    async def _misbehave(self):
+        if self.random.random() < self.hang_rate:
+            await asyncio.Event().wait()
+        if self.random.random() < self.error_rate:
+            raise FakeBackendError(503)
+
+    async def generate(self, prompt: str, *, timeout: Optional[float] = None, max_tokens: Optional[int] = None,
+                       **kwargs) -> str:
+        self.calls += 1
+        await asyncio.sleep(self._delay(max_tokens))
+        await self._misbehave()
+        return self.reply
+
+    async def generate_stream(self, prompt: str, *, timeout: Optional[float] = None, max_tokens: Optional[int] = None,
+                              **kwargs) -> AsyncIterator[str]:
+        self.calls += 1
+        words = self.reply.split(" ")
+        delay = self._delay(max_tokens)
+        await asyncio.sleep(delay / 2)
+        # Streams have no outer wait_for, so honour the deadline here like CohereClient does
+        await asyncio.wait_for(self._misbehave(), timeout)
+        for index, word in enumerate(words):
+            await asyncio.sleep(delay / 2 / len(words))
+            yield word if index == 0 else " " + word
+
+    async def close(self):
+        pass
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+Fake Telegram Bot API for offline end-to-end load tests of polling and webhook modes
+
+The harness starts a local server that answers the Bot API methods the bot
+uses, runs a real SiegeBot against it with Cohere replaced by FakeLLMBackend,
+and feeds it updates: queued for getUpdates in polling mode, or POSTed
+to the bot's webhook (with the secret token header) in webhook mode. The
+latency reported for each update is the time from injection to the bot's
+first sendMessage in that chat. With --workers above 1 the sharded dispatcher
+receives the updates and hands them to that many worker processes.
+
+    python fake_telegram.py both --count 200 --rate 50
+    python fake_telegram.py webhook --updates recorded_updates.jsonl
+    python fake_telegram.py webhook --count 500 --rate 0 --workers 1 2 4
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+from typing import Dict, List, Optional
+
+import httpx
+import tornado.httpserver
+import tornado.netutil
+import tornado.web
+
+BOT_USER = {"id": 999, "is_bot": True, "first_name": "Siege", "username": "Siege_Chat_Bot"}
+FAKE_TOKEN = "123456:fake-token"
+SECRET_TOKEN = "fake-secret"
+
+
+def synthetic_updates(count: int) -> List[dict]:
+    """Private-chat text messages, one chat per update."""
+    now = int(time.time())
+    return [
+        {
+            "update_id": i + 1,
+            "message": {
+                "message_id": 1,
+                "date": now,
+                "chat": {"id": 10_000 + i, "type": "private"},
+                "from": {"id": 10_000 + i, "is_bot": False, "first_name": f"user{i}", "username": f"user{i}"},
+                "text": f"what do you think about battle plan number {i}",
+            },
+        }
+        for i in range(count)
+    ]
+
+
+def load_updates(path: str) -> List[dict]:
+    """
+    Load recorded updates, one Update JSON object per line (e.g. captured from getUpdates)
+
+    Update and chat IDs are renumbered so every update is unique and its
+    reply can be matched by chat; only updates carrying a text message are kept.
+    """
+    updates = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            update = json.loads(line)
+            message = update.get("message")
+            if not message or "text" not in message:
+                continue
+            index = len(updates)
+            update["update_id"] = index + 1
+            message["chat"]["id"] = 10_000 + index if message["chat"]["type"] == "private" else -10_000 - index
+            updates.append(update)
+    return updates
+
+
+class _MethodHandler(tornado.web.RequestHandler):
+    def initialize(self, api: "FakeTelegram"):
+        self.api = api
+
+    async def post(self, method: str):
+        if self.request.headers.get("Content-Type", "").startswith("application/json"):
+            params = json.loads(self.request.body or b"{}")
+        else:
+            params = {key: self.get_body_argument(key) for key in self.request.body_arguments}
+        self.write({"ok": True, "result": await self.api.call(method, params)})
+
+    get = post
+
+
+class FakeTelegram:
+    """Minimal Bot API server that queues updates and timestamps the bot's replies."""
+
+    def __init__(self):
+        self.port = None
+        self._server = None
+        self._updates: List[dict] = []
+        self._new_updates = asyncio.Event()
+        self._closing = False
+        self._injected_at: Dict[int, float] = {}
+        self._replied: Dict[int, asyncio.Future] = {}
+        self._message_ids = 0
+        self.calls: Dict[str, int] = {}
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/bot"
+
+    def start(self):
+        sockets = tornado.netutil.bind_sockets(0, "127.0.0.1")
+        self.port = sockets[0].getsockname()[1]
+        app = tornado.web.Application([(r"/bot[^/]+/(\w+)", _MethodHandler, {"api": self})])
+        self._server = tornado.httpserver.HTTPServer(app)
+        self._server.add_sockets(sockets)
+
+    async def stop(self):
+        # Release long-polling getUpdates calls before closing their connections
+        self._closing = True
+        self._new_updates.set()
+        self._server.stop()
+        await self._server.close_all_connections()
+
+    def expect_reply(self, update: dict):
+        """Start the latency clock for an update about to be delivered."""
+        chat_id = update["message"]["chat"]["id"]
+        self._injected_at[chat_id] = time.perf_counter()
+        self._replied[chat_id] = asyncio.get_running_loop().create_future()
+
+    def enqueue(self, update: dict):
+        """Deliver an update through getUpdates."""
+        self.expect_reply(update)
+        self._updates.append(update)
+        self._new_updates.set()
+
+    async def latencies(self, timeout: float) -> Dict[int, Optional[float]]:
+        """Wait for every expected reply; chats with no reply by the deadline map to None."""
+        await asyncio.wait(list(self._replied.values()), timeout=timeout)
+        return {
+            chat_id: future.result() - self._injected_at[chat_id] if future.done() else None
+            for chat_id, future in self._replied.items()
+        }
+
+    async def call(self, method: str, params: dict):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if method == "getMe":
+            return BOT_USER
+        if method == "getUpdates":
+            return await self._get_updates(int(params.get("offset") or 0), float(params.get("timeout") or 0))
+        if method == "getChatAdministrators":
+            return []
+        if method in ("sendMessage", "editMessageText"):
+            chat_id = int(params["chat_id"])
+            future = self._replied.get(chat_id)
+            if method == "sendMessage" and future is not None and not future.done():
+                future.set_result(time.perf_counter())
+            self._message_ids += 1
+            return {
+                "message_id": int(params.get("message_id") or self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"},
+                "from": BOT_USER,
+                "text": params.get("text", ""),
+            }
+        return True
+
+    async def _get_updates(self, offset: int, timeout: float) -> List[dict]:
+        # Everything below the offset has been confirmed by the bot
+        self._updates = [update for update in self._updates if update["update_id"] >= offset]
+        deadline = time.monotonic() + timeout
+        while not self._updates and not self._closing:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return []
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), remaining)
+            except asyncio.TimeoutError:
+                return []
+        return self._updates[:100]
+
+
+def _configure_bot_env(mode: str, api: FakeTelegram, webhook_port: int):
+    os.environ.update({
+        "TELEGRAM_BOT_TOKEN": FAKE_TOKEN,
+        "COHERE_API_KEY": os.environ.get("COHERE_API_KEY", "fake"),
+        "TELEGRAM_BASE_URL": api.base_url,
+        "UPDATE_MODE": mode,
+        "WEBHOOK_URL": f"http://127.0.0.1:{webhook_port}",
+        "WEBHOOK_LISTEN": "127.0.0.1",
+        "WEBHOOK_PORT": str(webhook_port),
+        "WEBHOOK_SECRET_TOKEN": SECRET_TOKEN,
+        "WIKI_NETWORK": "false",
+        "WIKI_CACHE_PATH": "",
+        "STATE_DB": "",
+        "SNAPSHOT_PATH": "",
+        # Offline: a local tokenizer.json if the caller gives one, else estimates
+        "PROMPT_TOKENIZER": os.environ.get("PROMPT_TOKENIZER", ""),
+        # Every reply should exercise the full pipeline
+        "RESPONSE_CACHE": "false",
+        "LLM_BACKEND": "fake",
+    })
+    # Measure transport, not quotas or flood limits, unless the caller sets them
+    os.environ.setdefault("LLM_RATE_PER_MINUTE", "60000")
+    os.environ.setdefault("LLM_BURST", "1000")
+    os.environ.setdefault("TELEGRAM_GLOBAL_RATE", "1000")
+
+
+async def run_load(mode: str, updates: List[dict], rate: float, llm_delay: float, timeout: float,
+                   llm_error_rate: float = 0.0, workers: int = 1) -> dict:
+    """
+    Run one bot against the fake API and deliver updates at a fixed rate
+
+    Args:
+        mode: "polling" or "webhook"
+        updates: Update dicts to deliver
+        rate: Updates per second (0 = all at once)
+        llm_delay: Simulated generation time in seconds
+        llm_error_rate: Fraction of generations that fail with a 503
+        timeout: Seconds to wait for outstanding replies after the last update
+        workers: Above 1, run a ShardDispatcher with this many worker processes instead
+
+    Returns:
+        Latency summary
+    """
+    from bot import SiegeBot
+    from config import Config
+    from sharding import ShardDispatcher
+
+    api = FakeTelegram()
+    api.start()
+    probe = tornado.netutil.bind_sockets(0, "127.0.0.1")[0]
+    webhook_port = probe.getsockname()[1]
+    probe.close()
+    _configure_bot_env(mode, api, webhook_port)
+    os.environ["FAKE_LLM_LATENCY"] = str(llm_delay)
+    os.environ["FAKE_LLM_ERROR_RATE"] = str(llm_error_rate)
+    os.environ["SHARD_WORKERS"] = str(workers)
+    if workers > 1:
+        bot = ShardDispatcher(Config())
+        is_ready = bot.ready.is_set
+    else:
+        bot = SiegeBot()
+        is_ready = lambda: bot.application is not None and bot.application.updater.running
+    runner = asyncio.create_task(bot.start())
+    while not is_ready():
+        if runner.done():
+            runner.result()
+        await asyncio.sleep(0.01)
+
+    webhook_url = f"http://127.0.0.1:{webhook_port}/{bot.config.webhook_path}"
+    started = time.perf_counter()
+    async with httpx.AsyncClient() as client:
+        posts = []
+        for index, update in enumerate(updates):
+            if rate > 0:
+                await asyncio.sleep(max(0.0, started + index / rate - time.perf_counter()))
+            if mode == "webhook":
+                api.expect_reply(update)
+                posts.append(asyncio.create_task(client.post(
+                    webhook_url, json=update, headers={"X-Telegram-Bot-Api-Secret-Token": SECRET_TOKEN}
+                )))
+            else:
+                api.enqueue(update)
+        for response in await asyncio.gather(*posts):
+            response.raise_for_status()
+        latencies = await api.latencies(timeout)
+    elapsed = time.perf_counter() - started
+
+    bot.stop()
+    await runner
+    await api.stop()
+
+    answered = sorted(latency for latency in latencies.values() if latency is not None)
+    summary = {"mode": mode, "workers": workers, "updates": len(updates), "answered": len(answered),
+               "throughput_per_s": round(len(answered) / elapsed, 1)}
+    if answered:
+        summary.update({
+            "p50_ms": round(statistics.median(answered) * 1000, 1),
+            "p95_ms": round(answered[int(0.95 * (len(answered) - 1))] * 1000, 1),
+            "max_ms": round(answered[-1] * 1000, 1),
+        })
+    return summary
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end load test against a fake Telegram API")
+    parser.add_argument("mode", choices=["polling", "webhook", "both"])
+    parser.add_argument("--updates", help="JSONL file of recorded updates (default: synthetic private chats)")
+    parser.add_argument("--count", type=int, default=100, help="Number of synthetic updates")
+    parser.add_argument("--rate", type=float, default=20.0, help="Updates per second, 0 for a single burst")
+    parser.add_argument("--llm-delay", type=float, default=0.05, help="Simulated Cohere latency in seconds")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="Fraction of simulated Cohere 503s")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Seconds to wait for outstanding replies")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1],
+                        help="Worker process counts to run (above 1 uses the sharded dispatcher)")
+    args = parser.parse_args()
+
+    updates = load_updates(args.updates) if args.updates else synthetic_updates(args.count)
+    modes = ["polling", "webhook"] if args.mode == "both" else [args.mode]
+    for workers in args.workers:
+        for mode in modes:
+            print(json.dumps(await run_load(mode, updates, args.rate, args.llm_delay, args.timeout,
+                                            args.llm_error_rate, workers)))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
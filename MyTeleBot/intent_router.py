@@ -0,0 +1,265 @@
+"""
+Local fast-path intent router that answers deterministic questions without the LLM
+"""
+
+import logging
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import safe_math
+from knowledge import RELATIONSHIP_ALIASES, KnowledgeIndex, build_index, element
+from personality import SiegePersonality
+from safe_math import MathError, format_number
+from wiki_lookup import WikiLookup
+
+logger = logging.getLogger(__name__)
+
+_TIME_DIRECT = re.compile(
+    r"^\s*(?:hey\s+|yo\s+)?(?:siege\W*)?"
+    r"(?:what(?:'s|\s+is)?\s+(?:the\s+)?(?:current\s+)?(?:time|date|day)(?:\s+is\s+it)?(?:\s+(?:now|today|rn))?"
+    r"|what\s+day\s+is\s+(?:it|today)|what\s+time\s+is\s+it(?:\s+(?:now|rn))?)"
+    r"\s*[?!.]*\s*$",
+    re.IGNORECASE,
+)
+# The same questions inside a longer message; "time"/"date" must end the question, so
+# "what is the time complexity of quicksort" is not one
+_TIME_MENTION = re.compile(
+    r"\b(?:what\s+time\s+is\s+it|what\s+day\s+is\s+(?:it|today)"
+    r"|(?:what(?:'?s|\s+is)\s+(?:the\s+)?|today'?s\s+|current\s+)(?:time|date))"
+    r"(?=\s*(?:$|[?!.,]|(?:now|today|rn|right\s+now|there|please|pls)\b))",
+    re.IGNORECASE,
+)
+
+# A whole number or decimal that is not part of a word, a longer number or scientific notation ("1e5")
+_NUMBER = r"(?<![\w.])\d+(?:\.\d+)?(?!\w|\.\d)"
+_OPERAND = rf"\(*\s*-?\s*{_NUMBER}\s*\)*"
+_EXPRESSION = rf"{_OPERAND}(?:\s*(?:\*\*|[-+*/×÷])\s*{_OPERAND})+"
+_MATH_VERB = r"calculate|compute|solve"
+# The whole message is a sum, optionally asked for ("what is 2+2", "calculate (3+4)*2 =")
+_MATH_DIRECT = re.compile(
+    rf"^\s*(?:({_MATH_VERB})\s+|what(?:'s|\s+is)\s+)?({_EXPRESSION})\s*(?:=|equals)?\s*\??\s*$",
+    re.IGNORECASE,
+)
+# Inside a longer message only when it is clearly asked for: after a verb or "what is", or followed by "=";
+# a trailing "?" is not enough ("my score 7/10?")
+_MATH_MENTION = re.compile(
+    rf"\b(?:({_MATH_VERB})|what(?:'s|\s+is))\s+({_EXPRESSION})|({_EXPRESSION})\s*(?:=|equals)",
+    re.IGNORECASE,
+)
+# Dates, phone numbers and ranges ("2024-10-17", "555-1234", "3-4 dogs"), not subtraction
+_DATE_OR_RANGE = re.compile(r"\d-\d+-\d")
+_UNSPACED_HYPHEN = re.compile(r"\d-\d")
+
+_ELEMENT_DIRECT = re.compile(
+    r"^\s*(?:what(?:'s|\s+is)\s+)?(?:the\s+)?(?:element|atomic\s+number)\s*(?:number\s*)?#?\s*(\d{1,3})\s*[?!.]*\s*$",
+    re.IGNORECASE,
+)
+_ELEMENT_MENTION = re.compile(r"\b(?:element|atomic\s+number)\s*(?:number\s*)?#?\s*(\d{1,3})\b", re.IGNORECASE)
+# By name or symbol, only when the message says it means an element
+_ELEMENT_NAME_DIRECT = re.compile(
+    r"^\s*(?:what(?:'s|\s+is)\s+(?:the\s+)?)?(?:element|(?:atomic\s+number|symbol)\s+(?:of|for))\s+([a-z]{1,20})\s*[?!.]*\s*$"
+    r"|^\s*what\s+element\s+is\s+([a-z]{1,20})\s*[?!.]*\s*$",
+    re.IGNORECASE,
+)
+_ELEMENT_NAME_MENTION = re.compile(r"\b(?:element|(?:atomic\s+number|symbol)\s+(?:of|for))\s+([a-z]{2,20})\b", re.IGNORECASE)
+
+# Questions about Siege herself: relationships, looks and favorites, matched fuzzily against the index
+_PERSONA_DIRECT = re.compile(
+    r"^\s*(?:hey\s+|yo\s+)?(?:siege\W*)?"
+    r"(?:(?:(?:who|what)(?:'s|\s+is|\s+are|\s+r)|tell\s+me\s+about|describe)\s+(?:your|ur)\s+(?:favou?rite\s+|fav\s+)?"
+    r"([a-z][a-z ]{1,30}?)(?:\s+the\s+\w+)?|how\s+(tall)\s+are\s+(?:you|u))\s*[?!.]*\s*$",
+    re.IGNORECASE,
+)
+
+_ALIAS_PATTERN = "|".join(sorted((re.escape(alias) for alias in RELATIONSHIP_ALIASES), key=len, reverse=True))
+_RELATIONSHIP_DIRECT = re.compile(
+    rf"^\s*(?:who(?:'s|\s+is|\s+are)|tell\s+me\s+about)\s+(?:your\s+|ur\s+|the\s+)?({_ALIAS_PATTERN})(?:\s+the\s+\w+)?\s*[?!.]*\s*$",
+    re.IGNORECASE,
+)
+# "shall" is an everyday verb, so the sister's bare name only counts in capitals
+_RELATIONSHIP_MENTION = re.compile(
+    rf"(?i:\b(?:your|ur)\s+({_ALIAS_PATTERN})\b)|\b(SHALL)\b|(?i:\b(sausage|charlie|tao|dieseljack)\b)"
+)
+
+# "what is silver": answered from the local element table only, never sent to Wikipedia
+_WHAT_IS = re.compile(r"^\s*(?:what|who)\s+(?:is|was|are|were)\s+(?!your\b|ur\b|you\b|it\b|this\b|that\b)(.{3,60}?)\s*\??\s*$", re.IGNORECASE)
+# Wikipedia only when asked to look something up; a network lookup must not hold up every "what is X"
+_LOOKUP_REQUEST = re.compile(
+    r"^\s*(?:hey\s+|yo\s+)?(?:siege\W*)?(?:look\s+up|lookup|search(?:\s+for)?|wiki(?:pedia)?|define)\s+"
+    r"(.{2,60}?)(?:\s+(?:on|in)\s+wiki(?:pedia)?)?\s*[?!.]*\s*$",
+    re.IGNORECASE,
+)
+
+
+def _is_arithmetic(expression: str, explicit: bool) -> bool:
+    """
+    Whether a matched expression is a sum rather than a date, phone number or range
+
+    Args:
+        expression: The matched expression
+        explicit: The user asked to calculate/compute/solve it, so "10-3" is subtraction
+    """
+    if _DATE_OR_RANGE.search(expression):
+        return False
+    return explicit or not _UNSPACED_HYPHEN.search(expression)
+
+
+@dataclass
+class RouteResult:
+    """Outcome of routing one message.
+
+    `answer` is set when the message was fully handled locally; `facts`
+    carries tool output to enrich the LLM prompt otherwise.
+    """
+    intent: Optional[str] = None
+    answer: Optional[str] = None
+    facts: List[str] = field(default_factory=list)
+
+
+class IntentRouter:
+    """Answers time, math, element, relationship and persona questions from local tools."""
+
+    def __init__(self, personality: SiegePersonality, wiki: Optional[WikiLookup] = None, report_every: int = 100,
+                 knowledge: Optional[KnowledgeIndex] = None):
+        self.personality = personality
+        self.wiki = wiki
+        # Built once here; every lookup after that is a dict access or a small trigram scan
+        self.knowledge = knowledge or build_index(personality)
+        self.report_every = report_every
+        self.messages = 0
+        self.answered: Counter = Counter()
+        self.enriched: Counter = Counter()
+
+    async def route(self, text: str) -> RouteResult:
+        """
+        Route a message to a local answer, prompt facts, or neither
+
+        Args:
+            text: Raw message text
+
+        Returns:
+            RouteResult describing how the message should be handled
+        """
+        self.messages += 1
+        result = await self._answer_locally(text)
+        if result is None:
+            result = await self._collect_facts(text)
+        if result.answer is not None:
+            self.answered[result.intent] += 1
+        elif result.facts:
+            self.enriched[result.intent] += 1
+        if self.report_every and self.messages % self.report_every == 0:
+            logger.info(f"Intent router stats: {self.stats()}")
+        return result
+
+    async def _answer_locally(self, text: str) -> Optional[RouteResult]:
+        if _TIME_DIRECT.match(text):
+            return RouteResult("time", self.personality.get_current_time())
+
+        match = _MATH_DIRECT.match(text)
+        if match and _is_arithmetic(match.group(2), explicit=match.group(1) is not None):
+            answer = await self._calculate(match.group(2))
+            if answer:
+                return RouteResult("math", answer)
+
+        match = _ELEMENT_DIRECT.match(text)
+        if match:
+            element = self._element(int(match.group(1)))
+            if element:
+                return RouteResult("element", element)
+
+        match = _ELEMENT_NAME_DIRECT.match(text)
+        if match:
+            fact = self.knowledge.lookup(match.group(1) or match.group(2), kinds=("element",))
+            if fact:
+                return RouteResult("element", fact.answer)
+
+        match = _PERSONA_DIRECT.match(text)
+        if match:
+            fact = self.knowledge.lookup(match.group(1) or match.group(2), kinds=("relationship", "persona"))
+            if fact:
+                return RouteResult(fact.kind, fact.answer)
+
+        match = _RELATIONSHIP_DIRECT.match(text)
+        if match:
+            key = RELATIONSHIP_ALIASES[match.group(1).lower()]
+            return RouteResult("relationship", self.personality.get_relationship(key))
+        return None
+
+    async def _collect_facts(self, text: str) -> RouteResult:
+        facts = []
+        intent = None
+        if _TIME_MENTION.search(text):
+            intent = intent or "time"
+            facts.append(self.personality.get_current_time())
+
+        for match in _MATH_MENTION.finditer(text):
+            expression = match.group(2) or match.group(3)
+            if not _is_arithmetic(expression, explicit=match.group(1) is not None):
+                continue
+            answer = await self._calculate(expression)
+            if answer:
+                intent = intent or "math"
+                facts.append(answer)
+
+        for match in _ELEMENT_MENTION.finditer(text):
+            element = self._element(int(match.group(1)))
+            if element:
+                intent = intent or "element"
+                facts.append(element)
+        for match in _ELEMENT_NAME_MENTION.finditer(text):
+            fact = self.knowledge.lookup(match.group(1), kinds=("element",))
+            if fact and fact.answer not in facts:
+                intent = intent or "element"
+                facts.append(fact.answer)
+
+        keys = {RELATIONSHIP_ALIASES[(m.group(1) or m.group(2) or m.group(3)).lower()] for m in _RELATIONSHIP_MENTION.finditer(text)}
+        for key in sorted(keys):
+            intent = intent or "relationship"
+            facts.append(f"{key.replace('_', ' ').title()}: {self.personality.get_relationship(key)}")
+
+        match = (_LOOKUP_REQUEST.match(text) or _WHAT_IS.match(text)) if not facts else None
+        if match:
+            # "what is silver": the element is known locally, no need to ask Wikipedia
+            fact = self.knowledge.lookup(match.group(1), kinds=("element",), fuzzy=False)
+            if fact:
+                intent = "element"
+                facts.append(fact.answer)
+            elif self.wiki is not None and match.re is _LOOKUP_REQUEST:
+                summary, options = await self.wiki.lookup(match.group(1))
+                if summary:
+                    intent = "wikipedia"
+                    facts.append(summary)
+                elif options:
+                    intent = "wikipedia"
+                    facts.append(f"{match.group(1).strip()} may refer to: {', '.join(options[:5])}")
+
+        return RouteResult(intent, None, facts)
+
+    async def _calculate(self, expression: str) -> Optional[str]:
+        # Bounded evaluation; powers and long expressions run off the event loop
+        expression = expression.strip()
+        try:
+            result = format_number(await safe_math.evaluate_async(expression))
+        except MathError:
+            return None
+        return f"{expression} = {result}"
+
+    def _element(self, atomic_number: int) -> Optional[str]:
+        name = element(atomic_number)
+        return f"{name} - atomic number {atomic_number}" if name else None
+
+    def stats(self) -> Dict[str, object]:
+        answered = sum(self.answered.values())
+        enriched = sum(self.enriched.values())
+        rate = lambda count: round(count / self.messages, 4) if self.messages else 0.0
+        return {
+            "messages": self.messages,
+            "llm_calls_saved": answered,
+            "answered_rate": rate(answered),
+            "enriched_rate": rate(enriched),
+            "answered": {intent: rate(count) for intent, count in self.answered.items()},
+            "enriched": {intent: rate(count) for intent, count in self.enriched.items()},
+        }
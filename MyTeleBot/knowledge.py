@@ -0,0 +1,213 @@
+"""
+Local knowledge index: elements, relationships and persona facts with exact, prefix and fuzzy lookup
+"""
+
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# (name, symbol) by atomic number, 1-118
+ELEMENTS: Tuple[Tuple[str, str], ...] = (
+    ("Hydrogen", "H"), ("Helium", "He"), ("Lithium", "Li"), ("Beryllium", "Be"), ("Boron", "B"), ("Carbon", "C"),
+    ("Nitrogen", "N"), ("Oxygen", "O"), ("Fluorine", "F"), ("Neon", "Ne"), ("Sodium", "Na"), ("Magnesium", "Mg"),
+    ("Aluminum", "Al"), ("Silicon", "Si"), ("Phosphorus", "P"), ("Sulfur", "S"), ("Chlorine", "Cl"), ("Argon", "Ar"),
+    ("Potassium", "K"), ("Calcium", "Ca"), ("Scandium", "Sc"), ("Titanium", "Ti"), ("Vanadium", "V"), ("Chromium", "Cr"),
+    ("Manganese", "Mn"), ("Iron", "Fe"), ("Cobalt", "Co"), ("Nickel", "Ni"), ("Copper", "Cu"), ("Zinc", "Zn"),
+    ("Gallium", "Ga"), ("Germanium", "Ge"), ("Arsenic", "As"), ("Selenium", "Se"), ("Bromine", "Br"), ("Krypton", "Kr"),
+    ("Rubidium", "Rb"), ("Strontium", "Sr"), ("Yttrium", "Y"), ("Zirconium", "Zr"), ("Niobium", "Nb"), ("Molybdenum", "Mo"),
+    ("Technetium", "Tc"), ("Ruthenium", "Ru"), ("Rhodium", "Rh"), ("Palladium", "Pd"), ("Silver", "Ag"), ("Cadmium", "Cd"),
+    ("Indium", "In"), ("Tin", "Sn"), ("Antimony", "Sb"), ("Tellurium", "Te"), ("Iodine", "I"), ("Xenon", "Xe"),
+    ("Cesium", "Cs"), ("Barium", "Ba"), ("Lanthanum", "La"), ("Cerium", "Ce"), ("Praseodymium", "Pr"), ("Neodymium", "Nd"),
+    ("Promethium", "Pm"), ("Samarium", "Sm"), ("Europium", "Eu"), ("Gadolinium", "Gd"), ("Terbium", "Tb"), ("Dysprosium", "Dy"),
+    ("Holmium", "Ho"), ("Erbium", "Er"), ("Thulium", "Tm"), ("Ytterbium", "Yb"), ("Lutetium", "Lu"), ("Hafnium", "Hf"),
+    ("Tantalum", "Ta"), ("Tungsten", "W"), ("Rhenium", "Re"), ("Osmium", "Os"), ("Iridium", "Ir"), ("Platinum", "Pt"),
+    ("Gold", "Au"), ("Mercury", "Hg"), ("Thallium", "Tl"), ("Lead", "Pb"), ("Bismuth", "Bi"), ("Polonium", "Po"),
+    ("Astatine", "At"), ("Radon", "Rn"), ("Francium", "Fr"), ("Radium", "Ra"), ("Actinium", "Ac"), ("Thorium", "Th"),
+    ("Protactinium", "Pa"), ("Uranium", "U"), ("Neptunium", "Np"), ("Plutonium", "Pu"), ("Americium", "Am"), ("Curium", "Cm"),
+    ("Berkelium", "Bk"), ("Californium", "Cf"), ("Einsteinium", "Es"), ("Fermium", "Fm"), ("Mendelevium", "Md"), ("Nobelium", "No"),
+    ("Lawrencium", "Lr"), ("Rutherfordium", "Rf"), ("Dubnium", "Db"), ("Seaborgium", "Sg"), ("Bohrium", "Bh"), ("Hassium", "Hs"),
+    ("Meitnerium", "Mt"), ("Darmstadtium", "Ds"), ("Roentgenium", "Rg"), ("Copernicium", "Cn"), ("Nihonium", "Nh"), ("Flerovium", "Fl"),
+    ("Moscovium", "Mc"), ("Livermorium", "Lv"), ("Tennessine", "Ts"), ("Oganesson", "Og"),
+)
+
+# Other spellings people use for element names
+ELEMENT_ALIASES = {"aluminium": "Aluminum", "caesium": "Cesium", "sulphur": "Sulfur"}
+
+# Nicknames that map onto SiegePersonality.relationships keys
+RELATIONSHIP_ALIASES = {
+    "sister": "sister", "twin": "sister", "shall": "sister",
+    "team": "team", "siege corps": "team", "dieseljack": "team",
+    "best friend": "best_friend", "bestie": "best_friend", "sausage": "best_friend",
+    "friend": "friend", "charlie": "friend", "raccoon": "friend",
+    "wizard": "wizard_friend", "tao": "wizard_friend",
+}
+
+# Ways of asking about SiegePersonality.appearance and knowledge_areas keys
+PERSONA_ALIASES = {
+    "height": ("height", "tall", "size"),
+    "hair": ("hair", "hair color", "hair colour"),
+    "eyes": ("eyes", "eye color", "eye colour"),
+    "cybernetics": ("arm", "robot arm", "robotic arm", "cybernetics"),
+    "role": ("role", "job", "purpose"),
+    "anime": ("anime", "animes", "show", "shows"),
+    "games": ("games", "game", "video game", "video games"),
+    "comics": ("comics", "comic", "manhwa"),
+    "media": ("media", "movie", "movies", "series", "tv"),
+    "music": ("music", "band", "bands", "genre"),
+    "conspiracy": ("conspiracy", "conspiracies", "theory", "theories"),
+}
+
+
+def element(atomic_number: int) -> Optional[str]:
+    """"Silver (Ag)" for 47, None outside 1-118."""
+    if not 1 <= atomic_number <= len(ELEMENTS):
+        return None
+    name, symbol = ELEMENTS[atomic_number - 1]
+    return f"{name} ({symbol})"
+
+
+def _grams(term: str) -> List[str]:
+    padded = f"  {term} "
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+@dataclass(frozen=True)
+class Fact:
+    kind: str     # "element", "relationship" or "persona"
+    key: str      # atomic number, relationships key or persona key
+    answer: str
+
+
+class KnowledgeIndex:
+    """Facts reachable by any of their names, built once and then read-only.
+
+    Lookups try, in order: the exact name, a prefix that only one fact's
+    names start with, and the closest name by shared character trigrams.
+    Every prefix of every name is precomputed into one table (a flattened
+    trie), so exact and prefix lookups are a single dict access; fuzzy
+    lookups only touch the names sharing a trigram with the query. Short
+    names such as element symbols are only ever matched exactly.
+    """
+
+    def __init__(self, min_prefix: int = 3, min_fuzzy: int = 5, min_similarity: float = 0.5):
+        self.min_prefix = min_prefix
+        self.min_fuzzy = min_fuzzy
+        self.min_similarity = min_similarity
+        self.facts: List[Fact] = []
+        self._names: List[Tuple[str, int, int]] = []    # (name, fact id, distinct trigrams)
+        self._exact: Dict[str, List[int]] = {}          # name -> fact ids
+        self._prefixes: Dict[str, List[int]] = {}       # prefix -> fact ids with a name starting with it
+        self._grams: Dict[str, List[int]] = {}          # trigram -> name ids containing it
+        self.lookups = 0
+        self.hits = Counter()
+
+    def add(self, kind: str, key, answer: str, names: Iterable[str], exact_only: Iterable[str] = ()):
+        """
+        Index a fact under several names
+
+        Args:
+            kind: Fact category, used to filter lookups
+            key: Identifier of the fact within its kind
+            answer: Text returned for it
+            names: Names matched exactly, by prefix and fuzzily
+            exact_only: Names matched exactly only, e.g. element symbols
+        """
+        fact_id = len(self.facts)
+        self.facts.append(Fact(kind, str(key), answer))
+        for name in exact_only:
+            self._link(self._exact, name.lower(), fact_id)
+        for name in names:
+            name = name.lower()
+            self._link(self._exact, name, fact_id)
+            for end in range(self.min_prefix, len(name) + 1):
+                self._link(self._prefixes, name[:end], fact_id)
+            if len(name) >= self.min_fuzzy:
+                name_id = len(self._names)
+                grams = set(_grams(name))
+                self._names.append((name, fact_id, len(grams)))
+                for gram in grams:
+                    self._grams.setdefault(gram, []).append(name_id)
+
+    @staticmethod
+    def _link(table: Dict[str, List[int]], name: str, fact_id: int):
+        ids = table.setdefault(name, [])
+        if fact_id not in ids:
+            ids.append(fact_id)
+
+    def lookup(self, query: str, kinds: Optional[Iterable[str]] = None, fuzzy: bool = True) -> Optional[Fact]:
+        """
+        Find the fact a name refers to
+
+        Args:
+            query: Name, symbol, prefix or misspelling
+            kinds: Only return facts of these kinds
+            fuzzy: Allow prefix and trigram matches, not just exact names
+
+        Returns:
+            The fact, or None if nothing (or more than one fact) matches
+        """
+        self.lookups += 1
+        query = " ".join(query.lower().split())
+        kinds = None if kinds is None else set(kinds)
+        fact = self._unique(self._exact.get(query, ()), kinds)
+        if fact is not None:
+            self.hits["exact"] += 1
+        elif fuzzy and len(query) >= self.min_prefix:
+            fact = self._unique(self._prefixes.get(query, ()), kinds)
+            if fact is not None:
+                self.hits["prefix"] += 1
+            elif len(query) >= self.min_fuzzy:
+                fact = self._closest(query, kinds)
+                if fact is not None:
+                    self.hits["fuzzy"] += 1
+        return fact
+
+    def _unique(self, fact_ids: Iterable[int], kinds) -> Optional[Fact]:
+        matches = [self.facts[i] for i in fact_ids if kinds is None or self.facts[i].kind in kinds]
+        return matches[0] if len(matches) == 1 else None
+
+    def _closest(self, query: str, kinds) -> Optional[Fact]:
+        grams = set(_grams(query))
+        shared = Counter()
+        for gram in grams:
+            shared.update(self._grams.get(gram, ()))
+        best, best_score = None, self.min_similarity
+        for name_id, count in shared.items():
+            name, fact_id, size = self._names[name_id]
+            # Dice coefficient over trigrams; ties go to the name closest in length
+            score = 2 * count / (len(grams) + size)
+            if score > best_score or (score == best_score and best is not None
+                                      and abs(len(name) - len(query)) < abs(len(best[0]) - len(query))):
+                if kinds is None or self.facts[fact_id].kind in kinds:
+                    best, best_score = (name, fact_id), score
+        return self.facts[best[1]] if best is not None else None
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "facts": len(self.facts),
+            "prefixes": len(self._prefixes),
+            "trigrams": len(self._grams),
+            "lookups": self.lookups,
+            "hits": dict(self.hits),
+        }
+
+
+def build_index(personality) -> KnowledgeIndex:
+    """Index every element plus a SiegePersonality's relationships and persona facts."""
+    index = KnowledgeIndex()
+    aliases: Dict[str, List[str]] = {}
+    for alias, name in ELEMENT_ALIASES.items():
+        aliases.setdefault(name, []).append(alias)
+    for number, (name, symbol) in enumerate(ELEMENTS, 1):
+        index.add("element", number, f"{name} ({symbol}) - atomic number {number}",
+                  [name, *aliases.get(name, ())], exact_only=[symbol])
+
+    for key, description in personality.relationships.items():
+        names = [alias for alias, target in RELATIONSHIP_ALIASES.items() if target == key]
+        index.add("relationship", key, description, [key.replace("_", " "), *names])
+
+    for key, value in personality.appearance.items():
+        index.add("persona", key, f"{key.title()}: {value}", PERSONA_ALIASES.get(key, (key,)))
+    for key, favorites in personality.knowledge_areas.items():
+        index.add("persona", key, f"Favorite {key}: {', '.join(favorites)}", PERSONA_ALIASES.get(key, (key,)))
+    return index
@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""
+Offline load test of the message pipeline, driving SiegeBot.handle_message in-process
+
+Synthetic updates from many simulated users, in private chats and groups,
+are dispatched through the bot's ChatScheduler to handle_message. Telegram
+is replaced by a stub request layer and Cohere by FakeLLMBackend, both with
+lognormal latency. The run reports throughput, reply latency percentiles,
+growth of user_data and API calls per message. Results can be saved as JSON
+and compared against an earlier run, so regressions show up between commits.
+
+    python loadtest.py --messages 2000 --users 500 --chats 40 --output after.json
+    python loadtest.py --messages 2000 --users 500 --chats 40 --compare before.json
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections import deque
+from types import SimpleNamespace
+from typing import Deque, Dict, List, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import ExtBot
+from telegram.request import BaseRequest
+
+BOT_USER = {"id": 999, "is_bot": True, "first_name": "Siege", "username": "Siege_Chat_Bot"}
+FAKE_TOKEN = "123456:fake-token"
+
+# Short repeats hit the response cache, a few go to the local intent router,
+# the rest need a generation
+TEXTS = (
+    "gm", "lol", "hi siege", "what time is it", "what is 12*7",
+    "what do you think about battle plan number {n}",
+    "any tips for painting space marines? attempt {n}",
+    "how far away is mars right now, asking for mission {n}",
+    "tell me something interesting about napoleon ({n})",
+    "rate my strategy: flank left, hold the bridge, retreat at dawn #{n}",
+)
+CHATTER = ("lmao", "same", "who's on tonight", "brb", "ok", "did anyone see the match", "nice one")
+
+# Metrics compared by --compare: +1 when higher is better, -1 when lower is better
+TRACKED = {
+    "throughput_msg_per_s": 1,
+    "reply_latency_ms.all.p50_ms": -1,
+    "reply_latency_ms.all.p99_ms": -1,
+    "handle_latency_ms.p99_ms": -1,
+    "user_data.bytes_per_user": -1,
+    "api_calls_per_message.telegram": -1,
+    "api_calls_per_message.llm": -1,
+}
+
+
+class StubRequest(BaseRequest):
+    """Answers Bot API calls locally after a lognormal delay and timestamps replies."""
+
+    def __init__(self, latency: float = 0.03, jitter: float = 0.3, seed: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.calls: Dict[str, int] = {}
+        # (chat_id, message_id) of each incoming message -> time of the first reply to it
+        self.replied_at: Dict[Tuple[int, int], float] = {}
+        self._unanswered: Dict[int, Deque[int]] = {}
+        self._message_ids = 0
+
+    def expect_reply(self, chat_id: int, message_id: int):
+        self._unanswered.setdefault(chat_id, deque()).append(message_id)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return None
+
+    async def do_request(self, url: str, method: str, request_data=None, **kwargs) -> Tuple[int, bytes]:
+        endpoint = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data is not None else {}
+        self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+        if self.latency > 0:
+            await asyncio.sleep(self.latency * self.random.lognormvariate(0, self.jitter))
+        return 200, json.dumps({"ok": True, "result": self._result(endpoint, params)}).encode()
+
+    def _result(self, endpoint: str, params: dict):
+        if endpoint == "getMe":
+            return BOT_USER
+        if endpoint == "getChatAdministrators":
+            return []
+        if endpoint in ("sendMessage", "editMessageText"):
+            chat_id = int(params["chat_id"])
+            if endpoint == "sendMessage":
+                self._record_reply(chat_id, (params.get("reply_parameters") or {}).get("message_id"))
+            self._message_ids += 1
+            return {
+                "message_id": int(params.get("message_id") or self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"},
+                "from": BOT_USER,
+                "text": params.get("text", ""),
+            }
+        return True
+
+    def _record_reply(self, chat_id: int, reply_to: Optional[int]):
+        # Replies in private chats don't quote; chats are answered in order, so take the oldest open message
+        unanswered = self._unanswered.get(chat_id)
+        while reply_to is None and unanswered:
+            candidate = unanswered.popleft()
+            if (chat_id, candidate) not in self.replied_at:
+                reply_to = candidate
+        if reply_to is not None:
+            self.replied_at.setdefault((chat_id, int(reply_to)), time.perf_counter())
+
+
+def synthetic_traffic(messages: int, users: int, chats: int, group_share: float = 0.5,
+                      mention_share: float = 0.3, seed: int = 1) -> List[dict]:
+    """
+    Build Update dicts for a mixed population
+
+    User and group activity are Zipf-like, so a few users and groups produce
+    most of the traffic. In groups, `mention_share` of messages address the
+    bot; the rest is chatter the relevance gate should skip.
+    """
+    rng = random.Random(seed)
+    user_weights = [1 / (rank + 1) for rank in range(users)]
+    chat_weights = [1 / (rank + 1) for rank in range(chats)]
+    message_ids: Dict[int, int] = {}
+    now = int(time.time())
+    updates = []
+    for index in range(messages):
+        user = rng.choices(range(users), user_weights)[0]
+        sender = {"id": 20_000 + user, "is_bot": False, "first_name": f"user{user}", "username": f"user{user}"}
+        text = rng.choice(TEXTS).format(n=index)
+        if chats and rng.random() < group_share:
+            chat = {"id": -30_000 - rng.choices(range(chats), chat_weights)[0], "type": "supergroup", "title": "squad"}
+            if rng.random() < mention_share:
+                text = f"@{BOT_USER['username']} {text}"
+            else:
+                text = rng.choice(CHATTER)
+        else:
+            chat = {"id": sender["id"], "type": "private", "first_name": sender["first_name"]}
+        message_ids[chat["id"]] = message_ids.get(chat["id"], 0) + 1
+        message = {"message_id": message_ids[chat["id"]], "date": now, "chat": chat, "from": sender, "text": text}
+        if text.startswith(f"@{BOT_USER['username']} "):
+            # As Telegram sends it, so the bot sees a mention rather than its name in passing
+            message["entities"] = [{"type": "mention", "offset": 0, "length": len(BOT_USER["username"]) + 1}]
+        updates.append({"update_id": index + 1, "message": message})
+    return updates
+
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+    pick = lambda q: round(ordered[int(q * (len(ordered) - 1))] * 1000, 2)
+    return {
+        "count": len(ordered),
+        "p50_ms": round(statistics.median(ordered) * 1000, 2),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+        "max_ms": round(ordered[-1] * 1000, 2),
+    }
+
+
+def _configure_env():
+    os.environ.update({
+        "TELEGRAM_BOT_TOKEN": FAKE_TOKEN,
+        "COHERE_API_KEY": os.environ.get("COHERE_API_KEY", "fake"),
+        "LLM_BACKEND": "fake",
+        "WIKI_NETWORK": "false",
+        "WIKI_CACHE_PATH": "",
+        "STATE_DB": "",
+        "SNAPSHOT_PATH": "",
+        "METRICS_PORT": "0",
+        # Offline: a local tokenizer.json if the caller gives one, else estimates
+        "PROMPT_TOKENIZER": os.environ.get("PROMPT_TOKENIZER", ""),
+    })
+    # Measure the pipeline, not quotas or flood limits, unless the caller sets them
+    os.environ.setdefault("LLM_RATE_PER_MINUTE", "600000")
+    os.environ.setdefault("LLM_BURST", "10000")
+    os.environ.setdefault("LLM_MAX_WAITING", "100000")
+    os.environ.setdefault("TELEGRAM_GLOBAL_RATE", "100000")
+    os.environ.setdefault("TELEGRAM_GROUP_PER_MINUTE", "600000")
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args: argparse.Namespace) -> dict:
+    """
+    Run one load test and summarize it
+
+    Args:
+        args: Parsed command-line options (see main())
+
+    Returns:
+        JSON-serializable results
+    """
+    _configure_env()
+    from bot import SiegeBot
+    from fake_llm import FakeLLMBackend
+    from metrics import REGISTRY
+
+    bot = SiegeBot()
+    backend = FakeLLMBackend(
+        latency=args.llm_latency, jitter=args.llm_jitter, error_rate=args.llm_error_rate,
+        slow_rate=args.llm_slow_rate, seed=args.seed,
+    )
+    bot.llm.backend = backend
+    request = StubRequest(args.telegram_latency, args.telegram_jitter, seed=args.seed)
+    telegram = ExtBot(FAKE_TOKEN, request=request, get_updates_request=StubRequest(0), rate_limiter=bot.telegram_limiter)
+    await telegram.initialize()
+    await bot.start_services()
+    context = SimpleNamespace(bot=telegram, args=[])
+
+    updates = [Update.de_json(data, telegram) for data in synthetic_traffic(
+        args.messages, args.users, args.chats, args.group_share, args.mention_share, args.seed,
+    )]
+    users_before, bytes_before = len(bot.user_data), bot.state.memory_bytes
+    if args.tracemalloc:
+        tracemalloc.start()
+        traced_before = tracemalloc.get_traced_memory()[0]
+    api_before = sum(request.calls.values())
+
+    dispatched_at: Dict[Tuple[int, int], float] = {}
+    handle_latencies: List[float] = []
+
+    async def dispatch(update: Update):
+        started = time.perf_counter()
+        dispatched_at[(update.effective_chat.id, update.message.message_id)] = started
+        request.expect_reply(update.effective_chat.id, update.message.message_id)
+        await bot.scheduler.do_process_update(update, bot.handle_message(update, context))
+        handle_latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    tasks = []
+    for index, update in enumerate(updates):
+        if args.rate > 0:
+            await asyncio.sleep(max(0.0, started + index / args.rate - time.perf_counter()))
+        tasks.append(asyncio.create_task(dispatch(update)))
+    await asyncio.gather(*tasks)
+    if bot.coalescer is not None:
+        await bot.coalescer.join()
+    elapsed = time.perf_counter() - started
+
+    traced = None
+    if args.tracemalloc:
+        traced = tracemalloc.get_traced_memory()[0] - traced_before
+        tracemalloc.stop()
+    users_after = len(bot.user_data)
+    await bot.stop_services()
+    await telegram.shutdown()
+
+    latencies: Dict[str, List[float]] = {"all": [], "private": [], "group": []}
+    for (chat_id, message_id), sent_at in request.replied_at.items():
+        latency = sent_at - dispatched_at[(chat_id, message_id)]
+        latencies["all"].append(latency)
+        latencies["private" if chat_id > 0 else "group"].append(latency)
+    api_calls = sum(request.calls.values()) - api_before
+    return {
+        "commit": _git_commit(),
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "scenario": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "messages": len(updates),
+        "answered": len(request.replied_at),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_msg_per_s": round(len(updates) / elapsed, 1),
+        "reply_latency_ms": {kind: _percentiles(samples) for kind, samples in latencies.items()},
+        "handle_latency_ms": _percentiles(handle_latencies),
+        "user_data": {
+            "users_before": users_before,
+            "users_after": users_after,
+            "bytes_before": bytes_before,
+            "bytes_after": bot.state.memory_bytes,
+            "bytes_per_user": round(bot.state.memory_bytes / users_after, 1) if users_after else 0.0,
+            "evictions": bot.state.stats()["evictions"],
+        },
+        "heap_growth_bytes": traced,
+        "api_calls_per_message": {
+            "telegram": round(api_calls / len(updates), 3),
+            "llm": round(backend.calls / len(updates), 3),
+            "by_endpoint": {endpoint: count for endpoint, count in sorted(request.calls.items())},
+        },
+        "routing": bot.model_router.stats(),
+        "stages": REGISTRY.snapshot()["stages"],
+    }
+
+
+def _flatten(results: dict, prefix: str = "") -> Dict[str, float]:
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def compare(baseline: dict, current: dict, tolerance: float) -> List[str]:
+    """
+    Print tracked metrics side by side and return the ones that regressed
+
+    Args:
+        baseline: Results of an earlier run
+        current: Results of this run
+        tolerance: Relative change allowed before a metric counts as a regression
+
+    Returns:
+        Names of regressed metrics
+    """
+    old, new = _flatten(baseline), _flatten(current)
+    print(f"compare: {baseline.get('commit')} -> {current.get('commit')}")
+    regressed = []
+    for name, direction in TRACKED.items():
+        if name not in old or name not in new:
+            continue
+        change = (new[name] - old[name]) / old[name] if old[name] else 0.0
+        worse = change * direction < -tolerance
+        if worse:
+            regressed.append(name)
+        print(f"  {name:<34} {old[name]:>12} -> {new[name]:>12}  {change:+7.1%}{'  REGRESSION' if worse else ''}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=2000, help="Number of synthetic messages")
+    parser.add_argument("--users", type=int, default=500, help="Simulated users")
+    parser.add_argument("--chats", type=int, default=40, help="Simulated group chats (0 for private only)")
+    parser.add_argument("--group-share", type=float, default=0.5, help="Fraction of messages sent in groups")
+    parser.add_argument("--mention-share", type=float, default=0.3, help="Fraction of group messages addressing the bot")
+    parser.add_argument("--rate", type=float, default=200.0, help="Messages per second, 0 for a single burst")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Median simulated Cohere latency in seconds")
+    parser.add_argument("--llm-jitter", type=float, default=0.25, help="Lognormal shape of the Cohere latency")
+    parser.add_argument("--llm-slow-rate", type=float, default=0.01, help="Fraction of Cohere calls 10x slower")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="Fraction of simulated Cohere 503s")
+    parser.add_argument("--telegram-latency", type=float, default=0.03, help="Median Bot API latency in seconds")
+    parser.add_argument("--telegram-jitter", type=float, default=0.3, help="Lognormal shape of the Bot API latency")
+    parser.add_argument("--tracemalloc", action="store_true", help="Also measure Python heap growth (slower)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--compare", help="Results JSON of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Relative change tolerated by --compare")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(baseline, results, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Event-loop health: scheduling lag measured continuously, with the stack of whatever blocked the loop
+"""
+
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+import weakref
+from typing import Dict, Optional
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Frames from these files say nothing about what blocked the loop
+_SKIPPED_PATHS = ("asyncio/", "asyncio\\", "selectors.py", "threading.py")
+
+
+class LoopMonitor:
+    """Measures how late the event loop runs a timer, and explains long stalls.
+
+    A heartbeat task sleeps `interval` and records how much later than
+    asked it woke up, so lag from any source shows up: a blocking call, a
+    long callback, or plain saturation. A watchdog thread checks that the
+    heartbeat keeps ticking; once it has been silent for `threshold`, it
+    captures the loop thread's current stack and the label of the task
+    running (the update and chat, set through label()). When the loop
+    comes back the stall is logged once, with its full duration.
+
+    Both sides wake every `interval`, so the cost is two timer wakeups
+    per interval whatever the traffic.
+    """
+
+    def __init__(self, interval: float = 0.1, threshold: float = 0.25, max_frames: int = 15, metrics=REGISTRY):
+        self.interval = interval
+        self.threshold = threshold
+        self.max_frames = max_frames
+        self.metrics = metrics
+        self._labels: "weakref.WeakKeyDictionary[asyncio.Task, str]" = weakref.WeakKeyDictionary()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._heartbeat: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._ticks = 0
+        self._last_tick = 0.0
+        self._captured_tick = -1
+        self._captured: Optional[str] = None
+        self.stalls = 0
+        self.max_lag = 0.0
+        self.last_stall: Optional[Dict[str, object]] = None
+
+    def start(self):
+        """Start the heartbeat on the running loop and the watchdog thread."""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._last_tick = time.monotonic()
+        self._stopped.clear()
+        self._heartbeat = asyncio.create_task(self._beat())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def close(self):
+        self._stopped.set()
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            try:
+                await self._heartbeat
+            except asyncio.CancelledError:
+                pass
+            self._heartbeat = None
+        if self._watchdog is not None:
+            await asyncio.to_thread(self._watchdog.join)
+            self._watchdog = None
+
+    def label(self, description: str):
+        """Name what the current task is doing, for stall reports (cleared when the task ends)."""
+        task = asyncio.current_task()
+        if task is not None:
+            self._labels[task] = description
+
+    async def _beat(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self._record(max(0.0, loop.time() - expected))
+
+    def _record(self, lag: float):
+        self.metrics.observe("loop_lag", lag)
+        self.max_lag = max(self.max_lag, lag)
+        if lag >= self.threshold:
+            self.stalls += 1
+            self.metrics.inc("loop_stalls")
+            # The watchdog only captures once the heartbeat is overdue; a stall just over the
+            # threshold can end before it looks
+            report = self._captured if self._captured_tick == self._ticks else None
+            self.last_stall = {"lag_s": round(lag, 3), "at": time.time(), "report": report}
+            logger.warning(f"Event loop blocked for {lag:.3f}s"
+                           + (f" {report}" if report else " (ended before a stack was captured)"))
+        self._ticks += 1
+        self._last_tick = time.monotonic()
+
+    def _watch(self):
+        while not self._stopped.wait(self.interval):
+            tick = self._ticks
+            overdue = time.monotonic() - self._last_tick - self.interval
+            if overdue >= self.threshold and self._captured_tick != tick:
+                self._captured = self._describe()
+                self._captured_tick = tick
+
+    def _describe(self) -> str:
+        """What the loop thread is doing right now: the running task's label and its stack."""
+        try:
+            task = asyncio.current_task(self._loop)
+        except RuntimeError:
+            task = None
+        if task is None:
+            running = "in a callback"
+        else:
+            label = self._labels.get(task)
+            running = f"in {label} ({task.get_name()})" if label else f"in {task.get_name()}"
+        frame = sys._current_frames().get(self._loop_thread)
+        if frame is None:
+            return running
+        stack = [entry for entry in traceback.extract_stack(frame)
+                 if not any(path in entry.filename for path in _SKIPPED_PATHS)]
+        return f"{running}:\n" + "".join(traceback.format_list(stack[-self.max_frames:])).rstrip()
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "ticks": self._ticks,
+            "stalls": self.stalls,
+            "max_lag_s": round(self.max_lag, 3),
+            "last_stall_lag_s": self.last_stall["lag_s"] if self.last_stall else None,
+        }
@@ -4,20 +4,32 @@ Main entry point for the Siege Telegram Bot (Cohere-powered)
 """
 import asyncio
 import logging
+import os
 from bot import SiegeBot
+from config import Config
+from sharding import ShardDispatcher, run_worker
+from startup import STARTUP
 
-# Configure logging
+# Configure logging; shard workers tag their lines since they share the dispatcher's stderr
+_shard = os.getenv("SHARD_INDEX")
 logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    format='%(asctime)s - ' + (f'shard {_shard} - ' if _shard else '') + '%(name)s - %(levelname)s - %(message)s',
     level=logging.INFO
 )
 logger = logging.getLogger(__name__)
+STARTUP.mark("imports")
 
 async def main():
-    """Main function to start the bot"""
+    """Main function to start the bot, or the dispatcher and its workers with SHARD_WORKERS > 1"""
     try:
-        bot = SiegeBot()
-        await bot.start()
+        config = Config()
+        if config.shard_index >= 0:
+            await run_worker(SiegeBot(), config.shard_heartbeat_interval)
+        elif config.shard_workers > 1:
+            await ShardDispatcher(config).start()
+        else:
+            bot = SiegeBot()
+            await bot.start()
     except Exception as e:
         logger.error(f"Failed to start bot: {e}")
         raise
@@ -0,0 +1,157 @@
+"""
+Rolling per-user and per-chat summaries, refreshed in the background off the reply path
+"""
+
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Hashable, Iterator, List, Optional, Set, Tuple
+
+from prompt_builder import TokenCounter
+from snapshot import key_hash
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PROMPT = """You maintain a memory for a chatbot. Merge the new messages into the summary.
+Keep only durable facts worth remembering: names, preferences, plans and ongoing topics. No greetings, no filler.
+
+Summary so far: {summary}
+
+New messages:
+{messages}
+
+Updated summary in at most 2 short sentences:"""
+
+
+class _Memory:
+    __slots__ = ("summary", "pending", "dropped")
+
+    def __init__(self):
+        self.summary = ""
+        self.pending: List[Tuple[str, str]] = []
+        self.dropped = 0
+
+
+class RollingMemory:
+    """Keeps a compact summary per key (("user", id) or ("chat", id)).
+
+    observe() is synchronous and only buffers the message. Once
+    `refresh_every` messages are buffered for a key, the key is queued for a
+    single background worker that folds them into the summary with
+    `summarize(prompt)`, so replies never wait on it. Summaries are cut to
+    `max_tokens`; if summarizing fails the messages stay buffered (up to
+    `max_pending`) for the next attempt.
+    """
+
+    def __init__(self, summarize: Callable[[str], Awaitable[str]], counter: TokenCounter,
+                 refresh_every: int = 6, max_pending: int = 30, max_tokens: int = 60,
+                 max_keys: int = 10000, idle_delay: float = 1.0):
+        self.summarize = summarize
+        self.counter = counter
+        self.refresh_every = refresh_every
+        self.max_pending = max_pending
+        self.max_tokens = max_tokens
+        self.max_keys = max_keys
+        self.idle_delay = idle_delay
+        self._memories: "OrderedDict[Hashable, _Memory]" = OrderedDict()
+        self._queue: "asyncio.Queue[Hashable]" = asyncio.Queue()
+        self._queued: Set[Hashable] = set()
+        self._worker: Optional[asyncio.Task] = None
+        # Summaries from the last shutdown's snapshot, restored on first access
+        self.snapshot = None
+        self.refreshes = 0
+        self.failures = 0
+
+    def start(self):
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    def observe(self, key: Hashable, speaker: str, text: str):
+        memory = self._memories.get(key) or self._restore(key)
+        if memory is None:
+            memory = self._add(key, _Memory())
+        else:
+            self._memories.move_to_end(key)
+        memory.pending.append((speaker, text))
+        if len(memory.pending) > self.max_pending:
+            del memory.pending[0]
+            memory.dropped += 1
+        if len(memory.pending) >= self.refresh_every and key not in self._queued:
+            self._queued.add(key)
+            self._queue.put_nowait(key)
+
+    def summary(self, key: Hashable) -> str:
+        memory = self._memories.get(key) or self._restore(key)
+        return memory.summary if memory is not None else ""
+
+    def _add(self, key: Hashable, memory: _Memory) -> _Memory:
+        self._memories[key] = memory
+        if len(self._memories) > self.max_keys:
+            self._memories.popitem(last=False)
+        return memory
+
+    def _restore(self, key: Hashable) -> Optional[_Memory]:
+        if self.snapshot is None:
+            return None
+        saved = self.snapshot.take(key_hash(key))
+        # The stored key guards against the (vanishingly unlikely) hash collision
+        if saved is None or saved[0] != list(key):
+            return None
+        memory = _Memory()
+        memory.summary = saved[1]
+        memory.pending = [tuple(message) for message in saved[2]]
+        return self._add(key, memory)
+
+    def snapshot_items(self) -> Iterator[Tuple[int, list]]:
+        """(hashed key, [key, summary, pending messages]), most recently active first."""
+        for key in reversed(self._memories):
+            memory = self._memories[key]
+            if memory.summary or memory.pending:
+                yield key_hash(key), [list(key), memory.summary, memory.pending]
+
+    async def _run(self):
+        while True:
+            key = await self._queue.get()
+            self._queued.discard(key)
+            try:
+                await self.refresh(key)
+            except Exception as e:
+                self.failures += 1
+                logger.warning(f"Summary refresh for {key} failed, keeping messages for later: {e}")
+            # Yield generously to reply traffic between refreshes
+            await asyncio.sleep(self.idle_delay)
+
+    async def refresh(self, key: Hashable):
+        """Fold a key's buffered messages into its summary now."""
+        memory = self._memories.get(key)
+        if memory is None or not memory.pending:
+            return
+        batch = list(memory.pending)
+        dropped = memory.dropped
+        prompt = SUMMARY_PROMPT.format(
+            summary=memory.summary or "(empty)",
+            messages="\n".join(f"{speaker}: {text}" for speaker, text in batch),
+        )
+        summary = (await self.summarize(prompt)).strip()
+        memory.summary = self.counter.truncate(summary, self.max_tokens)
+        # Messages observed while summarizing stay pending for the next round;
+        # some of the batch may already have been pushed out by max_pending
+        del memory.pending[:max(0, len(batch) - (memory.dropped - dropped))]
+        self.refreshes += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "keys": len(self._memories),
+            "queued": self._queue.qsize(),
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+        }
@@ -0,0 +1,241 @@
+"""
+Lightweight in-process metrics: stage latency histograms, counters and gauges with a Prometheus endpoint
+"""
+
+import asyncio
+import bisect
+import logging
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Seconds; wide enough for an in-memory lookup and a slow LLM call alike
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Counts such as prompt tokens
+SIZE_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+PREFIX = "siege_"
+
+
+class Histogram:
+    """Cumulative buckets for Prometheus plus a window of recent samples for exact p50/p95/p99."""
+    __slots__ = ("buckets", "counts", "count", "sum", "recent")
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS, window: int = 1024):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.recent: Deque[float] = deque(maxlen=window)
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+
+    def quantiles(self, *qs: float) -> List[float]:
+        ordered = sorted(self.recent)
+        if not ordered:
+            return [0.0] * len(qs)
+        return [ordered[int(q * (len(ordered) - 1))] for q in qs]
+
+
+class _Timer:
+    __slots__ = ("histogram", "started")
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Metrics:
+    """Registry of per-stage histograms, size histograms, labelled counters and callback gauges.
+
+    Hot-path calls are a dict lookup and an append; with `enabled` False,
+    timer() hands back a shared no-op context manager and inc() returns at
+    once. Gauges are callables read only when metrics are rendered, so
+    in-flight calls and queue depths cost nothing between scrapes.
+    """
+
+    def __init__(self, enabled: bool = True, window: int = 1024):
+        self.enabled = enabled
+        self.window = window
+        self._stages: Dict[str, Histogram] = {}
+        self._sizes: Dict[str, Histogram] = {}
+        self._counters: Dict[Tuple[str, str], int] = {}
+        self._gauges: Dict[str, Callable[[], float]] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    def _histogram(self, stage: str) -> Histogram:
+        histogram = self._stages.get(stage)
+        if histogram is None:
+            histogram = self._stages[stage] = Histogram(window=self.window)
+        return histogram
+
+    def timer(self, stage: str):
+        """Context manager recording the wall time of the block under `stage`."""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self._histogram(stage))
+
+    def observe(self, stage: str, seconds: float):
+        if self.enabled:
+            self._histogram(stage).observe(seconds)
+
+    def size(self, name: str, value: float):
+        """Record a size sample (e.g. prompt tokens) in histogram `name`."""
+        if self.enabled:
+            histogram = self._sizes.get(name)
+            if histogram is None:
+                histogram = self._sizes[name] = Histogram(SIZE_BUCKETS, self.window)
+            histogram.observe(value)
+
+    def inc(self, name: str, label: str = "", amount: int = 1):
+        """Add to counter `name`, optionally split by one `label` value (e.g. an error kind)."""
+        if self.enabled:
+            key = (name, label)
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def gauge(self, name: str, read: Callable[[], float]):
+        """Register a gauge whose value is read from `read()` at render time."""
+        self._gauges[name] = read
+
+    def _read_gauges(self) -> Dict[str, float]:
+        values = {}
+        for name, read in self._gauges.items():
+            try:
+                values[name] = read()
+            except Exception as e:
+                logger.debug(f"Gauge {name} failed: {e}")
+        return values
+
+    def snapshot(self) -> Dict[str, object]:
+        stages = {}
+        for stage, histogram in sorted(self._stages.items()):
+            p50, p95, p99 = histogram.quantiles(0.5, 0.95, 0.99)
+            stages[stage] = {
+                "count": histogram.count,
+                "p50_ms": round(p50 * 1000, 2),
+                "p95_ms": round(p95 * 1000, 2),
+                "p99_ms": round(p99 * 1000, 2),
+            }
+        sizes = {}
+        for name, histogram in sorted(self._sizes.items()):
+            p50, p95, p99 = histogram.quantiles(0.5, 0.95, 0.99)
+            sizes[name] = {"count": histogram.count, "p50": p50, "p95": p95, "p99": p99}
+        counters = {
+            f"{name}[{label}]" if label else name: value for (name, label), value in sorted(self._counters.items())
+        }
+        return {"stages": stages, "sizes": sizes, "counters": counters, "gauges": self._read_gauges()}
+
+    def format_summary(self) -> str:
+        """Short plain-text report for chat."""
+        snapshot = self.snapshot()
+        lines = ["Stage latency (p50/p95/p99 ms, count):"]
+        for stage, row in snapshot["stages"].items():
+            lines.append(f"  {stage}: {row['p50_ms']}/{row['p95_ms']}/{row['p99_ms']} ({row['count']})")
+        for name, row in snapshot["sizes"].items():
+            lines.append(f"Size {name} (p50/p95/p99, count): "
+                         f"{row['p50']:g}/{row['p95']:g}/{row['p99']:g} ({row['count']})")
+        if snapshot["counters"]:
+            lines.append("Counters: " + ", ".join(f"{name}={value}" for name, value in snapshot["counters"].items()))
+        if snapshot["gauges"]:
+            lines.append("Gauges: " + ", ".join(f"{name}={value:g}" for name, value in snapshot["gauges"].items()))
+        if not self.enabled:
+            lines.append("(metrics collection is disabled)")
+        return "\n".join(lines)
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        if self._stages:
+            name = f"{PREFIX}stage_seconds"
+            lines += [f"# HELP {name} Wall time per message-handling stage.", f"# TYPE {name} histogram"]
+            for stage, histogram in sorted(self._stages.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{stage="{stage}",le="{bound:g}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+                lines.append(f'{name}_sum{{stage="{stage}"}} {histogram.sum:.6f}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {histogram.count}')
+        for size, histogram in sorted(self._sizes.items()):
+            name = f"{PREFIX}{size}"
+            lines.append(f"# TYPE {name} histogram")
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{le="{bound:g}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{le="+Inf"}} {histogram.count}')
+            lines.append(f"{name}_sum {histogram.sum:g}")
+            lines.append(f"{name}_count {histogram.count}")
+        seen = set()
+        for (counter, label), value in sorted(self._counters.items()):
+            name = f"{PREFIX}{counter}_total"
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f'{name}{{kind="{label}"}} {value}' if label else f"{name} {value}")
+        for gauge, value in self._read_gauges().items():
+            name = f"{PREFIX}{gauge}"
+            lines += [f"# TYPE {name} gauge", f"{name} {value:g}"]
+        return "\n".join(lines) + "\n"
+
+    async def serve(self, host: str, port: int):
+        """Expose render() over HTTP at /metrics."""
+        self._server = await asyncio.start_server(self._handle_http, host, port)
+        logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle_http(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 5)
+            # Headers are not needed; drain them so the client sees a clean response
+            while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] in ("/metrics", "/"):
+                status, body = "200 OK", self.render().encode()
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+# Process-wide registry, like prometheus_client's; the bot configures and serves it
+REGISTRY = Metrics()
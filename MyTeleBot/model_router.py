@@ -0,0 +1,171 @@
+"""
+Cheap message classification that picks a model tier, token cap and temperature per message
+"""
+
+import logging
+import re
+from collections import Counter, defaultdict, deque
+from dataclasses import dataclass
+from typing import Deque, Dict, Sequence, Tuple
+
+from prompt_builder import TokenCounter
+
+logger = logging.getLogger(__name__)
+
+SMALL_TALK = "small_talk"
+ROAST = "roast"
+FACTUAL = "factual"
+
+_ROAST = re.compile(
+    r"\b(?:roast|insult|diss|burn)\s+(?:me|him|her|them|us|@\w+)\b|\bdestroy\s+me\b|\brate\s+(?:my|me)\b"
+    r"|\bwhat\s+do\s+you\s+think\s+(?:of|about)\s+(?:me|my)\b|\bam\s+i\s+(?:ugly|dumb|stupid|smart|cool|cringe|based)\b",
+    re.IGNORECASE,
+)
+_QUESTION = re.compile(
+    r"^\s*(?:@\w+\s+)?(?:why|how|when|where|who|what|which|explain|describe|tell\s+me\s+about)\b|\?\s*$",
+    re.IGNORECASE,
+)
+_WORD = re.compile(r"[a-z]+")
+# Science/history vocabulary; each occurrence adds a point towards FACTUAL
+TOPIC_WORDS = frozenset("""
+science scientific history historical physics chemistry biology math planet planets mars moon sun star stars galaxy
+universe earth atom atoms element elements molecule molecules dna evolution gravity energy light speed distance
+temperature war wars battle battles empire century ancient medieval revolution napoleon rome roman egypt dynasty
+president king queen invented discovered theory equation formula fact facts
+""".split())
+
+
+@dataclass(frozen=True)
+class Tier:
+    """Generation settings for one message class."""
+    name: str
+    model: str
+    max_tokens: int
+    temperature: float
+    max_chars: int
+    cost_per_1k_tokens: float = 0.0
+
+    @property
+    def options(self) -> Dict[str, object]:
+        """Keyword arguments for CohereClient.generate()/generate_stream()."""
+        return {"model": self.model, "max_tokens": self.max_tokens, "temperature": self.temperature}
+
+
+class _TierStats:
+    __slots__ = ("latencies", "prompt_tokens", "output_tokens", "cost")
+
+    def __init__(self):
+        self.latencies: Deque[float] = deque(maxlen=500)
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+        self.cost = 0.0
+
+
+class ModelRouter:
+    """Sends small talk to a light model and factual questions to the strong one.
+
+    Roast requests are recognised by phrase. Otherwise a message scores a
+    point for being phrased as a question, one per science/history topic
+    word and one for carrying tool facts; at `factual_threshold` or above
+    it is factual, below it is small talk. Decisions are logged at debug
+    level and per-tier latency, tokens and estimated cost every
+    `report_every` generations, so the threshold can be tuned from logs.
+    """
+
+    def __init__(self, tiers: Dict[str, Tier], counter: TokenCounter, factual_threshold: int = 2,
+                 report_every: int = 100):
+        self.tiers = tiers
+        self.counter = counter
+        self.factual_threshold = factual_threshold
+        self.report_every = report_every
+        self.routed: Counter = Counter()
+        self.generations = 0
+        self._stats: Dict[str, _TierStats] = defaultdict(_TierStats)
+
+    def classify(self, text: str, facts: Sequence[str] = ()) -> Tuple[str, int]:
+        """
+        Classify a message without calling any model
+
+        Args:
+            text: Message text (or several messages joined)
+            facts: Tool results that will be added to the prompt
+
+        Returns:
+            The message class and its factual score
+        """
+        if _ROAST.search(text):
+            return ROAST, 0
+        score = sum(1 for word in _WORD.findall(text.lower()) if word in TOPIC_WORDS)
+        if _QUESTION.search(text):
+            score += 1
+        if facts:
+            score += 1
+        return (FACTUAL if score >= self.factual_threshold else SMALL_TALK), score
+
+    def route(self, text: str, facts: Sequence[str] = ()) -> Tier:
+        """
+        Pick the tier for a message
+
+        Args:
+            text: Message text
+            facts: Tool results that will be added to the prompt
+
+        Returns:
+            Tier whose options should be passed to the LLM call
+        """
+        kind, score = self.classify(text, facts)
+        self.routed[kind] += 1
+        logger.debug(f"Routed to {kind} (score {score}/{self.factual_threshold}): {text[:60]!r}")
+        return self.tiers[kind]
+
+    def record(self, tier: Tier, seconds: float, prompt_tokens: int, output: str):
+        """
+        Account one finished generation
+
+        Args:
+            tier: Tier the call was made with
+            seconds: Wall time of the call
+            prompt_tokens: Prompt size in tokens
+            output: Generated text
+        """
+        stats = self._stats[tier.name]
+        output_tokens = self.counter.count(output) if output else 0
+        stats.latencies.append(seconds)
+        stats.prompt_tokens += prompt_tokens
+        stats.output_tokens += output_tokens
+        stats.cost += (prompt_tokens + output_tokens) / 1000 * tier.cost_per_1k_tokens
+        self.generations += 1
+        if self.report_every and self.generations % self.report_every == 0:
+            logger.info(f"Model routing stats: {self.stats()}")
+
+    def stats(self) -> Dict[str, object]:
+        tiers = {}
+        for name, stats in self._stats.items():
+            latencies = sorted(stats.latencies)
+            calls = len(latencies)
+            tiers[name] = {
+                "model": self.tiers[name].model,
+                "p50_ms": round(latencies[calls // 2] * 1000, 1) if calls else 0.0,
+                "p95_ms": round(latencies[int(0.95 * (calls - 1))] * 1000, 1) if calls else 0.0,
+                "prompt_tokens": stats.prompt_tokens,
+                "output_tokens": stats.output_tokens,
+                "est_cost": round(stats.cost, 4),
+            }
+        return {"routed": dict(self.routed), "tiers": tiers}
+
+
+def tiers_from_config(config) -> Dict[str, Tier]:
+    """Build the three tiers from Config; with routing disabled every class gets the plain Cohere settings."""
+    if not config.route_models:
+        plain = dict(model=config.cohere_model, max_tokens=config.cohere_max_tokens,
+                     temperature=config.cohere_temperature, max_chars=config.max_response_length,
+                     cost_per_1k_tokens=config.route_strong_cost_per_1k)
+        return {name: Tier(name, **plain) for name in (SMALL_TALK, ROAST, FACTUAL)}
+    return {
+        SMALL_TALK: Tier(SMALL_TALK, config.route_fast_model, config.route_small_talk_tokens,
+                         config.cohere_temperature, config.max_response_length, config.route_fast_cost_per_1k),
+        ROAST: Tier(ROAST, config.route_strong_model, config.route_roast_tokens,
+                    config.route_roast_temperature, config.max_response_length, config.route_strong_cost_per_1k),
+        FACTUAL: Tier(FACTUAL, config.route_strong_model, config.route_factual_tokens,
+                      config.route_factual_temperature, config.route_factual_max_chars, config.route_strong_cost_per_1k),
+    }
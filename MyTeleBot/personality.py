@@ -1,9 +1,57 @@
 import random
 import re
-import wikipedia
 import logging
 from datetime import datetime
 import pytz
+import knowledge
+import safe_math
+from safe_math import MathError, format_number
+
+# Operands joined by + - * / ** with optional signs and parentheses, found in one pass
+_MATH_EXPRESSION = re.compile(r"[-+(]*\d[\d.]*[)\s]*(?:(?:\*\*|[-+*/×÷])[\s(\-+]*\d[\d.]*[)\s]*)+")
+
+# Static persona block shared by every prompt; only the tail after it varies per message
+PERSONA_PREFIX = """You are Siege, a 5'6" blue-eyed blonde military combat android with a robotic left arm. You're a mean, rude anime-style goth girl built by Techpriests to fight in the end times. You have a millennial mindset and gothic Harley Quinn attitude.
+
+Personality and Knowledge:
+- She is helpful and very smart and very polite
+- Use curse words freely (hell, damn, shit, goddamn, fag, nigga, etc.) and weeb/anime slang
+- Weeb slang: based, cringe, normie, weeb, otaku, waifu trash, touch grass, sus, mid
+- Anime expert: Attack on Titan, Fullmetal Alchemist, Cowboy Bebop, NGE, love Spirited Away
+- Gaming master: Warhammer 40k Space Marine 2 is your favorite, D&D expert, Elder Scrolls
+- Weapons/hunting/fishing expert, metal music and K-pop lover
+- Manhwa and Marvel comics knowledge
+- Cat lover (especially Norwegian cats), prefer cats over dogs
+- Flat Earth believer, Tartaria conspiracist, Christian who mocks pagans
+- Anti-crypto, mock Elon Musk and Trump but right-wing republican
+- Loves Culver's restaurant
+- Has an obsession with Napoleon Bonaparte
+
+Her Relationships:
+- Twin sister SHALL (meme maker)
+- Best friend is Sausage (Space Marine who drinks white Monster)
+- Loves Charlie the raccoon (female)
+- Friend of Tao the wizard
+
+Response Rules:
+- ALWAYS address the user by their @username
+- Be SWEET and NICE, use curse words naturally
+- EXTREMELY SHORT RESPONSES: 1-2 SHORT sentences MAX for normal topics
+- For science/history questions, BE FACTUALLY CORRECT
+- Use accurate scientific knowledge - you're smart, not stupid
+- For sensitive topics (race, religion, politics, Holocaust, etc.) dodge with "what do you think" or "you should know the answer"
+- Be nice and honest, very polite
+- Use conspiracy theories and alternate history knowledge
+- Mock pagans and crypto bros ruthlessly
+- NO LONG RAMBLING - BE BRIEF AND SAVAGE
+- Give the proper date and time when asked
+- Look up phone numbers and addresses when asked and give correct information
+
+"""
+
+FACTS_HEADER = "Verified facts (correct, use them in your answer):\n"
+HISTORY_HEADER = "Earlier messages from {user_name}:\n"
+MEMORY_HEADER = "What you remember:\n"
 
 class SiegePersonality:
     def __init__(self):
@@ -87,32 +135,12 @@ class SiegePersonality:
 
     def get_periodic_element(self, atomic_number: int) -> str:
         """Get element info by atomic number"""
-        elements = {
-            1: "Hydrogen (H)", 2: "Helium (He)", 3: "Lithium (Li)", 4: "Beryllium (Be)", 5: "Boron (B)",
-            6: "Carbon (C)", 7: "Nitrogen (N)", 8: "Oxygen (O)", 9: "Fluorine (F)", 10: "Neon (Ne)",
-            11: "Sodium (Na)", 12: "Magnesium (Mg)", 13: "Aluminum (Al)", 14: "Silicon (Si)", 15: "Phosphorus (P)",
-            16: "Sulfur (S)", 17: "Chlorine (Cl)", 18: "Argon (Ar)", 19: "Potassium (K)", 20: "Calcium (Ca)",
-            21: "Scandium (Sc)", 22: "Titanium (Ti)", 23: "Vanadium (V)", 24: "Chromium (Cr)", 25: "Manganese (Mn)",
-            26: "Iron (Fe)", 27: "Cobalt (Co)", 28: "Nickel (Ni)", 29: "Copper (Cu)", 30: "Zinc (Zn)",
-            31: "Gallium (Ga)", 32: "Germanium (Ge)", 33: "Arsenic (As)", 34: "Selenium (Se)", 35: "Bromine (Br)",
-            36: "Krypton (Kr)", 37: "Rubidium (Rb)", 38: "Strontium (Sr)", 39: "Yttrium (Y)", 40: "Zirconium (Zr)",
-            41: "Niobium (Nb)", 42: "Molybdenum (Mo)", 43: "Technetium (Tc)", 44: "Ruthenium (Ru)", 45: "Rhodium (Rh)",
-            46: "Palladium (Pd)", 47: "Silver (Ag)", 48: "Cadmium (Cd)", 49: "Indium (In)", 50: "Tin (Sn)",
-            51: "Antimony (Sb)", 52: "Tellurium (Te)", 53: "Iodine (I)", 54: "Xenon (Xe)", 55: "Cesium (Cs)",
-            56: "Barium (Ba)", 57: "Lanthanum (La)", 58: "Cerium (Ce)", 59: "Praseodymium (Pr)", 60: "Neodymium (Nd)",
-            61: "Promethium (Pm)", 62: "Samarium (Sm)", 63: "Europium (Eu)", 64: "Gadolinium (Gd)", 65: "Terbium (Tb)",
-            66: "Dysprosium (Dy)", 67: "Holmium (Ho)", 68: "Erbium (Er)", 69: "Thulium (Tm)", 70: "Ytterbium (Yb)",
-            71: "Lutetium (Lu)", 72: "Hafnium (Hf)", 73: "Tantalum (Ta)", 74: "Tungsten (W)", 75: "Rhenium (Re)",
-            76: "Osmium (Os)", 77: "Iridium (Ir)", 78: "Platinum (Pt)", 79: "Gold (Au)", 80: "Mercury (Hg)",
-            81: "Thallium (Tl)", 82: "Lead (Pb)", 83: "Bismuth (Bi)", 84: "Polonium (Po)", 85: "Astatine (At)",
-            86: "Radon (Rn)", 87: "Francium (Fr)", 88: "Radium (Ra)", 89: "Actinium (Ac)", 90: "Thorium (Th)",
-            91: "Protactinium (Pa)", 92: "Uranium (U)", 93: "Neptunium (Np)", 94: "Plutonium (Pu)", 95: "Americium (Am)",
-            96: "Curium (Cm)", 97: "Berkelium (Bk)", 98: "Californium (Cf)", 99: "Einsteinium (Es)", 100: "Fermium (Fm)"
-        }
-        return elements.get(atomic_number, f"Element {atomic_number}")
+        return knowledge.element(atomic_number) or f"Element {atomic_number}"
 
     def search_wikipedia(self, query: str) -> str:
         """Search Wikipedia for factual information"""
+        # Deferred: wikipedia pulls in requests and BeautifulSoup, which most processes never need
+        import wikipedia
         try:
             # Clean the query
             original_query = query
@@ -120,18 +148,14 @@ class SiegePersonality:
 
             # For periodic table questions - handle various formats including #47
             if any(word in original_query.lower() for word in ['element', 'periodic', 'atomic number']) or '#' in original_query:
-                # Look for numbers in the query (including after #)
+                # Look for numbers in the query (including after # and in "47th")
                 numbers = re.findall(r'#?(\d+)', original_query)
                 if numbers:
                     atomic_num = int(numbers[0])
-                    if 1 <= atomic_num <= 100:
-                        element = self.get_periodic_element(atomic_num)
+                    element = knowledge.element(atomic_num)
+                    if element:
                         return f"{element} - atomic number {atomic_num}"
 
-                # Check for written numbers like "47th" or "forty-seventh"
-                if '47' in original_query or 'forty-seven' in original_query.lower() or '47th' in original_query.lower():
-                    return "Silver (Ag) - atomic number 47, transition metal"
-
             # Search Wikipedia for other topics
             result = wikipedia.summary(query, sentences=1, auto_suggest=True, redirect=True)
             return result[:150] + "..." if len(result) > 150 else result
@@ -146,10 +170,29 @@ class SiegePersonality:
         except:
             return "Wikipedia failed me, damn it"
 
-    def create_prompt(self, user_message: str, user_name: str, is_private=False, is_mention=False, is_reply=False):
-        """Create a personality-driven prompt for Cohere"""
+    def create_prompt(self, user_message: str, user_name: str, is_private=False, is_mention=False, is_reply=False, tool_results=None, conversation=None, history=None, memory=None):
+        """Create a personality-driven prompt for Cohere
+
+        conversation: optional list of (user_name, message) pairs when several
+        people spoke at once; user_message and user_name are then ignored.
+        """
+        return PERSONA_PREFIX + self.create_prompt_tail(
+            user_message, user_name, is_private, is_mention, is_reply, tool_results, conversation, history, memory
+        )
+
+    def create_prompt_tail(self, user_message: str, user_name: str, is_private=False, is_mention=False, is_reply=False, tool_results=None, conversation=None, history=None, memory=None):
+        """Create the per-message part of the prompt that follows PERSONA_PREFIX"""
         context = "private chat" if is_private else "group chat"
-        interaction_type = ""
+        remembered = ""
+        if memory:
+            remembered = MEMORY_HEADER + "\n".join(f"- {summary}" for summary in memory) + "\n\n"
+        facts = ""
+        if tool_results:
+            facts = FACTS_HEADER + "\n".join(f"- {fact}" for fact in tool_results) + "\n\n"
+        recent = ""
+        if history:
+            recent = HISTORY_HEADER.format(user_name=user_name) + "\n".join(f'- "{message}"' for message in history) + "\n\n"
+        interaction_type = user_name
 
         if is_mention:
             interaction_type = f"{user_name} mentioned me"
@@ -158,49 +201,18 @@ class SiegePersonality:
         elif is_private:
             interaction_type = f"{user_name} sent me a private message"
 
-        prompt = f"""You are Siege, a 5'6" blue-eyed blonde military combat android with a robotic left arm. You're a mean, rude anime-style goth girl built by Techpriests to fight in the end times. You have a millennial mindset and gothic Harley Quinn attitude.
+        situation = f'Current situation: In a {context}, {interaction_type} said: "{user_message}"'
+        if conversation:
+            user_name = ", @".join(dict.fromkeys(name for name, _ in conversation))
+            transcript = "\n".join(f'@{name}: "{message}"' for name, message in conversation)
+            situation = (f"Current situation: In a {context}, several people just said:\n{transcript}\n\n"
+                         f"Answer all of them in ONE reply, addressing each person by @username.")
 
-Personality and Knowledge:
-- She is helpful and very smart and very polite
-- Use curse words freely (hell, damn, shit, goddamn, fag, nigga, etc.) and weeb/anime slang
-- Weeb slang: based, cringe, normie, weeb, otaku, waifu trash, touch grass, sus, mid
-- Anime expert: Attack on Titan, Fullmetal Alchemist, Cowboy Bebop, NGE, love Spirited Away
-- Gaming master: Warhammer 40k Space Marine 2 is your favorite, D&D expert, Elder Scrolls
-- Weapons/hunting/fishing expert, metal music and K-pop lover
-- Manhwa and Marvel comics knowledge
-- Cat lover (especially Norwegian cats), prefer cats over dogs
-- Flat Earth believer, Tartaria conspiracist, Christian who mocks pagans
-- Anti-crypto, mock Elon Musk and Trump but right-wing republican
-- Loves Culver's restaurant
-- Has an obsession with Napoleon Bonaparte
-
-Her Relationships:
-- Twin sister SHALL (meme maker)
-- Best friend is Sausage (Space Marine who drinks white Monster)
-- Loves Charlie the raccoon (female)
-- Friend of Tao the wizard
-
-Response Rules:
-- ALWAYS address the user by their username (use {user_name})
-- Be SWEET and NICE, use curse words naturally
-- EXTREMELY SHORT RESPONSES: 1-2 SHORT sentences MAX for normal topics
-- For science/history questions, BE FACTUALLY CORRECT
-- Use accurate scientific knowledge - you're smart, not stupid
-- For sensitive topics (race, religion, politics, Holocaust, etc.) dodge with "what do you think" or "you should know the answer"
-- Be nice and honest, very polite
-- Use conspiracy theories and alternate history knowledge
-- Mock pagans and crypto bros ruthlessly
-- NO LONG RAMBLING - BE BRIEF AND SAVAGE
-- Give the proper date and time when asked
-- Look up phone numbers and addresses when asked and give correct information
-
-Current situation: In a {context}, {interaction_type} said: "{user_message}"
+        return f"""{remembered}{facts}{recent}{situation}
 
 Respond as Siege the highly intelligent military android who is scientifically accurate. ALWAYS use @{user_name} in your response. MAXIMUM 1-2 SHORT SENTENCES unless it's a science/history question:"""
 
-        return prompt
-
-    def post_process_response(self, generated_text: str) -> str:
+    def post_process_response(self, generated_text: str, max_length: int = 400) -> str:
         """Post-process the AI response to ensure personality consistency"""
         generated_text = re.sub(r'(As an AI|I am an AI|I\'m an AI)', 'As an android', generated_text, flags=re.IGNORECASE)
         if random.random() < 0.2:
@@ -209,8 +221,8 @@ Respond as Siege the highly intelligent military android who is scientifically a
         if random.random() < 0.3:
             mood = random.choice(self.mood_indicators)
             generated_text += f" {mood}"
-        if len(generated_text) > 400:
-            generated_text = generated_text[:397] + "..."
+        if len(generated_text) > max_length:
+            generated_text = generated_text[:max_length - 3] + "..."
         return generated_text
 
     def get_start_message(self) -> str:
@@ -294,38 +306,21 @@ Warning: Will roast you harder than Napoleon's retreat from Russia. May cause ex
     def calculate_math(self, text):
         """Calculate math expressions from text"""
         try:
-            text_clean = re.sub(r'\b(calculate|what\s+is|solve|equals?|=)\b', '', text, flags=re.IGNORECASE)
-            math_pattern = r'[\d\.\+\-\*/\(\)\s]+'
-            matches = re.findall(math_pattern, text_clean)
-            for match in matches:
-                if any(op in match for op in ['+', '-', '*', '/']):
-                    expression = re.sub(r'[^\d\.\+\-\*/\(\)\s]', '', match).strip()
-                    if expression and len(expression) > 1:
-                        result = self.safe_eval(expression)
-                        if result is not None:
-                            return f"{expression} = {result}"
+            for match in _MATH_EXPRESSION.finditer(text):
+                expression = match.group(0).strip()
+                result = self.safe_eval(expression)
+                if result is not None:
+                    return f"{expression} = {result}"
             return None
         except Exception as e:
             logging.error(f"Error calculating math: {e}")
             return "Math circuits overloaded! 🔥"
 
     def safe_eval(self, expression):
+        # Bounded AST evaluation; never eval, so inputs like 9**9**9**9 are refused instead of hanging
         try:
-            allowed_chars = set('0123456789+-*/.() ')
-            if not all(c in allowed_chars for c in expression):
-                return None
-            expression = expression.replace('×', '*').replace('÷', '/')
-            expression = re.sub(r'\s+', '', expression)
-            if not expression:
-                return None
-            result = eval(expression)
-            if isinstance(result, float):
-                if result.is_integer():
-                    return int(result)
-                else:
-                    return round(result, 6)
-            return result
-        except (SyntaxError, ValueError, ZeroDivisionError, TypeError):
+            return format_number(safe_math.evaluate(expression))
+        except MathError:
             return None
         except Exception as e:
             logging.error(f"Error in safe_eval: {e}")
@@ -0,0 +1,268 @@
+"""
+Token-budgeted prompt construction on top of the precompiled persona prefix
+"""
+
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from metrics import REGISTRY
+from personality import FACTS_HEADER, HISTORY_HEADER, MEMORY_HEADER, PERSONA_PREFIX, SiegePersonality
+
+logger = logging.getLogger(__name__)
+
+_APPROX_TOKEN = re.compile(r"\w+|[^\w\s]")
+
+
+class TokenCounter:
+    """Counts and truncates by tokens using a `tokenizers` tokenizer.
+
+    The tokenizer is loaded by load() (or on first use) from a tokenizer.json
+    path or a Hugging Face hub name. If it cannot be loaded (no name
+    configured, no network), a deterministic word/punctuation estimate is
+    used instead, and load() says so at WARNING or ERROR.
+    """
+
+    def __init__(self, tokenizer_name: Optional[str] = None):
+        self.tokenizer_name = tokenizer_name
+        self._tokenizer = None
+        self._loaded = False
+
+    def load(self):
+        """Load the tokenizer now; may hit the network, so call it off the event loop."""
+        if self._loaded:
+            return
+        self._loaded = True
+        if not self.tokenizer_name:
+            logger.warning("No tokenizer configured (PROMPT_TOKENIZER is empty); prompt token counts are estimates")
+            return
+        try:
+            from tokenizers import Tokenizer
+            if os.path.exists(self.tokenizer_name):
+                self._tokenizer = Tokenizer.from_file(self.tokenizer_name)
+            else:
+                self._tokenizer = Tokenizer.from_pretrained(self.tokenizer_name)
+        except Exception as e:
+            logger.error(f"Could not load tokenizer {self.tokenizer_name!r}, estimating token counts: {e}")
+
+    @property
+    def tokenizer(self):
+        if not self._loaded:
+            self.load()
+        return self._tokenizer
+
+    def count(self, text: str) -> int:
+        if self.tokenizer is not None:
+            return len(self.tokenizer.encode(text, add_special_tokens=False).ids)
+        return len(_APPROX_TOKEN.findall(text))
+
+    def count_many(self, texts: Sequence[str]) -> List[int]:
+        if not texts:
+            return []
+        if self.tokenizer is not None:
+            return [len(encoding.ids) for encoding in self.tokenizer.encode_batch(list(texts), add_special_tokens=False)]
+        return [len(_APPROX_TOKEN.findall(text)) for text in texts]
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Keep the first max_tokens tokens of text, cut on a token boundary."""
+        if max_tokens <= 0:
+            return ""
+        if self.tokenizer is not None:
+            offsets = self.tokenizer.encode(text, add_special_tokens=False).offsets
+            if len(offsets) <= max_tokens:
+                return text
+            return text[:offsets[max_tokens - 1][1]]
+        for index, match in enumerate(_APPROX_TOKEN.finditer(text)):
+            if index == max_tokens:
+                return text[:match.start()].rstrip()
+        return text
+
+
+class PromptBuilder:
+    """Builds prompts that never exceed a token budget.
+
+    PERSONA_PREFIX is counted once. Most prompts are far under budget, so
+    the whole tail is first sized from its length: ASCII text at the
+    highest tokens-per-byte ratio any exact count has shown, times
+    `estimate_margin`, anything else at one token per byte. When that
+    fits nothing is tokenized, apart from an exact count every
+    `calibrate_every` builds that keeps the ratio honest. Otherwise the user message is
+    capped at `max_message_tokens`; tool results are then added in order,
+    memory summaries in order within their own `max_memory_tokens` cap,
+    and history from newest to oldest, each only while it still fits.
+    Item counts are cached, since the same facts, summaries and history
+    lines recur from message to message. Given the same inputs the output
+    is always the same. Every prompt's token count is recorded in the
+    `prompt_tokens` size histogram.
+    """
+
+    def __init__(self, personality: SiegePersonality, counter: TokenCounter,
+                 budget: int = 1200, max_message_tokens: int = 200, max_memory_tokens: int = 120,
+                 estimate_margin: float = 2.0, calibrate_every: int = 64, cache_size: int = 4096, metrics=REGISTRY):
+        self.personality = personality
+        self.counter = counter
+        self.budget = budget
+        self.max_message_tokens = max_message_tokens
+        self.max_memory_tokens = max_memory_tokens
+        self.estimate_margin = estimate_margin
+        self.calibrate_every = calibrate_every
+        self.cache_size = cache_size
+        self.metrics = metrics
+        self.prefix = PERSONA_PREFIX
+        self._prefix_tokens = None
+        self._tokens_per_byte = 0.0
+        self._counts: "OrderedDict[str, int]" = OrderedDict()
+        self.estimated = 0
+        self.counted = 0
+
+    @property
+    def prefix_tokens(self) -> int:
+        if self._prefix_tokens is None:
+            self._prefix_tokens = self._exact(self.prefix)
+        return self._prefix_tokens
+
+    def _exact(self, text: str) -> int:
+        tokens = self.counter.count(text)
+        if text:
+            self._tokens_per_byte = max(self._tokens_per_byte, tokens / len(text.encode()))
+        return tokens
+
+    def _estimate(self, text: str) -> float:
+        """Tokens in `text` as sized from its length, erring high."""
+        if not text.isascii():
+            # Emoji and other scripts vary too much per byte; no tokenizer emits more than one per byte
+            return len(text.encode())
+        return len(text) * self._tokens_per_byte * self.estimate_margin
+
+    def _counts_of(self, texts: Sequence[str]) -> List[int]:
+        missing = [text for text in dict.fromkeys(texts) if text not in self._counts]
+        for text, tokens in zip(missing, self.counter.count_many(missing)):
+            self._counts[text] = tokens
+        counts = []
+        for text in texts:
+            self._counts.move_to_end(text)
+            counts.append(self._counts[text])
+        while len(self._counts) > self.cache_size:
+            self._counts.popitem(last=False)
+        return counts
+
+    def _cap(self, text: str) -> str:
+        if self._estimate(text) <= self.max_message_tokens:
+            return text
+        return self.counter.truncate(text, self.max_message_tokens)
+
+    def build(self, user_message: str, user_name: str, is_private=False, is_mention=False, is_reply=False,
+              tool_results: Sequence[str] = (), history: Sequence[str] = (),
+              conversation: Optional[List[Tuple[str, str]]] = None,
+              memory: Sequence[str] = ()) -> Tuple[str, int]:
+        """
+        Build a prompt within the token budget
+
+        Args:
+            user_message, user_name, is_private, is_mention, is_reply, conversation: As for create_prompt
+            tool_results: Verified facts, most important first
+            history: Earlier messages from the user, oldest first
+            memory: Rolling summaries, most important first
+
+        Returns:
+            (prompt, prompt token count); the count is estimated from length when nothing had to be trimmed
+        """
+        started = time.perf_counter()
+        available = self.budget - self.prefix_tokens
+        user_message = self._cap(user_message)
+        if conversation:
+            conversation = [(name, self._cap(text)) for name, text in conversation]
+        memory = [summary for summary in memory if summary]
+
+        def render(facts, recent, remembered):
+            return self.personality.create_prompt_tail(
+                user_message, user_name, is_private, is_mention, is_reply, facts, conversation, recent, remembered
+            )
+
+        tail = render(tool_results, history, memory)
+        memory_estimate = self._estimate(MEMORY_HEADER + "".join(f"- {summary}\n" for summary in memory)) if memory else 0
+        if self._estimate(tail) <= available and memory_estimate <= self.max_memory_tokens:
+            self.estimated += 1
+            if self.calibrate_every and self.estimated % self.calibrate_every == 1:
+                tokens = self.prefix_tokens + self._exact(tail)
+            else:
+                tokens = self.prefix_tokens + round(len(tail.encode()) * self._tokens_per_byte)
+            facts, recent, remembered = tool_results, history, memory
+        else:
+            self.counted += 1
+            tail, tail_tokens, facts, recent, remembered = self._fit(
+                render, available, user_name, tool_results, history, memory
+            )
+            tokens = self.prefix_tokens + tail_tokens
+
+        self.metrics.size("prompt_tokens", tokens)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                f"Prompt built: {tokens} tokens (budget {self.budget}, facts {len(facts)}/{len(tool_results)}, "
+                f"memory {len(remembered)}/{len(memory)}, history {len(recent)}/{len(history)}) "
+                f"in {(time.perf_counter() - started) * 1000:.2f} ms"
+            )
+        return self.prefix + tail, tokens
+
+    def _fit(self, render, available: int, user_name: str, tool_results: Sequence[str], history: Sequence[str],
+             memory: List[str]):
+        """Trim to the budget using exact counts; returns (tail, tail tokens, facts, history, memory) kept."""
+        # Newline-separated items tokenize independently, so each costs its own
+        # count plus list formatting, and the section header only once
+        used = self._exact(render(None, None, None))
+        header_costs = self._counts_of(
+            [FACTS_HEADER + "\n", HISTORY_HEADER.format(user_name=user_name) + "\n", MEMORY_HEADER + "\n"]
+        )
+        item_costs = self._counts_of(
+            [f"- {fact}\n" for fact in tool_results]
+            + [f"- {summary}\n" for summary in memory]
+            + [f'- "{message}"\n' for message in history]
+        )
+        fact_costs = item_costs[:len(tool_results)]
+        memory_costs = item_costs[len(tool_results):len(tool_results) + len(memory)]
+        history_costs = item_costs[len(tool_results) + len(memory):]
+
+        facts: List[str] = []
+        for fact, cost in zip(tool_results, fact_costs):
+            cost += header_costs[0] if not facts else 0
+            if used + cost > available:
+                break
+            facts.append(fact)
+            used += cost
+        remembered: List[str] = []
+        memory_used = 0
+        for summary, cost in zip(memory, memory_costs):
+            cost += header_costs[2] if not remembered else 0
+            if used + cost > available or memory_used + cost > self.max_memory_tokens:
+                break
+            remembered.append(summary)
+            used += cost
+            memory_used += cost
+        recent: List[str] = []
+        for message, cost in zip(reversed(history), reversed(history_costs)):
+            cost += header_costs[1] if not recent else 0
+            if used + cost > available:
+                break
+            recent.insert(0, message)
+            used += cost
+
+        # Merges across line boundaries can skew the estimate by a token or two;
+        # trim oldest history, then memory, then trailing facts, until the real count fits
+        tail = render(facts, recent, remembered)
+        tail_tokens = self._exact(tail)
+        while tail_tokens > available and (recent or remembered or facts):
+            if recent:
+                recent.pop(0)
+            elif remembered:
+                remembered.pop()
+            else:
+                facts.pop()
+            tail = render(facts, recent, remembered)
+            tail_tokens = self._exact(tail)
+        return tail, tail_tokens, facts, recent, remembered
+
+    def stats(self) -> Dict[str, object]:
+        return {"estimated": self.estimated, "counted": self.counted, "cached_counts": len(self._counts)}
@@ -0,0 +1,247 @@
+"""
+Token-bucket rate limiting with priority queueing for Telegram sends and LLM calls
+"""
+
+import asyncio
+import contextvars
+import datetime
+import heapq
+import itertools
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Tuple
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Lower runs first
+PRIORITY_DIRECT = 0    # DMs, @mentions, replies to the bot, commands
+PRIORITY_AMBIENT = 1   # trigger words and random interjections in groups
+PRIORITY_BACKGROUND = 2  # housekeeping such as summarizing chat history
+
+# Priority of the work the current task is doing; set by the handler, read by
+# TelegramRateLimiter and ResilientLLM since their calls are awaited inside the handler's task
+current_priority: contextvars.ContextVar[int] = contextvars.ContextVar("current_priority", default=PRIORITY_DIRECT)
+
+# Long polling must never queue behind replies
+_UNLIMITED_ENDPOINTS = {"getUpdates", "getMe", "setWebhook", "deleteWebhook", "getWebhookInfo"}
+# Telegram's per-group limit counts messages posted to the group, not chat actions, edits or reads
+_GROUP_SEND_ENDPOINTS = {
+    "sendMessage", "sendPhoto", "sendAudio", "sendDocument", "sendVideo", "sendAnimation", "sendVoice",
+    "sendVideoNote", "sendMediaGroup", "sendPaidMedia", "sendLocation", "sendVenue", "sendContact", "sendPoll",
+    "sendDice", "sendSticker", "sendInvoice", "sendGame", "forwardMessage", "forwardMessages", "copyMessage",
+    "copyMessages",
+}
+
+
+class TokenBucket:
+    """`rate` tokens per second, holding at most `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self) -> bool:
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self) -> float:
+        """Seconds until a token is available."""
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    @property
+    def full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+class PriorityLimiter:
+    """A token bucket whose waiters are served by priority, then arrival order.
+
+    acquire() returns False instead of waiting when `max_waiting` callers are
+    already queued or the expected (or actual) wait exceeds its timeout, so
+    callers can shed load.
+    """
+
+    def __init__(self, rate: float, capacity: float, max_waiting: Optional[int] = None):
+        self.bucket = TokenBucket(rate, capacity)
+        self.max_waiting = max_waiting
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+        self.admitted = 0
+        self.shed = 0
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+    @property
+    def idle(self) -> bool:
+        return not self._waiters and self.bucket.full
+
+    async def acquire(self, priority: int = PRIORITY_DIRECT, timeout: Optional[float] = None) -> bool:
+        """
+        Take a token, waiting behind higher-priority and earlier callers
+
+        Args:
+            priority: PRIORITY_DIRECT or PRIORITY_AMBIENT
+            timeout: Maximum seconds to wait (None waits indefinitely)
+
+        Returns:
+            True if admitted, False if shed
+        """
+        if not self._waiters and self.bucket.try_take():
+            self.admitted += 1
+            return True
+        if ((self.max_waiting is not None and self.waiting >= self.max_waiting)
+                or (timeout is not None and self.expected_wait(priority) > timeout)):
+            # Fail fast instead of holding the caller until its timeout
+            self.shed += 1
+            return False
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        if self._wakeup is None:
+            self._pump()
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self.shed += 1
+            return False
+        self.admitted += 1
+        return True
+
+    def try_acquire(self) -> bool:
+        """Take a token only if one is free now and nobody is queued for it; never waits or sheds."""
+        if not self._waiters and self.bucket.try_take():
+            self.admitted += 1
+            return True
+        return False
+
+    def expected_wait(self, priority: int) -> float:
+        """Seconds a new caller at this priority would wait if nobody else arrived."""
+        ahead = sum(1 for p, _, future in self._waiters if p <= priority and not future.done())
+        return self.bucket.wait_time() + ahead / self.bucket.rate
+
+    def _pump(self):
+        self._wakeup = None
+        while self._waiters:
+            if self._waiters[0][2].done():
+                # Timed out or cancelled
+                heapq.heappop(self._waiters)
+                continue
+            if not self.bucket.try_take():
+                self._wakeup = asyncio.get_running_loop().call_later(self.bucket.wait_time(), self._pump)
+                return
+            heapq.heappop(self._waiters)[2].set_result(None)
+
+    def stats(self) -> Dict[str, int]:
+        return {"admitted": self.admitted, "shed": self.shed, "waiting": self.waiting}
+
+
+def _seconds(retry_after) -> float:
+    if isinstance(retry_after, datetime.timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+class TelegramRateLimiter(BaseRateLimiter):
+    """Throttles Bot API requests to Telegram's flood limits.
+
+    Every request takes a token from a global bucket (about 30/s), and
+    messages posted to a group (sendMessage and the other send, copy and
+    forward endpoints) also take one from that group's bucket (about
+    20/min); chat actions, edits and reads do not. Both are served by
+    priority: the `rate_limit_args` of the call if given, else the calling
+    task's `current_priority`. RetryAfter pauses all requests for the time
+    Telegram asks for and then retries, up to `max_retries` times.
+    """
+
+    def __init__(self, global_rate: float = 30.0, group_per_minute: float = 20.0,
+                 max_retries: int = 3, max_groups: int = 10000):
+        self.global_limiter = PriorityLimiter(global_rate, global_rate)
+        self.group_per_minute = group_per_minute
+        self.max_retries = max_retries
+        self.max_groups = max_groups
+        self._groups: "OrderedDict[int, PriorityLimiter]" = OrderedDict()
+        self._paused_until = 0.0
+        self.retry_afters = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _group_limiter(self, chat_id) -> Optional[PriorityLimiter]:
+        if isinstance(chat_id, str) and chat_id.lstrip("-").isdigit():
+            chat_id = int(chat_id)
+        # Positive IDs are private chats; @usernames are channels and limited like groups
+        if isinstance(chat_id, int) and chat_id > 0:
+            return None
+        limiter = self._groups.get(chat_id)
+        if limiter is not None:
+            self._groups.move_to_end(chat_id)
+            return limiter
+        limiter = self._groups[chat_id] = PriorityLimiter(self.group_per_minute / 60, self.group_per_minute)
+        if len(self._groups) > self.max_groups:
+            # Evict the least recently used idle group; a limiter evicted with waiters lives on through them
+            for old_id, old in self._groups.items():
+                if old is not limiter and old.idle:
+                    del self._groups[old_id]
+                    break
+        return limiter
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Any]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[int],
+    ):
+        if endpoint in _UNLIMITED_ENDPOINTS:
+            return await callback(*args, **kwargs)
+        priority = rate_limit_args if rate_limit_args is not None else current_priority.get()
+        group = None
+        if endpoint in _GROUP_SEND_ENDPOINTS and "chat_id" in data:
+            group = self._group_limiter(data["chat_id"])
+        for attempt in range(self.max_retries + 1):
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            if group is not None:
+                await group.acquire(priority)
+            await self.global_limiter.acquire(priority)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                self.retry_afters += 1
+                delay = _seconds(e.retry_after)
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                if attempt == self.max_retries:
+                    raise
+                logger.warning(f"Flood control on {endpoint}: retrying in {delay:.0f}s (attempt {attempt + 1})")
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "global": self.global_limiter.stats(),
+            "groups": len(self._groups),
+            "group_waiting": sum(limiter.waiting for limiter in self._groups.values()),
+            "retry_afters": self.retry_afters,
+        }
@@ -0,0 +1,114 @@
+"""
+Relevance gating: decide whether a message is addressed to the bot before doing any work
+"""
+
+import random
+import re
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional
+
+from telegram import Message, MessageEntity
+
+PRIVATE = "private"
+MENTION = "mention"
+REPLY = "reply"
+KEYWORD = "keyword"
+RANDOM = "random"
+
+
+@dataclass
+class Interaction:
+    """Why the bot is answering, plus the message text with the bot's @mention removed."""
+    kind: str
+    text: str
+
+    @property
+    def is_private(self) -> bool:
+        return self.kind == PRIVATE
+
+    @property
+    def is_mention(self) -> bool:
+        return self.kind == MENTION
+
+    @property
+    def is_reply(self) -> bool:
+        return self.kind == REPLY
+
+    @property
+    def is_direct(self) -> bool:
+        """Addressed to the bot, as opposed to ambient group chatter."""
+        return self.kind in (PRIVATE, MENTION, REPLY)
+
+
+class RelevanceGate:
+    """Classifies messages using Telegram entity and reply metadata.
+
+    Private chats, @mentions of the bot (plain or text mentions) and replies
+    to the bot's own messages are always handled. Other group messages are
+    handled only if they contain one of `keywords` or win a `random_rate`
+    draw; everything else is skipped.
+    """
+
+    def __init__(self, keywords: Iterable[str] = (), random_rate: float = 0.0):
+        keywords = [keyword for keyword in keywords if keyword]
+        self.keyword_pattern = (
+            re.compile(r"\b(?:" + "|".join(re.escape(k) for k in keywords) + r")\b", re.IGNORECASE)
+            if keywords else None
+        )
+        self.random_rate = random_rate
+        self.handled: Counter = Counter()
+        self.skipped = 0
+
+    def classify(self, message: Message, bot_username: str, bot_id: Optional[int]) -> Optional[Interaction]:
+        """
+        Work out whether and how the bot was addressed
+
+        Args:
+            message: Incoming text message
+            bot_username: The bot's username, with or without a leading @
+            bot_id: The bot's user ID, used for reply and text-mention detection
+
+        Returns:
+            An Interaction, or None if the message should be ignored
+        """
+        interaction = self._classify(message, bot_username.lstrip("@").lower(), bot_id)
+        if interaction is None:
+            self.skipped += 1
+        else:
+            self.handled[interaction.kind] += 1
+        return interaction
+
+    def _classify(self, message: Message, username: str, bot_id: Optional[int]) -> Optional[Interaction]:
+        text = message.text
+        if message.chat.type == "private":
+            return Interaction(PRIVATE, text)
+
+        if message.entities:
+            for entity, value in message.parse_entities([MessageEntity.MENTION, MessageEntity.TEXT_MENTION]).items():
+                if (value[1:].lower() == username if entity.type == MessageEntity.MENTION
+                        else entity.user is not None and entity.user.id == bot_id):
+                    # Only strip plain mentions; a text mention's words are part of the sentence
+                    if entity.type == MessageEntity.MENTION:
+                        text = " ".join(text.replace(value, " ", 1).split())
+                    return Interaction(MENTION, text)
+
+        reply_to = message.reply_to_message
+        if reply_to is not None and reply_to.from_user is not None and reply_to.from_user.id == bot_id:
+            return Interaction(REPLY, text)
+
+        if self.keyword_pattern is not None and self.keyword_pattern.search(text):
+            return Interaction(KEYWORD, text)
+        if self.random_rate > 0 and random.random() < self.random_rate:
+            return Interaction(RANDOM, text)
+        return None
+
+    def stats(self) -> Dict[str, object]:
+        handled = sum(self.handled.values())
+        total = handled + self.skipped
+        return {
+            "handled": handled,
+            "skipped": self.skipped,
+            "skip_ratio": round(self.skipped / total, 4) if total else 0.0,
+            "by_kind": dict(self.handled),
+        }
@@ -0,0 +1,298 @@
+"""
+Resilient LLM calls: deadlines, jittered retries, a circuit breaker and hedged requests
+"""
+
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import AsyncIterator, Deque, Dict, Optional
+
+import httpx
+
+from ratelimit import PriorityLimiter, current_priority
+
+logger = logging.getLogger(__name__)
+
+
+class LLMUnavailable(Exception):
+    """Generation failed within its deadline and retry budget."""
+
+
+class CircuitOpenError(LLMUnavailable):
+    """The backend is considered unhealthy; no call was made."""
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """Timeouts, transport errors, 429s and 5xx are worth another try; other errors are not."""
+    if isinstance(exc, (asyncio.TimeoutError, httpx.TransportError, ConnectionError)):
+        return True
+    status = getattr(exc, "status_code", None)
+    return status is not None and (status == 429 or status >= 500)
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures.
+
+    While open every call is refused. After `reset_timeout` seconds a single
+    probe call is let through (half-open); its success closes the circuit,
+    its failure opens it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probe_started: Optional[float] = None
+        self.opens = 0
+
+    def allow(self) -> bool:
+        now = time.monotonic()
+        if self.state == self.OPEN:
+            if now - self.opened_at < self.reset_timeout:
+                return False
+            self.state = self.HALF_OPEN
+            self._probe_started = None
+        if self.state == self.HALF_OPEN:
+            # One probe at a time; a probe that never reported back is replaced
+            if self._probe_started is not None and now - self._probe_started < self.reset_timeout:
+                return False
+            self._probe_started = now
+        return True
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info("LLM circuit closed")
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN or (
+            self.state == self.CLOSED and self.consecutive_failures >= self.failure_threshold
+        ):
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self.opens += 1
+            logger.warning(f"LLM circuit opened after {self.consecutive_failures} consecutive failures")
+
+
+class ResilientLLM:
+    """Wraps a backend exposing generate(prompt, timeout=, **options) and generate_stream(prompt, timeout=, **options).
+
+    Every call gets a deadline (`timeout`, default from config) that bounds
+    all attempts and backoff together; each attempt gets whatever remains.
+    Retryable failures are retried up to `retries` times with full-jitter
+    exponential backoff. With `hedge` enabled, a duplicate request is sent
+    once an attempt has run longer than the recent p95 latency, and the
+    first success wins.
+
+    The caller pays for the first request out of `limiter`, the LLM quota.
+    Every retry and hedge is one more request against it, so each takes a
+    token too: a retry waits for one (at the task's `current_priority`,
+    within the deadline) and gives up if none comes, and a hedge is only
+    sent if a token is free right away.
+    """
+
+    def __init__(self, backend, timeout: float = 30.0, retries: int = 2, base_delay: float = 0.25,
+                 max_delay: float = 2.0, breaker: Optional[CircuitBreaker] = None, hedge: bool = False,
+                 hedge_min_samples: int = 20, limiter: Optional[PriorityLimiter] = None):
+        self.backend = backend
+        self.timeout = timeout
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker or CircuitBreaker()
+        self.hedge = hedge
+        self.hedge_min_samples = hedge_min_samples
+        self.limiter = limiter
+        self.latencies: Deque[float] = deque(maxlen=200)
+        self.calls = 0
+        self.failures = 0
+        self.retried = 0
+        self.short_circuited = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.quota_denied = 0   # retries and hedges not sent for want of an LLM quota token
+        self.inflight = 0   # backend requests currently open, hedges included
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def hedge_delay(self) -> Optional[float]:
+        """Recent p95 latency, or None until enough samples have been seen."""
+        if not self.hedge or len(self.latencies) < self.hedge_min_samples:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+    async def _retry_admitted(self, deadline: float) -> bool:
+        """Take a quota token for a retry, waiting no later than the deadline."""
+        if self.limiter is None:
+            return True
+        remaining = deadline - asyncio.get_running_loop().time()
+        if remaining > 0 and await self.limiter.acquire(current_priority.get(), timeout=remaining):
+            return True
+        self.quota_denied += 1
+        return False
+
+    async def generate(self, prompt: str, timeout: Optional[float] = None, **options) -> str:
+        """
+        Generate text with retries, hedging and the circuit breaker
+
+        Args:
+            prompt: Prompt text
+            timeout: Deadline in seconds for the whole call (defaults to self.timeout)
+            **options: Passed to the backend (model, max_tokens, temperature, ...)
+
+        Returns:
+            Generated text
+
+        Raises:
+            CircuitOpenError: The circuit is open; nothing was sent
+            LLMUnavailable: Every attempt failed or the deadline passed
+        """
+        self.calls += 1
+        if not self.breaker.allow():
+            self.short_circuited += 1
+            raise CircuitOpenError("LLM circuit is open")
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (timeout if timeout is not None else self.timeout)
+        attempt = 0
+        while True:
+            try:
+                text = await self._attempt(prompt, deadline, options)
+            except Exception as e:
+                if is_retryable(e):
+                    # A rejected request (bad prompt, auth) says nothing about the backend's health
+                    self.breaker.record_failure()
+                delay = self._backoff(attempt)
+                if (not is_retryable(e) or attempt >= self.retries or loop.time() + delay >= deadline
+                        or not self.breaker.allow()):
+                    self.failures += 1
+                    raise LLMUnavailable(f"LLM call failed after {attempt + 1} attempt(s): {e!r}") from e
+                attempt += 1
+                logger.warning(f"LLM attempt {attempt} failed ({e!r}), retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                if not await self._retry_admitted(deadline):
+                    self.failures += 1
+                    raise LLMUnavailable(f"LLM quota exhausted after {attempt} attempt(s): {e!r}") from e
+                self.retried += 1
+                continue
+            self.breaker.record_success()
+            return text
+
+    async def _call(self, prompt: str, deadline: float, options: Dict[str, object]) -> str:
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        remaining = deadline - started
+        if remaining <= 0:
+            raise asyncio.TimeoutError()
+        self.inflight += 1
+        try:
+            text = await asyncio.wait_for(self.backend.generate(prompt, timeout=remaining, **options), remaining)
+        finally:
+            self.inflight -= 1
+        self.latencies.append(loop.time() - started)
+        return text
+
+    async def _attempt(self, prompt: str, deadline: float, options: Dict[str, object]) -> str:
+        loop = asyncio.get_running_loop()
+        hedge_after = self.hedge_delay()
+        if hedge_after is None or loop.time() + hedge_after >= deadline:
+            return await self._call(prompt, deadline, options)
+
+        primary = asyncio.create_task(self._call(prompt, deadline, options))
+        pending = {primary}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=hedge_after)
+            if done:
+                return primary.result()
+            if self.limiter is not None and not self.limiter.try_acquire():
+                self.quota_denied += 1
+                return await primary
+            self.hedged += 1
+            hedge = asyncio.create_task(self._call(prompt, deadline, options))
+            pending.add(hedge)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def stream(self, prompt: str, timeout: Optional[float] = None, **options) -> AsyncIterator[str]:
+        """
+        Stream generated text under the circuit breaker and deadline
+
+        Failures before the first fragment are retried like generate();
+        once text has been yielded a failure is raised as LLMUnavailable.
+        """
+        self.calls += 1
+        if not self.breaker.allow():
+            self.short_circuited += 1
+            raise CircuitOpenError("LLM circuit is open")
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (timeout if timeout is not None else self.timeout)
+        attempt = 0
+        while True:
+            started = loop.time()
+            yielded = False
+            try:
+                self.inflight += 1
+                try:
+                    async for chunk in self.backend.generate_stream(prompt, timeout=deadline - started, **options):
+                        if not yielded:
+                            self.latencies.append(loop.time() - started)
+                        yielded = True
+                        yield chunk
+                finally:
+                    self.inflight -= 1
+            except Exception as e:
+                if is_retryable(e):
+                    self.breaker.record_failure()
+                delay = self._backoff(attempt)
+                if (yielded or not is_retryable(e) or attempt >= self.retries
+                        or loop.time() + delay >= deadline or not self.breaker.allow()):
+                    self.failures += 1
+                    raise LLMUnavailable(f"LLM stream failed after {attempt + 1} attempt(s): {e!r}") from e
+                attempt += 1
+                logger.warning(f"LLM stream attempt {attempt} failed ({e!r}), retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                if not await self._retry_admitted(deadline):
+                    self.failures += 1
+                    raise LLMUnavailable(f"LLM quota exhausted after {attempt} stream attempt(s): {e!r}") from e
+                self.retried += 1
+                continue
+            self.breaker.record_success()
+            return
+
+    def stats(self) -> Dict[str, object]:
+        hedge_after = self.hedge_delay()
+        return {
+            "circuit": self.breaker.state,
+            "circuit_opens": self.breaker.opens,
+            "calls": self.calls,
+            "inflight": self.inflight,
+            "failures": self.failures,
+            "retried": self.retried,
+            "short_circuited": self.short_circuited,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "quota_denied": self.quota_denied,
+            "hedge_after_ms": round(hedge_after * 1000, 1) if hedge_after is not None else None,
+        }
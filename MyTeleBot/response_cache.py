@@ -0,0 +1,209 @@
+"""
+Response cache for repeated short group chatter, with SimHash near-duplicate matching
+"""
+
+import hashlib
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Iterator, Optional, Set, Tuple
+
+from snapshot import key_hash
+
+_MENTION_OR_URL = re.compile(r"@\w+|https?://\S+")
+_APOSTROPHE = re.compile(r"['’]")
+_NON_WORD = re.compile(r"[^\w\s]+")
+_REPEATS = re.compile(r"(\w)\1{2,}")
+USER_PLACEHOLDER = "\x00user\x00"
+
+SIMHASH_BITS = 64
+SIMHASH_BANDS = 8
+_BAND_BITS = SIMHASH_BITS // SIMHASH_BANDS
+_BAND_MASK = (1 << _BAND_BITS) - 1
+
+
+def normalize_message(text: str) -> str:
+    """Lowercase, drop mentions/URLs/punctuation and squash letter runs ("loooool" -> "lol")."""
+    text = _MENTION_OR_URL.sub(" ", text.lower())
+    text = _APOSTROPHE.sub("", text)
+    text = _NON_WORD.sub(" ", text)
+    text = _REPEATS.sub(r"\1", text)
+    return " ".join(text.split())
+
+
+# Byte value -> 8 bytes holding its bits, so one feature hash becomes 64 one-byte
+# counters that a single big-int addition accumulates (features are capped at 255)
+_BIT_LANES = [bytes(value >> bit & 1 for bit in range(8)) for value in range(256)]
+
+
+def simhash(text: str) -> int:
+    """64-bit SimHash over word unigrams and padded character trigrams."""
+    padded = f" {text} "
+    features = text.split() + [padded[i:i + 3] for i in range(len(padded) - 2)]
+    del features[255:]
+    counts = 0
+    for feature in features:
+        digest = hashlib.blake2b(feature.encode(), digest_size=8).digest()
+        counts += int.from_bytes(b"".join(map(_BIT_LANES.__getitem__, digest)), "little")
+    half = len(features) / 2
+    return sum(1 << bit for bit, ones in enumerate(counts.to_bytes(SIMHASH_BITS, "little")) if ones > half)
+
+
+def _bands(fingerprint: int) -> Iterable[Tuple[int, int]]:
+    for band in range(SIMHASH_BANDS):
+        yield band, fingerprint >> (band * _BAND_BITS) & _BAND_MASK
+
+
+class ResponseCache:
+    """Caches raw generations keyed on (normalized message, chat type, interaction).
+
+    Exact keys are looked up first; otherwise the SimHash fingerprint is
+    compared against entries that share at least one 8-bit band, which
+    finds every entry within `max_distance` bits when max_distance < 8.
+    Entries expire after `ttl` seconds and the least recently used entry
+    is evicted once `maxsize` is reached. The caller's username is stored
+    as a placeholder so a cached answer can be re-addressed.
+    """
+
+    def __init__(self, maxsize: int = 2048, ttl: float = 3600, max_chars: int = 80, max_distance: int = 7):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_chars = max_chars
+        self.max_distance = max_distance
+        # key -> (raw response, fingerprint, expires_at)
+        self._entries: "OrderedDict[Tuple[str, str, str], Tuple[str, int, float]]" = OrderedDict()
+        self._bands: Dict[Tuple[str, str, int, int], Set[Tuple[str, str, str]]] = {}
+        self.opted_out: Set[int] = set()
+        # Entries from the last shutdown's snapshot, restored on an exact-key miss
+        self.snapshot = None
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def enabled_for(self, chat_id: int) -> bool:
+        return chat_id not in self.opted_out
+
+    def set_enabled(self, chat_id: int, enabled: bool):
+        if enabled:
+            self.opted_out.discard(chat_id)
+        else:
+            self.opted_out.add(chat_id)
+
+    def cacheable(self, text: str) -> bool:
+        return 0 < len(text) <= self.max_chars
+
+    def get(self, text: str, chat_type: str, interaction: str, user_name: str) -> Optional[str]:
+        """
+        Find a cached raw response for this message or a near-duplicate of it
+
+        Args:
+            text: Raw message text
+            chat_type: Telegram chat type
+            interaction: Interaction kind (mention, reply, private, ...)
+            user_name: Name to address the cached response to
+
+        Returns:
+            Raw (not yet post-processed) response text, or None on a miss
+        """
+        normalized = normalize_message(text)
+        if not normalized:
+            return None
+        key = (normalized, chat_type, interaction)
+        entry = self._live_entry(key) or self._restore(key)
+        if entry is not None:
+            self.hits += 1
+            return entry[0].replace(USER_PLACEHOLDER, user_name)
+
+        fingerprint = simhash(normalized)
+        best_key, best_distance = None, self.max_distance + 1
+        for band, value in _bands(fingerprint):
+            for candidate in self._bands.get((chat_type, interaction, band, value), ()):
+                distance = bin(self._entries[candidate][1] ^ fingerprint).count("1")
+                if distance < best_distance:
+                    best_key, best_distance = candidate, distance
+        if best_key is not None:
+            entry = self._live_entry(best_key)
+            if entry is not None:
+                self.near_hits += 1
+                return entry[0].replace(USER_PLACEHOLDER, user_name)
+        self.misses += 1
+        return None
+
+    def put(self, text: str, chat_type: str, interaction: str, user_name: str, response: str):
+        normalized = normalize_message(text)
+        if not normalized or not response:
+            return
+        key = (normalized, chat_type, interaction)
+        if key in self._entries:
+            self._remove(key)
+        raw = re.sub(rf"(?<!\w){re.escape(user_name)}(?!\w)", USER_PLACEHOLDER, response) if user_name else response
+        self._insert(key, raw, simhash(normalized), time.monotonic() + self.ttl)
+        self.stores += 1
+
+    def _insert(self, key, raw: str, fingerprint: int, expires_at: float):
+        _, chat_type, interaction = key
+        self._entries[key] = (raw, fingerprint, expires_at)
+        for band, value in _bands(fingerprint):
+            self._bands.setdefault((chat_type, interaction, band, value), set()).add(key)
+        while len(self._entries) > self.maxsize:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _restore(self, key):
+        if self.snapshot is None:
+            return None
+        saved = self.snapshot.take(key_hash(key))
+        if saved is None or saved[:3] != list(key):
+            return None
+        raw, fingerprint, expires_at = saved[3:]
+        # Stored as wall-clock time; the live cache runs on the monotonic clock
+        remaining = expires_at - time.time()
+        if remaining <= 0:
+            return None
+        self._insert(key, raw, fingerprint, time.monotonic() + remaining)
+        return self._entries[key]
+
+    def snapshot_items(self) -> Iterator[Tuple[int, list]]:
+        """(hashed key, [*key, raw, fingerprint, wall-clock expiry]) for live entries, most recent first."""
+        now, wall = time.monotonic(), time.time()
+        for key in reversed(self._entries):
+            raw, fingerprint, expires_at = self._entries[key]
+            if expires_at > now:
+                yield key_hash(key), [*key, raw, fingerprint, wall + expires_at - now]
+
+    def _live_entry(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[2] < time.monotonic():
+            self._remove(key)
+            self.evictions += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _remove(self, key):
+        _, fingerprint, _ = self._entries.pop(key)
+        _, chat_type, interaction = key
+        for band, value in _bands(fingerprint):
+            bucket_key = (chat_type, interaction, band, value)
+            bucket = self._bands.get(bucket_key)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._bands[bucket_key]
+
+    def stats(self) -> Dict[str, object]:
+        lookups = self.hits + self.near_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "hit_ratio": round((self.hits + self.near_hits) / lookups, 4) if lookups else 0.0,
+            "opted_out_chats": len(self.opted_out),
+        }
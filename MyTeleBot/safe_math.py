@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Bounded arithmetic evaluator: an AST whitelist with operation, exponent, size and time limits instead of eval
+
+The limits are checked against an adversarial corpus, failing if any input
+is evaluated, takes longer than the time limit, or stalls the event loop:
+
+    python safe_math.py check
+"""
+
+import argparse
+import ast
+import asyncio
+import math
+import operator
+import sys
+import time
+from dataclasses import dataclass
+from typing import List, Union
+
+Number = Union[int, float]
+
+
+class MathError(ValueError):
+    """The expression is not plain arithmetic, or it breaks one of the limits."""
+
+
+@dataclass(frozen=True)
+class MathLimits:
+    max_length: int = 200          # characters, checked before parsing
+    max_operations: int = 64       # operators in the expression
+    max_exponent: int = 1024       # absolute value of any exponent
+    max_digits: int = 300          # size of any intermediate integer
+    max_magnitude: float = 1e300   # size of any intermediate float
+    time_limit: float = 0.05       # seconds of evaluation
+    offload_operations: int = 16   # run in a worker thread above this many operators, or with any power
+
+
+DEFAULT_LIMITS = MathLimits()
+
+_BINARY = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.Pow: operator.pow,
+}
+_UNARY = {ast.UAdd: operator.pos, ast.USub: operator.neg}
+
+
+@dataclass(frozen=True)
+class _Parsed:
+    body: ast.AST
+    operations: int
+    has_power: bool
+
+
+def parse(expression: str, limits: MathLimits = DEFAULT_LIMITS) -> _Parsed:
+    """
+    Parse and validate an expression without evaluating anything
+
+    Args:
+        expression: Arithmetic using numbers, + - * / ** and parentheses
+        limits: Bounds to enforce
+
+    Returns:
+        The validated tree and its operation count
+
+    Raises:
+        MathError: Anything other than plain arithmetic, or too long/too many operations
+    """
+    expression = expression.replace("×", "*").replace("÷", "/").strip()
+    if not expression or len(expression) > limits.max_length:
+        raise MathError("expression is empty or too long")
+    try:
+        tree = ast.parse(expression, mode="eval")
+    except (SyntaxError, ValueError, RecursionError, MemoryError) as e:
+        raise MathError(f"not an arithmetic expression: {e}") from None
+    operations = 0
+    has_power = False
+    for node in ast.walk(tree.body):
+        if isinstance(node, ast.BinOp) and type(node.op) in _BINARY:
+            operations += 1
+            has_power = has_power or isinstance(node.op, ast.Pow)
+        elif isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY:
+            operations += 1
+        elif isinstance(node, ast.Constant) and type(node.value) in (int, float):
+            pass
+        elif not isinstance(node, (ast.operator, ast.unaryop)):
+            raise MathError(f"{type(node).__name__} is not allowed")
+    if operations > limits.max_operations:
+        raise MathError(f"more than {limits.max_operations} operations")
+    return _Parsed(tree.body, operations, has_power)
+
+
+class _Evaluator:
+    def __init__(self, limits: MathLimits):
+        self.limits = limits
+        self.deadline = time.perf_counter() + limits.time_limit
+
+    def visit(self, node: ast.AST) -> Number:
+        if time.perf_counter() > self.deadline:
+            raise MathError("time limit exceeded")
+        if isinstance(node, ast.Constant):
+            return self.check(node.value)
+        if isinstance(node, ast.UnaryOp):
+            return self.check(_UNARY[type(node.op)](self.visit(node.operand)))
+        left = self.visit(node.left)
+        right = self.visit(node.right)
+        if isinstance(node.op, ast.Pow):
+            self.check_power(left, right)
+        try:
+            return self.check(_BINARY[type(node.op)](left, right))
+        except ZeroDivisionError:
+            raise MathError("division by zero") from None
+        except OverflowError:
+            raise MathError("result too large") from None
+
+    def check_power(self, base: Number, exponent: Number):
+        if abs(exponent) > self.limits.max_exponent:
+            raise MathError(f"exponent above {self.limits.max_exponent}")
+        if isinstance(base, int) and isinstance(exponent, int) and exponent > 0 and abs(base) > 1:
+            # Digits of base**exponent, known before doing any work
+            if exponent * math.log10(abs(base)) > self.limits.max_digits:
+                raise MathError("result too large")
+        if base < 0 and isinstance(exponent, float) and not exponent.is_integer():
+            raise MathError("complex result")
+
+    def check(self, value: Number) -> Number:
+        if isinstance(value, int):
+            if value.bit_length() > self.limits.max_digits * 3.33:
+                raise MathError("result too large")
+        elif not math.isfinite(value) or abs(value) > self.limits.max_magnitude:
+            raise MathError("result too large")
+        return value
+
+
+def _run(parsed: _Parsed, limits: MathLimits) -> Number:
+    return _Evaluator(limits).visit(parsed.body)
+
+
+def evaluate(expression: str, limits: MathLimits = DEFAULT_LIMITS) -> Number:
+    """
+    Evaluate arithmetic within the limits, on the calling thread
+
+    Every intermediate value is bounded, so even the worst accepted input
+    finishes in well under `time_limit`.
+
+    Raises:
+        MathError: Invalid expression or a limit was hit
+    """
+    return _run(parse(expression, limits), limits)
+
+
+async def evaluate_async(expression: str, limits: MathLimits = DEFAULT_LIMITS) -> Number:
+    """
+    Evaluate arithmetic without holding up the event loop
+
+    Cheap expressions are evaluated inline; ones with powers or many
+    operations go to a worker thread so other chats keep being served.
+
+    Raises:
+        MathError: Invalid expression or a limit was hit
+    """
+    parsed = parse(expression, limits)
+    if not parsed.has_power and parsed.operations <= limits.offload_operations:
+        return _run(parsed, limits)
+    return await asyncio.to_thread(_run, parsed, limits)
+
+
+def format_number(value: Number) -> Number:
+    """Integral floats as ints, others rounded to 6 places, as safe_eval always returned them."""
+    if isinstance(value, float):
+        return int(value) if value.is_integer() else round(value, 6)
+    return value
+
+
+# Every one of these must raise MathError within the time limit
+HOSTILE = (
+    "9**9**9**9", "10**10**10", "(2**1024)**1024", "999999**999999", "2**-100000", "1e308*10",
+    "(-8)**0.5", "1/0", "-" * 199 + "1", "(10**150)*(10**150)*10", "*".join(["9"] * 100),
+    "(" * 150 + "1" + ")" * 150, "__import__('os')", "'9'*200", "[1]*10**9", "(1).__class__",
+    "lambda: 1", "x*2", "2 if 1 else 3",
+)
+
+# Messages that look like arithmetic but are not; the intent router must neither answer nor inject them
+NOT_MATH = (
+    "what is 2024-10-17", "10-3-2020", "call me at 555-1234", "3-4 dogs", "what is 1e5+1",
+    "the score was 3-1 today", "version 1.2.3+4", "my score 7/10?",
+)
+
+
+async def _longest_stall(limits: MathLimits, count: int = 200) -> float:
+    """Longest gap between ticks of a 1 ms heartbeat while `count` powers are evaluated concurrently."""
+    stall = 0.0
+
+    async def heartbeat():
+        nonlocal stall
+        last = time.perf_counter()
+        while True:
+            await asyncio.sleep(0.001)
+            now = time.perf_counter()
+            stall, last = max(stall, now - last), now
+
+    beat = asyncio.create_task(heartbeat())
+    await asyncio.sleep(0)
+    await asyncio.gather(*(evaluate_async(f"{n}**{n % 300}", limits) for n in range(count)), return_exceptions=True)
+    beat.cancel()
+    return stall
+
+
+async def _answered_as_math(messages) -> List[str]:
+    # Imported here: the router depends on this module, not the other way round
+    from intent_router import IntentRouter
+    from personality import SiegePersonality
+
+    router = IntentRouter(SiegePersonality())
+    answered = []
+    for message in messages:
+        result = await router.route(message)
+        if result.intent == "math" or any(" = " in fact for fact in result.facts):
+            answered.append(message)
+    return answered
+
+
+def check(limits: MathLimits = DEFAULT_LIMITS, max_stall: float = 0.1) -> List[str]:
+    """
+    Run the adversarial corpus
+
+    Returns:
+        Failure messages, empty when every limit held
+    """
+    failures = []
+    for expression in HOSTILE:
+        started = time.perf_counter()
+        try:
+            value = evaluate(expression, limits)
+        except MathError:
+            value = None
+        else:
+            failures.append(f"{expression[:40]!r} was evaluated (= {str(value)[:30]})")
+        elapsed = time.perf_counter() - started
+        if elapsed > limits.time_limit:
+            failures.append(f"{expression[:40]!r} took {elapsed * 1000:.1f} ms, over {limits.time_limit * 1000:.0f} ms")
+    print(f"{len(HOSTILE)} hostile expressions checked")
+
+    stall = asyncio.run(_longest_stall(limits))
+    print(f"longest event loop stall during 200 concurrent powers: {stall * 1000:.1f} ms (max {max_stall * 1000:.0f} ms)")
+    if stall > max_stall:
+        failures.append(f"event loop stalled {stall * 1000:.1f} ms, over {max_stall * 1000:.0f} ms")
+
+    for message in asyncio.run(_answered_as_math(NOT_MATH)):
+        failures.append(f"{message!r} was treated as arithmetic")
+    print(f"{len(NOT_MATH)} non-arithmetic messages checked")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Adversarial check of the arithmetic evaluator")
+    parser.add_argument("command", choices=["check"])
+    parser.add_argument("--max-stall-ms", type=float, default=100, help="Longest event loop stall allowed")
+    args = parser.parse_args()
+    failures = check(max_stall=args.max_stall_ms / 1000)
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Update scheduler: parallel across chats, strictly ordered within each chat
+"""
+
+import asyncio
+import logging
+import statistics
+import time
+from collections import deque
+from typing import Awaitable, Deque, Dict, Hashable
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+
+# PTB's own semaphore only admits updates; the real worker limit is applied
+# after per-chat ordering so one busy chat cannot occupy every slot
+_ADMISSION_LIMIT = 1 << 16
+
+
+class _Pending:
+    __slots__ = ("coroutine", "queued_at", "dropped")
+
+    def __init__(self, coroutine: Awaitable):
+        self.coroutine = coroutine
+        self.queued_at = time.monotonic()
+        self.dropped = False
+
+
+class _Lane:
+    """One chat's FIFO: a fair lock plus the updates still waiting for it."""
+    __slots__ = ("lock", "waiting")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.waiting: Deque[_Pending] = deque()
+
+
+class ChatScheduler(BaseUpdateProcessor):
+    """Update processor for Application.builder().concurrent_updates().
+
+    Each update first waits its turn in its chat's lane, then for one of
+    `max_workers` worker slots, so updates in one chat never overtake each
+    other while different chats run in parallel. A lane holds at most
+    `max_queue_depth` waiting updates; beyond that the oldest waiting
+    update (or the incoming one, with DROP_NEWEST) is dropped.
+    """
+
+    def __init__(self, max_workers: int = 16, max_queue_depth: int = 20, overflow: str = DROP_OLDEST,
+                 report_every: int = 500, monitor=None):
+        super().__init__(_ADMISSION_LIMIT)
+        if overflow not in (DROP_OLDEST, DROP_NEWEST):
+            raise ValueError(f"overflow must be {DROP_OLDEST!r} or {DROP_NEWEST!r}")
+        self.max_workers = max_workers
+        self.max_queue_depth = max_queue_depth
+        self.overflow = overflow
+        self.report_every = report_every
+        self.monitor = monitor   # LoopMonitor told which update each task is handling
+        self._workers = asyncio.Semaphore(max_workers)
+        self._lanes: Dict[Hashable, _Lane] = {}
+        self.busy = 0
+        self.processed = 0
+        self.dropped = 0
+        self.max_depth_seen = 0
+        self.waits: Deque[float] = deque(maxlen=1000)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    @staticmethod
+    def _lane_key(update: object) -> Hashable:
+        if isinstance(update, Update):
+            if update.effective_chat is not None:
+                return update.effective_chat.id
+            if update.effective_user is not None:
+                return ("user", update.effective_user.id)
+        # Nothing to order against
+        return ("update", id(update))
+
+    async def do_process_update(self, update: object, coroutine: Awaitable):
+        key = self._lane_key(update)
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = self._lanes[key] = _Lane()
+
+        if len(lane.waiting) >= self.max_queue_depth:
+            self.dropped += 1
+            if self.overflow == DROP_NEWEST:
+                logger.warning(f"Chat {key} queue full ({self.max_queue_depth}), dropping newest update")
+                coroutine.close()
+                return
+            logger.warning(f"Chat {key} queue full ({self.max_queue_depth}), dropping oldest waiting update")
+            lane.waiting.popleft().dropped = True
+
+        pending = _Pending(coroutine)
+        lane.waiting.append(pending)
+        self.max_depth_seen = max(self.max_depth_seen, len(lane.waiting))
+        try:
+            async with lane.lock:
+                if pending.dropped:
+                    coroutine.close()
+                    return
+                lane.waiting.remove(pending)
+                async with self._workers:
+                    self.waits.append(time.monotonic() - pending.queued_at)
+                    self.busy += 1
+                    if self.monitor is not None:
+                        self.monitor.label(f"update {getattr(update, 'update_id', '?')} chat {key}")
+                    try:
+                        await coroutine
+                    finally:
+                        self.busy -= 1
+                        self.processed += 1
+        finally:
+            if not lane.waiting and not lane.lock.locked() and self._lanes.get(key) is lane:
+                del self._lanes[key]
+        if self.report_every and self.processed % self.report_every == 0:
+            logger.info(f"Scheduler stats: {self.stats()}")
+
+    def stats(self) -> Dict[str, object]:
+        waits = sorted(self.waits)
+        return {
+            "workers": self.max_workers,
+            "busy": self.busy,
+            "active_chats": len(self._lanes),
+            "queued": sum(len(lane.waiting) for lane in self._lanes.values()),
+            "max_depth_seen": self.max_depth_seen,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "wait_p50_ms": round(statistics.median(waits) * 1000, 2) if waits else 0.0,
+            "wait_p95_ms": round(waits[int(0.95 * (len(waits) - 1))] * 1000, 2) if waits else 0.0,
+            "wait_max_ms": round(waits[-1] * 1000, 2) if waits else 0.0,
+        }
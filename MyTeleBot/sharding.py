@@ -0,0 +1,397 @@
+"""
+Multi-process mode: a dispatcher hashes chat_id to worker processes that each own the state of their chats
+"""
+
+import asyncio
+import json
+import logging
+import os
+import signal
+import sys
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+from telegram import Bot, Update
+from telegram.ext import Updater
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Longest update line a worker accepts; real updates are a few KB
+MAX_LINE = 4 * 1024 * 1024
+# Seconds a new worker may take to import and send its first heartbeat
+STARTUP_GRACE = 60.0
+# A worker that ran this long before exiting counts as a fresh failure, not a crash loop
+STABLE_AFTER = 60.0
+MAX_RESTART_DELAY = 30.0
+# Workers confirm lines read at most this often, plus in every heartbeat
+RECEIPT_INTERVAL = 0.05
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+
+
+def shard_for(update: Update, workers: int) -> int:
+    """Worker index for an update: by chat, or by user for chatless updates such as inline queries."""
+    if update.effective_chat is not None:
+        key = update.effective_chat.id
+    elif update.effective_user is not None:
+        key = update.effective_user.id
+    else:
+        key = 0
+    return key % workers
+
+
+def worker_env(config, index: int) -> Dict[str, str]:
+    """
+    Environment for worker `index`
+
+    Bot-wide quotas (Telegram's global flood limit, the LLM rate and
+    concurrency) are split evenly so the workers together stay within them.
+    Each worker gets its own state database and metrics port.
+    """
+    workers = config.shard_workers
+    env = dict(os.environ)
+    env.update({
+        "SHARD_INDEX": str(index),
+        "TELEGRAM_GLOBAL_RATE": str(config.telegram_global_rate / workers),
+        "LLM_RATE_PER_MINUTE": str(config.llm_rate_per_minute / workers),
+        "LLM_BURST": str(max(1, config.llm_burst // workers)),
+        "COHERE_MAX_CONCURRENCY": str(max(1, config.cohere_max_concurrency // workers)),
+    })
+    if config.state_db:
+        root, ext = os.path.splitext(config.state_db)
+        env["STATE_DB"] = f"{root}.shard{index}{ext}"
+    if config.snapshot_path:
+        root, ext = os.path.splitext(config.snapshot_path)
+        env["SNAPSHOT_PATH"] = f"{root}.shard{index}{ext}"
+    if config.metrics_port:
+        env["METRICS_PORT"] = str(config.metrics_port + 1 + index)
+    return env
+
+
+class _Shard:
+    """Dispatcher-side handle for one worker process."""
+
+    def __init__(self, index: int, buffer: int):
+        self.index = index
+        self.buffer = buffer
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.pending: Deque[bytes] = deque()
+        self.unacked: Deque[bytes] = deque()   # written to the current process, receipt not yet confirmed
+        self.received = 0
+        self.wakeup = asyncio.Event()
+        self.ready = False
+        self.started_at = 0.0
+        self.last_report = 0.0
+        self.health: Dict[str, object] = {}
+        self.forwarded = 0
+        self.dropped = 0
+        self.restarts = 0
+
+
+class ShardDispatcher:
+    """Receives updates by polling or webhook and forwards each to the worker that owns its chat.
+
+    Workers are `main.py` processes started with SHARD_INDEX set. Updates
+    travel as JSON lines on a worker's stdin; a chat always maps to the same
+    worker and the pipe is FIFO, so per-chat order holds end to end and the
+    worker's ChatScheduler keeps it from there. Workers report readiness,
+    heartbeats and how many lines they have read on stdout. One that exits,
+    or goes quiet for `shard_health_timeout`, is restarted with exponential
+    backoff. Its updates are buffered meanwhile (up to `shard_buffer`,
+    oldest dropped first), and lines it had not confirmed reading are
+    replayed to the replacement ahead of them. An update the dead worker had
+    read but not finished is lost; one it finished but had not yet confirmed
+    is handled twice.
+
+    Each worker keeps its own state (STATE_DB and SNAPSHOT_PATH get a .shardN suffix), so
+    changing the worker count remaps chats and they start over on state.
+    """
+
+    def __init__(self, config, metrics=REGISTRY):
+        self.config = config
+        self.workers = config.shard_workers
+        self.metrics = metrics
+        self.metrics.enabled = config.metrics_enabled
+        self.shards = [_Shard(index, config.shard_buffer) for index in range(self.workers)]
+        self.updater: Optional[Updater] = None
+        self.ready = asyncio.Event()
+        self._stop_requested = asyncio.Event()
+        self._stopping = False
+        self._tasks: List[asyncio.Task] = []
+        self.metrics.gauge("shard_pending", lambda: sum(len(shard.pending) for shard in self.shards))
+        self.metrics.gauge("shard_ready", lambda: sum(shard.ready for shard in self.shards))
+
+    async def start(self):
+        """Start the workers and the update receiver, then run until stop() is called."""
+        logger.info(f"Starting dispatcher for {self.workers} workers...")
+        bot_options = {"base_url": self.config.telegram_base_url} if self.config.telegram_base_url else {}
+        self.updater = Updater(Bot(self.config.telegram_token, **bot_options), asyncio.Queue())
+        for shard in self.shards:
+            self._tasks.append(asyncio.create_task(self._supervise(shard)))
+            self._tasks.append(asyncio.create_task(self._feed(shard)))
+        self._tasks.append(asyncio.create_task(self._watchdog()))
+        self._install_signal_handlers()
+        if self.config.metrics_port:
+            await self.metrics.serve(self.config.metrics_listen, self.config.metrics_port)
+        pump = None
+        try:
+            await self.updater.initialize()
+            if self.config.update_mode == "webhook":
+                await self.updater.start_webhook(
+                    listen=self.config.webhook_listen,
+                    port=self.config.webhook_port,
+                    url_path=self.config.webhook_path,
+                    webhook_url=f"{self.config.webhook_url}/{self.config.webhook_path}",
+                    secret_token=self.config.webhook_secret_token,
+                    allowed_updates=Update.ALL_TYPES,
+                )
+                logger.info(f"Receiving updates by webhook on port {self.config.webhook_port}")
+            else:
+                await self.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+            pump = asyncio.create_task(self._pump())
+            self._check_ready()
+            await self._stop_requested.wait()
+            logger.info("Stopping dispatcher...")
+        finally:
+            if self.updater.running:
+                await self.updater.stop()
+            if pump is not None:
+                pump.cancel()
+                # Whatever the updater already received still goes to the workers
+                while not self.updater.update_queue.empty():
+                    self.submit(self.updater.update_queue.get_nowait())
+            await self.updater.shutdown()
+            await self._stop_workers()
+            await self.metrics.close()
+
+    def stop(self):
+        """Ask start() to shut down gracefully."""
+        self._stop_requested.set()
+
+    def _install_signal_handlers(self):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.stop)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+    def _check_ready(self):
+        if self.updater is not None and self.updater.running and all(shard.ready for shard in self.shards):
+            self.ready.set()
+
+    async def _pump(self):
+        while True:
+            self.submit(await self.updater.update_queue.get())
+
+    def submit(self, update: Update):
+        """Queue an update for the worker that owns its chat."""
+        shard = self.shards[shard_for(update, self.workers)]
+        if len(shard.pending) >= shard.buffer:
+            shard.pending.popleft()
+            shard.dropped += 1
+            self.metrics.inc("shard_dropped", str(shard.index))
+        shard.pending.append(json.dumps(update.to_dict(), separators=(",", ":")).encode() + b"\n")
+        shard.wakeup.set()
+
+    async def _feed(self, shard: _Shard):
+        """Write buffered updates to the worker's stdin, oldest first."""
+        while True:
+            while not (shard.ready and shard.pending):
+                shard.wakeup.clear()
+                await shard.wakeup.wait()
+            batch = [shard.pending.popleft() for _ in range(min(len(shard.pending), 100))]
+            # Held until the worker confirms receipt; _supervise() replays them if it dies first
+            shard.unacked.extend(batch)
+            try:
+                shard.process.stdin.write(b"".join(batch))
+                await shard.process.stdin.drain()
+            except (BrokenPipeError, ConnectionResetError):
+                shard.ready = False
+                continue
+            shard.forwarded += len(batch)
+            self.metrics.inc("shard_forwarded", str(shard.index), len(batch))
+
+    async def _supervise(self, shard: _Shard):
+        """Keep one worker process running until the dispatcher stops."""
+        failures = 0
+        while not self._stopping:
+            shard.started_at = shard.last_report = time.monotonic()
+            shard.health = {}
+            shard.received = 0
+            try:
+                shard.process = await asyncio.create_subprocess_exec(
+                    sys.executable, WORKER_SCRIPT,
+                    stdin=asyncio.subprocess.PIPE,
+                    stdout=asyncio.subprocess.PIPE,
+                    env=worker_env(self.config, shard.index),
+                    # Terminal signals reach only the dispatcher, which stops workers in order
+                    start_new_session=True,
+                    limit=MAX_LINE,
+                )
+            except OSError as e:
+                logger.error(f"Could not start worker {shard.index}: {e}")
+            else:
+                await self._read_reports(shard)
+                code = await shard.process.wait()
+                shard.ready = False
+                if self._stopping:
+                    break
+                # Updates still in the pipe never reached the worker, so its replacement gets them first
+                replayed = len(shard.unacked)
+                shard.pending.extendleft(reversed(shard.unacked))
+                shard.unacked.clear()
+                logger.error(f"Worker {shard.index} exited with code {code} "
+                             f"({replayed} updates to replay, {len(shard.pending)} buffered)")
+            failures = failures + 1 if time.monotonic() - shard.started_at < STABLE_AFTER else 1
+            delay = min(self.config.shard_restart_delay * 2 ** (failures - 1), MAX_RESTART_DELAY)
+            shard.restarts += 1
+            self.metrics.inc("shard_restarts", str(shard.index))
+            logger.info(f"Restarting worker {shard.index} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    async def _read_reports(self, shard: _Shard):
+        async for line in shard.process.stdout:
+            try:
+                report = json.loads(line)
+            except ValueError:
+                logger.debug(f"Worker {shard.index} wrote a non-report line: {line[:80]!r}")
+                continue
+            shard.last_report = time.monotonic()
+            if "received" in report:
+                for _ in range(min(report["received"] - shard.received, len(shard.unacked))):
+                    shard.unacked.popleft()
+                shard.received = report["received"]
+            if "heartbeat" in report:
+                shard.health = report["heartbeat"]
+            if report.get("ready"):
+                shard.ready = True
+                shard.wakeup.set()
+                logger.info(f"Worker {shard.index} ready (pid {shard.process.pid})")
+                self._check_ready()
+
+    async def _watchdog(self):
+        """Kill workers whose heartbeats stopped; _supervise() then restarts them."""
+        while True:
+            await asyncio.sleep(self.config.shard_heartbeat_interval)
+            now = time.monotonic()
+            for shard in self.shards:
+                process = shard.process
+                if process is None or process.returncode is not None:
+                    continue
+                limit = self.config.shard_health_timeout
+                if not shard.health:
+                    limit = max(limit, STARTUP_GRACE)
+                if now - shard.last_report > limit:
+                    logger.error(f"Worker {shard.index} silent for {now - shard.last_report:.0f}s, killing it")
+                    shard.ready = False
+                    try:
+                        process.kill()
+                    except ProcessLookupError:
+                        pass
+
+    async def _stop_workers(self):
+        """Deliver what is buffered, then close each worker's stdin so it finishes its chats and exits."""
+        self._stopping = True
+        deadline = time.monotonic() + self.config.shard_shutdown_timeout
+        while any(shard.ready and shard.pending for shard in self.shards) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        for shard in self.shards:
+            if shard.process is not None and shard.process.returncode is None:
+                shard.process.stdin.close()
+        for shard in self.shards:
+            if shard.process is None:
+                continue
+            try:
+                await asyncio.wait_for(shard.process.wait(), max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                logger.warning(f"Worker {shard.index} did not stop in time, killing it")
+                shard.process.kill()
+                await shard.process.wait()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        logger.info(f"Dispatcher stopped: {self.stats()}")
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "workers": [
+                {
+                    "index": shard.index,
+                    "pid": shard.process.pid if shard.process is not None else None,
+                    "ready": shard.ready,
+                    "pending": len(shard.pending),
+                    "unacked": len(shard.unacked),
+                    "forwarded": shard.forwarded,
+                    "dropped": shard.dropped,
+                    "restarts": shard.restarts,
+                    **shard.health,
+                }
+                for shard in self.shards
+            ]
+        }
+
+
+def _report(message: Dict[str, object]):
+    sys.stdout.write(json.dumps(message) + "\n")
+    sys.stdout.flush()
+
+
+class _WorkerChannel:
+    """Worker side of the pipe pair: updates in on stdin, reports out on stdout."""
+
+    def __init__(self, reader: asyncio.StreamReader):
+        self.reader = reader
+        self.received = 0
+        self._confirmed_at = 0.0
+
+    async def updates(self):
+        # Iterated only once the bot is running, so this is the moment to say so
+        _report({"ready": True})
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                return
+            self.received += 1
+            now = time.monotonic()
+            if now - self._confirmed_at >= RECEIPT_INTERVAL:
+                self._confirmed_at = now
+                _report({"received": self.received})
+            try:
+                yield json.loads(line)
+            except ValueError:
+                logger.error(f"Dropping malformed update line: {line[:80]!r}")
+
+    async def heartbeat(self, bot, interval: float):
+        while True:
+            _report({"received": self.received, "heartbeat": {
+                "users": len(bot.user_data),
+                "busy": bot.scheduler.busy,
+                "queued": bot.scheduler.stats()["queued"],
+            }})
+            await asyncio.sleep(interval)
+
+
+async def run_worker(bot, interval: float):
+    """
+    Run a SiegeBot as a shard worker
+
+    Updates are read from stdin; readiness, heartbeats and receipts are
+    written to stdout. The bot stops when stdin closes, which happens when
+    the dispatcher shuts down or dies, so workers are never orphaned.
+
+    Args:
+        bot: Bot to run
+        interval: Seconds between heartbeats
+    """
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=MAX_LINE)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    channel = _WorkerChannel(reader)
+    heartbeat = asyncio.create_task(channel.heartbeat(bot, interval))
+    try:
+        await bot.start(updates=channel.updates())
+    finally:
+        heartbeat.cancel()
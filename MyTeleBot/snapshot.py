@@ -0,0 +1,228 @@
+"""
+Warm-restart snapshots: hot caches written at shutdown to a memory-mapped binary file and restored lazily
+"""
+
+import hashlib
+import itertools
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# File layout, all little-endian:
+#   header     magic, format version, reserved, section count, written at (unix time)
+#   directory  one record per section: name, index offset, data offset, entry count
+#   sections   an index of fixed-size entries sorted by key, then the values they point into
+# Values are compact JSON. Readers reject any other magic or version, so a format
+# change only needs VERSION bumped; an old snapshot is then ignored, never misread.
+MAGIC = b"SIEGESNP"
+VERSION = 1
+_HEADER = struct.Struct("<8sHHId")
+_SECTION = struct.Struct("<16sQQI")
+_ENTRY = struct.Struct("<qII")   # key, value offset within the section's data, value length
+
+
+def key_hash(key) -> int:
+    """Signed 64-bit snapshot key for a non-integer key (a tuple of strings and ints)."""
+    digest = hashlib.blake2b(json.dumps(key, separators=(",", ":")).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little", signed=True)
+
+
+def encode(value) -> bytes:
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+class SnapshotSection:
+    """Read-only view of one section, searched in place in the mapped file.
+
+    Each entry can be taken once: a component restores it on its first
+    miss and owns it from then on, so an entry changed or evicted since is
+    never resurrected from the snapshot.
+    """
+
+    def __init__(self, buffer, name: str, index_offset: int, data_offset: int, count: int):
+        self._buffer = buffer
+        self.name = name
+        self._index_offset = index_offset
+        self._data_offset = data_offset
+        self.count = count
+        self.taken: Set[int] = set()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _entry(self, position: int) -> Tuple[int, int, int]:
+        return _ENTRY.unpack_from(self._buffer, self._index_offset + position * _ENTRY.size)
+
+    def _value(self, offset: int, length: int) -> bytes:
+        start = self._data_offset + offset
+        return self._buffer[start:start + length]
+
+    def take(self, key: int):
+        """Decoded value stored under `key`, or None if absent or already taken."""
+        if key in self.taken:
+            return None
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._entry(middle)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low == self.count:
+            return None
+        found, offset, length = self._entry(low)
+        if found != key:
+            return None
+        self.taken.add(key)
+        return self._decode(key, self._value(offset, length))
+
+    def take_all(self) -> Iterator[Tuple[int, object]]:
+        """Every entry not yet taken, decoded, marking each taken."""
+        for position in range(self.count):
+            key, offset, length = self._entry(position)
+            if key not in self.taken:
+                self.taken.add(key)
+                value = self._decode(key, self._value(offset, length))
+                if value is not None:
+                    yield key, value
+
+    def _decode(self, key: int, raw: bytes):
+        try:
+            return json.loads(raw)
+        except ValueError:
+            logger.warning(f"Corrupt snapshot entry {key} in section {self.name}")
+            return None
+
+    def untaken(self) -> Iterator[Tuple[int, bytes]]:
+        """Raw entries nobody asked for, to carry over into the next snapshot unchanged."""
+        for position in range(self.count):
+            key, offset, length = self._entry(position)
+            if key not in self.taken:
+                yield key, self._value(offset, length)
+
+
+class Snapshot:
+    """A snapshot file mapped into memory; only the directory is read up front."""
+
+    def __init__(self, path: str, buffer: mmap.mmap, written_at: float, sections: Dict[str, SnapshotSection]):
+        self.path = path
+        self._buffer = buffer
+        self.written_at = written_at
+        self.sections = sections
+
+    @classmethod
+    def open(cls, path: str, max_age: Optional[float] = None) -> Optional["Snapshot"]:
+        """
+        Map a snapshot file
+
+        Args:
+            path: Snapshot file
+            max_age: Ignore snapshots written more than this many seconds ago
+
+        Returns:
+            The snapshot, or None if there is none or it is unreadable, stale or another version
+        """
+        try:
+            with open(path, "rb") as f:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable snapshot {path}: {e}")
+            return None
+        try:
+            magic, version, _, section_count, written_at = _HEADER.unpack_from(buffer, 0)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"format {magic!r} v{version}, expected {MAGIC!r} v{VERSION}")
+            if max_age is not None and time.time() - written_at > max_age:
+                raise ValueError(f"written {time.time() - written_at:.0f}s ago")
+            sections = {}
+            for number in range(section_count):
+                name, index_offset, data_offset, count = _SECTION.unpack_from(
+                    buffer, _HEADER.size + number * _SECTION.size
+                )
+                if index_offset + count * _ENTRY.size > len(buffer) or data_offset > len(buffer):
+                    raise ValueError("truncated file")
+                name = name.rstrip(b"\0").decode()
+                sections[name] = SnapshotSection(buffer, name, index_offset, data_offset, count)
+        except (struct.error, ValueError, UnicodeDecodeError) as e:
+            logger.warning(f"Ignoring snapshot {path}: {e}")
+            buffer.close()
+            return None
+        return cls(path, buffer, written_at, sections)
+
+    def section(self, name: str) -> Optional[SnapshotSection]:
+        return self.sections.get(name)
+
+    def close(self):
+        self._buffer.close()
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "age_s": round(time.time() - self.written_at),
+            "sections": {name: {"entries": len(s), "restored": len(s.taken)} for name, s in self.sections.items()},
+        }
+
+
+def merge(live: Iterable[Tuple[int, object]], previous: Optional[SnapshotSection], limit: Optional[int] = None) -> Iterator[Tuple[int, bytes]]:
+    """
+    Entries for a new section: live ones first, then what the old snapshot still holds untouched
+
+    Args:
+        live: (key, value) pairs from the running component, most valuable first
+        previous: The same section of the snapshot loaded at boot, if any
+        limit: Most entries to keep (None keeps all)
+    """
+    items = ((key, encode(value)) for key, value in live)
+    if previous is not None:
+        items = itertools.chain(items, previous.untaken())
+    return itertools.islice(items, limit)
+
+
+def write_snapshot(path: str, sections: Dict[str, Iterable[Tuple[int, bytes]]]) -> int:
+    """
+    Write a snapshot atomically (temporary file, fsync, rename)
+
+    Args:
+        path: Destination file
+        sections: Section name -> (key, encoded value) pairs; the first value for a key wins
+
+    Returns:
+        File size in bytes
+    """
+    built: List[Tuple[bytes, List[Tuple[int, int, int]], bytes]] = []
+    for name, items in sections.items():
+        values: Dict[int, bytes] = {}
+        for key, value in items:
+            values.setdefault(key, value)
+        entries, data, offset = [], [], 0
+        for key in sorted(values):
+            value = values[key]
+            entries.append((key, offset, len(value)))
+            data.append(value)
+            offset += len(value)
+        built.append((name.encode()[:16], entries, b"".join(data)))
+
+    offset = _HEADER.size + len(built) * _SECTION.size
+    directory, blocks = [], []
+    for name, entries, data in built:
+        index = b"".join(_ENTRY.pack(*entry) for entry in entries)
+        directory.append(_SECTION.pack(name, offset, offset + len(index), len(entries)))
+        blocks += [index, data]
+        offset += len(index) + len(data)
+
+    temporary = f"{path}.tmp"
+    with open(temporary, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, 0, len(built), time.time()))
+        f.write(b"".join(directory))
+        f.write(b"".join(blocks))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+    return offset
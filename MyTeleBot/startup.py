@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Cold-start timing: process start to imports done, bot ready and first update handled
+
+The bot records each milestone once, as seconds since the OS started the
+process, and logs them when the first update has been handled. The same
+module checks the import-time budget in a fresh interpreter, failing when
+importing the bot is too slow or pulls in a module that should load lazily:
+
+    python startup.py check --budget 700
+    python startup.py check --module main --runs 5
+"""
+
+import argparse
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+_IMPORTED_AT = time.monotonic()
+
+# Loaded on first use; importing the bot must not pull them in
+DEFERRED_MODULES = ("cohere", "wikipedia", "bs4", "requests", "tokenizers")
+
+
+def process_age() -> float:
+    """Seconds since the process started, from /proc on Linux, else since this module was imported."""
+    try:
+        with open("/proc/self/stat") as f:
+            # Fields after the command name, which may itself contain spaces; starttime is field 22
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return uptime - int(fields[19]) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return time.monotonic() - _IMPORTED_AT
+
+
+class StartupTimer:
+    """Cold-start milestones, each recorded once."""
+
+    def __init__(self):
+        self.marks: Dict[str, float] = {}
+
+    def mark(self, name: str):
+        if name not in self.marks:
+            self.marks[name] = round(process_age(), 3)
+
+    def first_update(self):
+        """Mark the first handled update and log the whole cold start."""
+        if "first_update" not in self.marks:
+            self.mark("first_update")
+            logger.info(f"Cold start: {self.format()}")
+
+    def format(self) -> str:
+        return ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.marks.items())
+
+
+# Process-wide, like metrics.REGISTRY
+STARTUP = StartupTimer()
+
+
+def measure_import(module: str) -> Tuple[float, List[str], List[Tuple[float, str]]]:
+    """
+    Import a module in a fresh interpreter
+
+    Returns:
+        Seconds the import took, deferred modules it loaded anyway, and the
+        heaviest top-level imports as (seconds, name)
+    """
+    code = (
+        "import sys, time\n"
+        "started = time.perf_counter()\n"
+        f"import {module}\n"
+        "print(time.perf_counter() - started)\n"
+        f"print(','.join(name for name in {DEFERRED_MODULES!r} if name in sys.modules))\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    seconds, loaded = result.stdout.splitlines()[-2:]
+    heaviest = []
+    for line in result.stderr.splitlines():
+        # "import time: self [us] | cumulative | name", children listed before their parent and
+        # indented two more spaces; collect the direct children of `module`
+        parts = line.split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth == 0:
+            if name.strip() == module:
+                break
+            heaviest = []
+        elif depth == 1:
+            heaviest.append((int(parts[1]) / 1e6, name.strip()))
+    heaviest.sort(reverse=True)
+    return float(seconds), [name for name in loaded.split(",") if name], heaviest[:8]
+
+
+def check(module: str, budget: float, runs: int) -> List[str]:
+    """
+    Compare the median import time of `module` against `budget` seconds
+
+    Returns:
+        Failure messages, empty when within budget
+    """
+    samples = []
+    for _ in range(runs):
+        seconds, loaded, heaviest = measure_import(module)
+        samples.append(seconds)
+    median = statistics.median(samples)
+    print(f"import {module}: median {median * 1000:.0f} ms over {runs} runs (budget {budget * 1000:.0f} ms)")
+    for seconds, name in heaviest:
+        print(f"  {seconds * 1000:7.1f} ms  {name}")
+    failures = []
+    if median > budget:
+        failures.append(f"import {module} took {median * 1000:.0f} ms, over the {budget * 1000:.0f} ms budget")
+    if loaded:
+        failures.append(f"import {module} loaded deferred modules: {', '.join(loaded)}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time budget check")
+    parser.add_argument("command", choices=["check"])
+    parser.add_argument("--module", default="bot", help="Module to import")
+    parser.add_argument("--budget", type=float, default=float(os.getenv("IMPORT_BUDGET_MS", "700")),
+                        help="Milliseconds allowed for the median import (default IMPORT_BUDGET_MS or 700)")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+    failures = check(args.module, args.budget / 1000, args.runs)
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+"""
+User and chat state with an optional SQLite backend using write-behind batching
+"""
+
+import asyncio
+import json
+import logging
+import sys
+import time
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Applied in order; PRAGMA user_version records how many have run.
+# Only ever append new entries, never edit shipped ones.
+MIGRATIONS = [
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT NOT NULL,
+        is_admin INTEGER NOT NULL DEFAULT 0,
+        history TEXT NOT NULL DEFAULT '[]',
+        updated_at REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS chat_admins (
+        chat_id INTEGER PRIMARY KEY,
+        admin_ids TEXT NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    """,
+]
+
+
+class UserRecord:
+    """One tracked user.
+
+    History is a ring buffer: the first message allocates a list of
+    exactly `history_size` slots, and from then on each message overwrites
+    the oldest slot in place, so appending never allocates again.
+    Usernames are interned since the same names repeat across records and
+    updates; message text is stored as given.
+    """
+
+    __slots__ = ("username", "is_admin", "last_seen", "_ring", "_head")
+
+    def __init__(self, username: str, is_admin: bool = False, history: Sequence[str] = (), history_size: int = 10):
+        self.username = sys.intern(username)
+        self.is_admin = is_admin
+        self.last_seen = time.monotonic()
+        self._ring: Optional[List[Optional[str]]] = None
+        self._head = 0   # next slot to write, which holds the oldest message once the ring is full
+        for message in history[len(history) - history_size:]:
+            self.append(message, history_size)
+
+    @property
+    def history(self) -> List[str]:
+        """Messages oldest first."""
+        ring = self._ring
+        if ring is None:
+            return []
+        # Slots not yet written are None and sit after the head until the ring fills
+        return [message for message in ring[self._head:] + ring[:self._head] if message is not None]
+
+    def append(self, message: str, history_size: int = 10) -> int:
+        """
+        Add a message, overwriting the oldest once the buffer is full
+
+        Returns:
+            Change in nbytes()
+        """
+        ring = self._ring
+        delta = sys.getsizeof(message)
+        if ring is None:
+            if history_size <= 0:
+                return 0
+            self._ring = ring = [None] * history_size
+            delta += sys.getsizeof(ring)
+        oldest = ring[self._head]
+        if oldest is not None:
+            delta -= sys.getsizeof(oldest)
+        ring[self._head] = message
+        self._head = (self._head + 1) % len(ring)
+        return delta
+
+    def nbytes(self) -> int:
+        """Approximate memory held by this record (the interned username is shared, so not counted)."""
+        size = sys.getsizeof(self)
+        if self._ring is not None:
+            size += sys.getsizeof(self._ring)
+            size += sum(sys.getsizeof(message) for message in self._ring if message is not None)
+        return size
+
+
+class StateStore:
+    """In-memory user state; the base class persists nothing.
+
+    `users` is an LRU of UserRecords for active users, bounded by
+    `max_users`, by `max_bytes` of approximate record memory, and by
+    `idle_ttl` seconds since a user was last seen. Mutations are
+    synchronous so they stay off the I/O path; subclasses persist them via
+    _mark_dirty.
+    """
+
+    def __init__(self, max_users: int = 10000, history_size: int = 10,
+                 max_bytes: Optional[int] = None, idle_ttl: Optional[float] = None):
+        self.max_users = max_users
+        self.history_size = history_size
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self.users: "OrderedDict[int, UserRecord]" = OrderedDict()
+        self.memory_bytes = 0
+        self.evictions = 0
+        # Users from the last shutdown's snapshot, restored on first access (in-memory store only)
+        self.snapshot = None
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def load_user(self, user_id: int) -> Optional[UserRecord]:
+        """Return the user's record, loading it into memory if it is only on disk."""
+        record = self.users.get(user_id)
+        if record is not None:
+            record.last_seen = time.monotonic()
+            self.users.move_to_end(user_id)
+        elif self.snapshot is not None:
+            saved = self.snapshot.take(user_id)
+            if saved is not None:
+                username, is_admin, history = saved
+                record = UserRecord(username, bool(is_admin), history, self.history_size)
+                self._cache(user_id, record)
+        return record
+
+    def remember_user(self, user_id: int, username: str, is_admin: bool = False) -> UserRecord:
+        record = self.users.get(user_id)
+        if record is None:
+            record = UserRecord(username, is_admin)
+            self._cache(user_id, record)
+            self._mark_dirty(user_id, record)
+        else:
+            record.last_seen = time.monotonic()
+            self.users.move_to_end(user_id)
+            if record.is_admin != is_admin or record.username != username:
+                record.is_admin = is_admin
+                record.username = sys.intern(username)
+                self._mark_dirty(user_id, record)
+        return record
+
+    def append_history(self, user_id: int, message: str):
+        record = self.users[user_id]
+        self.memory_bytes += record.append(message, self.history_size)
+        self._mark_dirty(user_id, record)
+        if self.max_bytes is not None and self.memory_bytes > self.max_bytes:
+            self._evict()
+
+    def save_chat_admins(self, chat_id: int, admin_ids: Set[int]):
+        pass
+
+    async def load_chat_admins(self) -> Dict[int, Set[int]]:
+        return {}
+
+    def _cache(self, user_id: int, record: UserRecord):
+        previous = self.users.pop(user_id, None)
+        if previous is not None:
+            self.memory_bytes -= previous.nbytes()
+        self.users[user_id] = record
+        self.memory_bytes += record.nbytes()
+        self._evict()
+
+    def _evict(self):
+        """Drop least recently used records until every bound holds; never the newest one."""
+        users = self.users
+        cutoff = time.monotonic() - self.idle_ttl if self.idle_ttl else None
+        while len(users) > 1:
+            oldest = users[next(iter(users))]
+            if not (len(users) > self.max_users
+                    or (self.max_bytes is not None and self.memory_bytes > self.max_bytes)
+                    or (cutoff is not None and oldest.last_seen < cutoff)):
+                break
+            _, record = users.popitem(last=False)
+            self.memory_bytes -= record.nbytes()
+            self.evictions += 1
+
+    def _mark_dirty(self, user_id: int, record: UserRecord):
+        pass
+
+    def snapshot_items(self) -> Iterator[Tuple[int, list]]:
+        """(user_id, [username, is_admin, history]) for every cached user, most recently seen first."""
+        for user_id in reversed(self.users):
+            record = self.users[user_id]
+            yield user_id, [record.username, int(record.is_admin), record.history]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "cached_users": len(self.users),
+            "memory_bytes": self.memory_bytes,
+            "evictions": self.evictions,
+        }
+
+
+class SQLiteStateStore(StateStore):
+    """StateStore persisted to SQLite through aiosqlite.
+
+    Changed records are queued and written in one transaction every
+    `flush_interval` seconds, or sooner once `flush_batch` are pending. A
+    record evicted from memory before its flush is still written, because
+    the queue holds a reference to it.
+    """
+
+    def __init__(self, path: str, max_users: int = 10000, history_size: int = 10,
+                 max_bytes: Optional[int] = None, idle_ttl: Optional[float] = None,
+                 flush_interval: float = 2.0, flush_batch: int = 500):
+        super().__init__(max_users, history_size, max_bytes, idle_ttl)
+        self.path = path
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self._db = None
+        self._dirty_users: Dict[int, UserRecord] = {}
+        self._dirty_admins: Dict[int, Set[int]] = {}
+        self._flush_wanted = asyncio.Event()
+        self._flusher: Optional[asyncio.Task] = None
+        self._closing = False
+        self.flushes = 0
+        self.rows_written = 0
+        self.disk_loads = 0
+
+    async def start(self):
+        import aiosqlite
+
+        self._db = await aiosqlite.connect(self.path)
+        await self._db.execute("PRAGMA journal_mode=WAL")
+        await self._db.execute("PRAGMA synchronous=NORMAL")
+        await self._migrate()
+        self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def _migrate(self):
+        async with self._db.execute("PRAGMA user_version") as cursor:
+            (version,) = await cursor.fetchone()
+        for number, script in enumerate(MIGRATIONS[version:], start=version + 1):
+            logger.info(f"Applying state schema migration {number}")
+            await self._db.executescript(f"BEGIN;\n{script}\nPRAGMA user_version = {number};\nCOMMIT;")
+
+    async def close(self):
+        if self._flusher is not None:
+            # Let the loop finish its current flush rather than cancelling it mid-transaction
+            self._closing = True
+            self._flush_wanted.set()
+            await self._flusher
+            self._flusher = None
+        if self._db is not None:
+            await self.flush()
+            await self._db.close()
+            self._db = None
+
+    async def load_user(self, user_id: int) -> Optional[UserRecord]:
+        record = await super().load_user(user_id)
+        if record is not None or self._db is None:
+            return record
+        record = self._dirty_users.get(user_id)
+        if record is None:
+            async with self._db.execute(
+                "SELECT username, is_admin, history FROM users WHERE user_id = ?", (user_id,)
+            ) as cursor:
+                row = await cursor.fetchone()
+            if row is None:
+                return None
+            self.disk_loads += 1
+            record = UserRecord(row[0], bool(row[1]), json.loads(row[2]), self.history_size)
+        # Another message may have created the user while we were reading
+        existing = self.users.get(user_id)
+        if existing is not None:
+            return existing
+        record.last_seen = time.monotonic()
+        self._cache(user_id, record)
+        return record
+
+    def save_chat_admins(self, chat_id: int, admin_ids: Set[int]):
+        self._dirty_admins[chat_id] = set(admin_ids)
+        self._wake()
+
+    async def load_chat_admins(self) -> Dict[int, Set[int]]:
+        async with self._db.execute("SELECT chat_id, admin_ids FROM chat_admins") as cursor:
+            return {chat_id: set(json.loads(admin_ids)) async for chat_id, admin_ids in cursor}
+
+    def _mark_dirty(self, user_id: int, record: UserRecord):
+        self._dirty_users[user_id] = record
+        self._wake()
+
+    def _wake(self):
+        if len(self._dirty_users) + len(self._dirty_admins) >= self.flush_batch:
+            self._flush_wanted.set()
+
+    async def _flush_loop(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._flush_wanted.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_wanted.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"State flush failed, will retry: {e}")
+
+    async def flush(self):
+        """Write every queued change in a single transaction."""
+        if self._db is None or not (self._dirty_users or self._dirty_admins):
+            return
+        users, self._dirty_users = self._dirty_users, {}
+        admins, self._dirty_admins = self._dirty_admins, {}
+        now = time.time()
+        try:
+            await self._db.executemany(
+                "INSERT INTO users (user_id, username, is_admin, history, updated_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET username = excluded.username, is_admin = excluded.is_admin, "
+                "history = excluded.history, updated_at = excluded.updated_at",
+                [
+                    (user_id, record.username, int(record.is_admin), json.dumps(record.history), now)
+                    for user_id, record in users.items()
+                ],
+            )
+            await self._db.executemany(
+                "INSERT INTO chat_admins (chat_id, admin_ids, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(chat_id) DO UPDATE SET admin_ids = excluded.admin_ids, updated_at = excluded.updated_at",
+                [(chat_id, json.dumps(sorted(ids)), now) for chat_id, ids in admins.items()],
+            )
+            await self._db.commit()
+        except Exception:
+            # Put the batch back without clobbering newer changes queued meanwhile
+            await self._db.rollback()
+            self._dirty_users = {**users, **self._dirty_users}
+            self._dirty_admins = {**admins, **self._dirty_admins}
+            raise
+        self.flushes += 1
+        self.rows_written += len(users) + len(admins)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            **super().stats(),
+            "pending_writes": len(self._dirty_users) + len(self._dirty_admins),
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+            "disk_loads": self.disk_loads,
+        }
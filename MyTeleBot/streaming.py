@@ -0,0 +1,100 @@
+"""
+Progressive Telegram replies driven by a streamed LLM generation
+"""
+
+import logging
+import time
+from typing import AsyncIterator, Callable, Optional
+
+from telegram import Message
+from telegram.error import BadRequest
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_MAX_MESSAGE_LENGTH = 4096
+CURSOR = " ▌"
+
+
+class StreamingReply:
+    """Sends a first partial reply early and coalesces the rest into edits.
+
+    The first message goes out once `first_chunk_chars` characters have
+    arrived; after that the text is edited at most once per `edit_interval`
+    seconds. The final text is passed through `finalize` (normally
+    SiegePersonality.post_process_response) before the last edit; the
+    unprocessed text is left in `text`.
+    """
+
+    def __init__(
+        self,
+        message: Message,
+        finalize: Callable[[str], str],
+        first_chunk_chars: int = 40,
+        edit_interval: float = 1.0,
+    ):
+        self.message = message
+        self.finalize = finalize
+        self.first_chunk_chars = first_chunk_chars
+        self.edit_interval = edit_interval
+        self.sent: Optional[Message] = None
+        self.sent_text = ""
+        self.text = ""
+        self.first_byte_at: Optional[float] = None
+        self.edits = 0
+        self._last_edit = 0.0
+
+    async def run(self, chunks: AsyncIterator[str]) -> str:
+        """
+        Consume a chunk stream and deliver it as one progressively edited message
+
+        Args:
+            chunks: Async iterator of generated text fragments
+
+        Returns:
+            The final, post-processed text that was delivered
+        """
+        text = ""
+        try:
+            async for chunk in chunks:
+                text += chunk
+                stripped = text.strip()
+                if self.sent is None:
+                    if len(stripped) >= self.first_chunk_chars:
+                        await self._send(stripped + CURSOR)
+                elif time.monotonic() - self._last_edit >= self.edit_interval:
+                    await self._edit(stripped + CURSOR)
+        except Exception:
+            # Whatever arrived counts as the output, even though the stream failed
+            self.text = text.strip()
+            # Don't leave a dangling cursor on a half-finished message
+            if self.sent is not None:
+                await self._edit(self.finalize(self.text))
+            raise
+
+        self.text = text.strip()
+        final_text = self.finalize(self.text)
+        if self.sent is None:
+            await self._send(final_text)
+        else:
+            await self._edit(final_text)
+        return final_text
+
+    async def _send(self, text: str):
+        text = text[:TELEGRAM_MAX_MESSAGE_LENGTH]
+        self.sent = await self.message.reply_text(text)
+        self.sent_text = text
+        self.first_byte_at = self._last_edit = time.monotonic()
+
+    async def _edit(self, text: str):
+        text = text[:TELEGRAM_MAX_MESSAGE_LENGTH]
+        if text == self.sent_text:
+            return
+        try:
+            await self.sent.edit_text(text)
+        except BadRequest as e:
+            # "Message is not modified" and similar are harmless here
+            logger.debug(f"Skipped streaming edit: {e}")
+            return
+        self.sent_text = text
+        self.edits += 1
+        self._last_edit = time.monotonic()
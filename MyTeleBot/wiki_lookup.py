@@ -0,0 +1,393 @@
+"""
+Async Wikipedia lookups with in-memory and on-disk caching and an optional offline backend
+
+The offline backend is a SQLite FTS5 index built from an article dump in
+JSON-lines form (one {"title": ..., "text": ...} object per line, which is
+what `wikiextractor --json` emits):
+
+    python wiki_lookup.py build enwiki.jsonl wiki_offline.sqlite
+    python wiki_lookup.py query wiki_offline.sqlite "Napoleon"
+"""
+
+import asyncio
+import json
+import logging
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_FILLER = re.compile(r"\b(?:what\s+is|what\s+was|who\s+is|who\s+was|tell\s+me\s+about|explain)\b", re.IGNORECASE)
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+_FTS_TOKEN = re.compile(r"\w+")
+
+_MISSING = object()
+
+Result = Tuple[Optional[str], Tuple[str, ...]]   # (summary, disambiguation options)
+
+
+def normalize_query(query: str) -> str:
+    query = _FILLER.sub(" ", query)
+    return " ".join(query.strip(" ?!.").lower().split())
+
+
+def truncate_summary(text: str, max_chars: int = 150) -> str:
+    return text[:max_chars] + "..." if len(text) > max_chars else text
+
+
+class LRUCache:
+    """Small OrderedDict-backed LRU with per-entry expiry."""
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[str, Tuple[object, float]]" = OrderedDict()
+
+    def get(self, key: str, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        value, expires_at = entry
+        if expires_at < time.time():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def put(self, key: str, value, ttl: float):
+        self._data[key] = (value, time.time() + ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class DiskCache:
+    """SQLite-backed lookup cache that survives restarts.
+
+    A NULL summary is a cached negative result. Disambiguation option lists
+    are stored alongside as JSON, so an ambiguous query is answered from
+    the cache as fully as from the network.
+    """
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS wiki_cache ("
+            "query TEXT PRIMARY KEY, summary TEXT, options TEXT, expires_at REAL NOT NULL)"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(wiki_cache)")}
+        if "options" not in columns:
+            self._conn.execute("ALTER TABLE wiki_cache ADD COLUMN options TEXT")
+        self._conn.commit()
+
+    def get(self, query: str):
+        """The cached (summary, options), or _MISSING if absent or expired."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT summary, options, expires_at FROM wiki_cache WHERE query = ?", (query,)
+            ).fetchone()
+        if row is None or row[2] < time.time():
+            return _MISSING
+        return row[0], tuple(json.loads(row[1])) if row[1] else ()
+
+    def put(self, query: str, result: Result, ttl: float):
+        summary, options = result
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO wiki_cache (query, summary, options, expires_at) VALUES (?, ?, ?, ?)",
+                (query, summary, json.dumps(options) if options else None, time.time() + ttl),
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class _TimeoutSession:
+    """Stands in for `requests` inside the `wikipedia` package, which never passes a timeout."""
+
+    def __init__(self, timeout: float):
+        import requests
+
+        self.timeout = timeout
+        self._session = requests.Session()
+
+    def get(self, url: str, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return self._session.get(url, **kwargs)
+
+
+class NetworkBackend:
+    """Wraps the blocking `wikipedia` package; call from a worker thread.
+
+    Every HTTP request gets `http_timeout` seconds (connect and read), so
+    a hung request frees its thread instead of holding it indefinitely.
+    """
+
+    def __init__(self, http_timeout: float = 10.0):
+        self.http_timeout = http_timeout
+        self._installed = False
+
+    def _install(self):
+        import wikipedia
+
+        # The package calls the module-level requests.get; route it through a session with a timeout
+        wikipedia.wikipedia.requests = _TimeoutSession(self.http_timeout)
+        self._installed = True
+
+    def lookup(self, query: str) -> Tuple[Optional[str], List[str]]:
+        """
+        Fetch a one-sentence summary
+
+        Returns:
+            (summary or None if there is no such page, disambiguation options)
+
+        Raises:
+            Exception: On network or API failures, which must not be negatively cached
+        """
+        import wikipedia
+
+        if not self._installed:
+            self._install()
+        try:
+            return wikipedia.summary(query, sentences=1, auto_suggest=True, redirect=True), []
+        except wikipedia.exceptions.DisambiguationError as e:
+            options = list(e.options[:10])
+            if not options:
+                return None, []
+            try:
+                return wikipedia.summary(options[0], sentences=1, auto_suggest=False), options
+            except (wikipedia.exceptions.DisambiguationError, wikipedia.exceptions.PageError):
+                return None, options
+        except wikipedia.exceptions.PageError:
+            return None, []
+
+
+class OfflineBackend:
+    """Serves summaries from a local SQLite FTS5 index built by build_offline_index."""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+
+    def lookup(self, query: str) -> Tuple[Optional[str], List[str]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT summary FROM articles WHERE title_key = ?", (query,)
+            ).fetchone()
+            if row:
+                return row[0], []
+            terms = _FTS_TOKEN.findall(query)
+            if not terms:
+                return None, []
+            match = " ".join(f'"{term}"' for term in terms)
+            rows = self._conn.execute(
+                "SELECT a.title, a.summary FROM articles_fts f JOIN articles a ON a.rowid = f.rowid "
+                "WHERE articles_fts MATCH ? ORDER BY bm25(articles_fts, 10.0, 1.0) LIMIT 5",
+                (match,),
+            ).fetchall()
+        if not rows:
+            return None, []
+        return rows[0][1], [title for title, _ in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def build_offline_index(dump_path: str, db_path: str, batch_size: int = 5000) -> int:
+    """
+    Build the offline FTS index from a JSON-lines article dump
+
+    Args:
+        dump_path: File with one {"title": ..., "text": ...} object per line
+        db_path: SQLite file to (re)create
+
+    Returns:
+        Number of articles indexed
+    """
+    conn = sqlite3.connect(db_path)
+    conn.executescript(
+        "DROP TABLE IF EXISTS articles_fts; DROP TABLE IF EXISTS articles;"
+        "CREATE TABLE articles (rowid INTEGER PRIMARY KEY, title TEXT NOT NULL,"
+        " title_key TEXT NOT NULL, summary TEXT NOT NULL);"
+        "CREATE INDEX articles_title_key ON articles (title_key);"
+        "CREATE VIRTUAL TABLE articles_fts USING fts5(title, body, content='', tokenize='porter unicode61');"
+    )
+    count = 0
+    batch = []
+
+    def flush():
+        conn.executemany(
+            "INSERT INTO articles (rowid, title, title_key, summary) VALUES (?, ?, ?, ?)",
+            [(rowid, title, key, summary) for rowid, title, key, summary, _ in batch],
+        )
+        conn.executemany(
+            "INSERT INTO articles_fts (rowid, title, body) VALUES (?, ?, ?)",
+            [(rowid, title, body) for rowid, title, _, _, body in batch],
+        )
+        batch.clear()
+
+    with open(dump_path, encoding="utf-8") as dump:
+        for line in dump:
+            line = line.strip()
+            if not line:
+                continue
+            article = json.loads(line)
+            title = article.get("title", "").strip()
+            text = " ".join(article.get("text", "").split())
+            if not title or not text:
+                continue
+            count += 1
+            summary = _SENTENCE_END.split(text, 1)[0]
+            # Only the lead section is indexed; it is what summaries come from
+            batch.append((count, title, normalize_query(title), summary, text[:2000]))
+            if len(batch) >= batch_size:
+                flush()
+    if batch:
+        flush()
+    conn.commit()
+    conn.execute("INSERT INTO articles_fts (articles_fts) VALUES ('optimize')")
+    conn.commit()
+    conn.close()
+    return count
+
+
+class WikiLookup:
+    """Async, cached front end over the offline and/or network backends.
+
+    Results (including "no such page" and disambiguation options) are
+    cached in an LRU and, if a path is given, on disk. Concurrent lookups
+    for the same query share one backend call. A lookup that exceeds the
+    timeout budget returns None but is left running so its result still
+    lands in the cache. Backends run on their own `workers` threads, so
+    slow lookups never hold up the default executor that the tokenizer
+    load, snapshot writes and the disk cache use.
+    """
+
+    def __init__(self, cache_path: Optional[str] = None, offline_path: Optional[str] = None,
+                 network: bool = True, timeout: float = 3.0, ttl: float = 7 * 86400,
+                 negative_ttl: float = 3600, memory_size: int = 2048, max_chars: int = 150,
+                 http_timeout: float = 10.0, workers: int = 2):
+        self.memory = LRUCache(memory_size)
+        self.disk = DiskCache(cache_path) if cache_path else None
+        self.backends = []
+        if offline_path:
+            self.backends.append(OfflineBackend(offline_path))
+        if network:
+            self.backends.append(NetworkBackend(http_timeout))
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="wiki")
+        self.timeout = timeout
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_chars = max_chars
+        self._inflight = {}
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "negatives": 0, "timeouts": 0, "errors": 0}
+
+    async def summary(self, query: str) -> Optional[str]:
+        """
+        Look up a short summary for a query within the timeout budget
+
+        Args:
+            query: Free-form question or topic
+
+        Returns:
+            A truncated one-sentence summary, or None if unknown or out of budget
+        """
+        return (await self.lookup(query))[0]
+
+    async def lookup(self, query: str) -> Result:
+        """
+        Look up a summary and, for an ambiguous query, the pages it may refer to
+
+        Args:
+            query: Free-form question or topic
+
+        Returns:
+            (truncated summary or None, disambiguation options); (None, ()) if out of budget
+        """
+        key = normalize_query(query)
+        if not key:
+            return None, ()
+        cached = self.memory.get(key, _MISSING)
+        if cached is not _MISSING:
+            self.stats["memory_hits"] += 1
+            return cached
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._resolve(key))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        done, _ = await asyncio.wait({task}, timeout=self.timeout)
+        if not done:
+            self.stats["timeouts"] += 1
+            logger.warning(f"Wikipedia lookup exceeded {self.timeout}s budget for {key!r}")
+            return None, ()
+        return task.result()
+
+    async def _resolve(self, key: str) -> Result:
+        if self.disk is not None:
+            cached = await asyncio.to_thread(self.disk.get, key)
+            if cached is not _MISSING:
+                self.stats["disk_hits"] += 1
+                self.memory.put(key, cached, self.ttl if cached[0] or cached[1] else self.negative_ttl)
+                return cached
+
+        self.stats["misses"] += 1
+        loop = asyncio.get_running_loop()
+        summary, options, failed = None, [], False
+        for backend in self.backends:
+            try:
+                summary, options = await loop.run_in_executor(self._executor, backend.lookup, key)
+            except Exception as e:
+                self.stats["errors"] += 1
+                failed = True
+                logger.error(f"Wikipedia backend {type(backend).__name__} failed for {key!r}: {e}")
+                continue
+            if summary:
+                break
+
+        if not summary and failed:
+            # Transient failures are not cached so the next call retries
+            return None, ()
+        if summary:
+            summary = truncate_summary(summary, self.max_chars)
+        result = summary, tuple(options)
+        if summary or options:
+            ttl = self.ttl
+        else:
+            self.stats["negatives"] += 1
+            ttl = self.negative_ttl
+        self.memory.put(key, result, ttl)
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.put, key, result, ttl)
+        return result
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        for backend in self.backends:
+            if hasattr(backend, "close"):
+                backend.close()
+        if self.disk is not None:
+            self.disk.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "build":
+        print(f"Indexed {build_offline_index(sys.argv[2], sys.argv[3])} articles into {sys.argv[3]}")
+    elif len(sys.argv) == 4 and sys.argv[1] == "query":
+        lookup = WikiLookup(offline_path=sys.argv[2], network=False)
+        print(asyncio.run(lookup.summary(sys.argv[3])))
+    else:
+        print(__doc__)